@@ -16,6 +16,10 @@ class MockCourierAdapter:
     def __init__(self, delay_ms: int = 100):
         self.delay = delay_ms / 1000.0
 
+    def health_check(self) -> bool:
+        # nothing to reach: the mock is always available
+        return True
+
     def book_shipment(
         self, order_id: int, pickup_address: Dict = None, parcels: Dict = None
     ) -> Dict:
@@ -1,5 +1,7 @@
+import asyncio
 import random
 import time
+from abc import ABC, abstractmethod
 from typing import Dict, Optional
 from uuid import uuid4
 
@@ -74,24 +76,8 @@ class MockPaymentAdapter:
         # Simulate network latency / gateway processing
         time.sleep(self.delay_seconds)
 
-        # Simulate deterministic decline if requested by the test payload
-        if (
-            payment_method
-            and isinstance(payment_method, dict)
-            and payment_method.get("force_decline")
-        ):
-            raise PaymentDeclined("Simulated forced decline")
-
-        # Simulate a random transient failure (low probability)
-        if random.random() < 0.01:
-            raise PaymentTransientError("Simulated transient gateway error")
-
-        # --- 2. Simulate Success ---
-        txn = {
-            "transaction_id": f"mock-{uuid4().hex}",
-            "status": "captured",
-            "amount_cents": amount_cents,
-        }
+        # --- 2. Simulate the gateway's answer ---
+        txn = _gateway_result(amount_cents, payment_method)
 
         # --- 3. Store Idempotency partial result (payment_result) WITHOUT marking overall operation completed ---
         if idempotency_key:
@@ -113,8 +99,65 @@ class MockPaymentAdapter:
     def refund(self, transaction_id: str) -> Dict:
         """Simulates a refund."""
         time.sleep(self.delay_seconds)
-        return {
-            "refund_id": f"refund-{uuid4().hex}",
-            "status": "refunded",
-            "transaction_id": transaction_id,
-        }
+        return _refund_result(transaction_id)
+
+
+def _gateway_result(amount_cents: int, payment_method: Dict) -> Dict:
+    # Simulate deterministic decline if requested by the test payload
+    if (
+        payment_method
+        and isinstance(payment_method, dict)
+        and payment_method.get("force_decline")
+    ):
+        raise PaymentDeclined("Simulated forced decline")
+
+    # Simulate a random transient failure (low probability)
+    if random.random() < 0.01:
+        raise PaymentTransientError("Simulated transient gateway error")
+
+    return {
+        "transaction_id": f"mock-{uuid4().hex}",
+        "status": "captured",
+        "amount_cents": amount_cents,
+    }
+
+
+def _refund_result(transaction_id: str) -> Dict:
+    return {
+        "refund_id": f"refund-{uuid4().hex}",
+        "status": "refunded",
+        "transaction_id": transaction_id,
+    }
+
+
+class AsyncPaymentAdapter(ABC):
+    """
+    Gateway interface for async callers: charge/refund are awaited on the event
+    loop instead of blocking a threadpool slot for the gateway round trip.
+
+    Unlike MockPaymentAdapter it never touches the database; callers persist the
+    result (and handle idempotency) themselves, off the event loop.
+    """
+
+    @abstractmethod
+    async def charge(self, amount_cents: int, payment_method: Dict) -> Dict:
+        """Capture `amount_cents`; raises PaymentDeclined / PaymentTransientError."""
+
+    @abstractmethod
+    async def refund(self, transaction_id: str) -> Dict:
+        """Refund a captured transaction."""
+
+
+class AsyncMockPaymentAdapter(AsyncPaymentAdapter):
+    """MockPaymentAdapter's gateway behaviour with asyncio.sleep for latency."""
+
+    def __init__(self, delay_ms: int = 200):
+        self.delay_seconds = delay_ms / 1000.0
+
+    async def charge(self, amount_cents: int, payment_method: Dict) -> Dict:
+        await asyncio.sleep(self.delay_seconds)
+        return _gateway_result(amount_cents, payment_method)
+
+    async def refund(self, transaction_id: str) -> Dict:
+        await asyncio.sleep(self.delay_seconds)
+        return _refund_result(transaction_id)
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from app.adapters.mock_payment import (
+    AsyncPaymentAdapter,
+    PaymentDeclined,
+    PaymentTransientError,
+)
+from app.config import settings
+from app.utils.resilience import (
+    BulkheadFull,
+    CircuitOpen,
+    RetryPolicy,
+    get_breaker,
+    get_bulkhead,
+)
+from app.utils.tracing import tracer
+
+
+class PaymentUnavailable(PaymentTransientError):
+    """Refused without calling the gateway (breaker open or bulkhead full)."""
+
+
+def _policy() -> RetryPolicy:
+    return RetryPolicy(
+        attempts=settings.PAYMENT_RETRY_ATTEMPTS,
+        base_delay=settings.PAYMENT_RETRY_BASE_MS / 1000.0,
+        max_delay=settings.PAYMENT_RETRY_MAX_MS / 1000.0,
+    )
+
+
+def _guards(name: str):
+    return (
+        get_breaker(
+            name,
+            failure_threshold=settings.PAYMENT_BREAKER_FAILURES,
+            reset_timeout=settings.PAYMENT_BREAKER_RESET_SECONDS,
+        ),
+        get_bulkhead(name, max_concurrent=settings.PAYMENT_MAX_IN_FLIGHT),
+    )
+
+
+class ResilientPaymentAdapter:
+    """
+    Wraps a (sync) payment adapter with the resilience layer:
+
+    - bulkhead: at most PAYMENT_MAX_IN_FLIGHT charges in flight per adapter;
+      one more is refused immediately instead of tying up another worker;
+    - circuit breaker: consecutive transient failures open it and later
+      charges fail fast (PaymentUnavailable) until a probe succeeds;
+    - retry: transient errors are retried with exponential backoff and full
+      jitter, while the breaker allows it.
+
+    Declines are business answers from a healthy gateway: never retried and
+    counted as success by the breaker. Refunds go through the breaker only.
+    """
+
+    def __init__(
+        self, adapter, name: str = "payment", policy: Optional[RetryPolicy] = None
+    ):
+        self.adapter = adapter
+        self.name = name
+        self.policy = policy or _policy()
+        self.breaker, self.bulkhead = _guards(name)
+
+    def charge(
+        self,
+        db_session,
+        amount_cents: int,
+        payment_method: Dict,
+        idempotency_key: Optional[str] = None,
+    ) -> Dict:
+        try:
+            with self.bulkhead.slot():
+                for attempt in range(self.policy.attempts):
+                    if attempt:
+                        time.sleep(self.policy.backoff(attempt - 1))
+                    self.breaker.allow()
+                    try:
+                        with tracer.span("payment.charge", attempt=attempt + 1):
+                            txn = self.adapter.charge(
+                                db_session,
+                                amount_cents,
+                                payment_method,
+                                idempotency_key=idempotency_key,
+                            )
+                    except PaymentDeclined:
+                        self.breaker.record_success()
+                        raise
+                    except PaymentTransientError:
+                        self.breaker.record_failure()
+                        if attempt + 1 >= self.policy.attempts:
+                            raise
+                        continue
+                    except Exception:
+                        # unknown outcome: not retried, but the gateway is suspect
+                        self.breaker.record_failure()
+                        raise
+                    self.breaker.record_success()
+                    return txn
+        except (CircuitOpen, BulkheadFull) as e:
+            raise PaymentUnavailable(f"Payment gateway unavailable: {e}")
+
+    def refund(self, transaction_id: str) -> Dict:
+        try:
+            self.breaker.allow()
+        except CircuitOpen as e:
+            raise PaymentUnavailable(f"Payment gateway unavailable: {e}")
+        try:
+            result = self.adapter.refund(transaction_id)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def health_check(self) -> bool:
+        return self.breaker.state != "open"
+
+
+class AsyncResilientPaymentAdapter(AsyncPaymentAdapter):
+    """ResilientPaymentAdapter for AsyncPaymentAdapters; same breaker and bulkhead."""
+
+    def __init__(
+        self,
+        adapter: AsyncPaymentAdapter,
+        name: str = "payment",
+        policy: Optional[RetryPolicy] = None,
+    ):
+        self.adapter = adapter
+        self.name = name
+        self.policy = policy or _policy()
+        self.breaker, self.bulkhead = _guards(name)
+
+    async def charge(self, amount_cents: int, payment_method: Dict) -> Dict:
+        try:
+            with self.bulkhead.slot():
+                for attempt in range(self.policy.attempts):
+                    if attempt:
+                        await asyncio.sleep(self.policy.backoff(attempt - 1))
+                    self.breaker.allow()
+                    try:
+                        with tracer.span("payment.charge", attempt=attempt + 1):
+                            txn = await self.adapter.charge(
+                                amount_cents, payment_method
+                            )
+                    except PaymentDeclined:
+                        self.breaker.record_success()
+                        raise
+                    except PaymentTransientError:
+                        self.breaker.record_failure()
+                        if attempt + 1 >= self.policy.attempts:
+                            raise
+                        continue
+                    except Exception:
+                        # unknown outcome: not retried, but the gateway is suspect
+                        self.breaker.record_failure()
+                        raise
+                    self.breaker.record_success()
+                    return txn
+        except (CircuitOpen, BulkheadFull) as e:
+            raise PaymentUnavailable(f"Payment gateway unavailable: {e}")
+
+    async def refund(self, transaction_id: str) -> Dict:
+        try:
+            self.breaker.allow()
+        except CircuitOpen as e:
+            raise PaymentUnavailable(f"Payment gateway unavailable: {e}")
+        try:
+            result = await self.adapter.refund(transaction_id)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
@@ -3,8 +3,10 @@ from sqlalchemy import text
 
 from app.adapters.mock_courier import MockCourierAdapter
 from app.adapters.mock_payment import MockPaymentAdapter
+from app.adapters.resilient_payment import ResilientPaymentAdapter
 from app.db import SessionLocal, engine
 from app.repositories.idempotency_repo import IdempotencyRepository
+from app.utils import resilience
 
 router = APIRouter()
 
@@ -24,8 +26,10 @@ def health():
     try:
         # Instantiate the required repository
         idem_repo = IdempotencyRepository(db)
-        # Pass the required argument to the adapter
-        pay_adapter = MockPaymentAdapter(idempotency_repo=idem_repo)
+        # Pass the required argument to the adapter; the wrapper reports the breaker
+        pay_adapter = ResilientPaymentAdapter(
+            MockPaymentAdapter(idempotency_repo=idem_repo)
+        )
         payment_ok = pay_adapter.health_check()
         courier_adapter = MockCourierAdapter()
         courier_ok = courier_adapter.health_check()
@@ -40,4 +44,5 @@ def health():
         "db": db_ok,
         "payment_adapter": payment_ok,
         "courier_adapter": courier_ok,
+        "breakers": resilience.snapshot(),
     }
@@ -5,7 +5,16 @@ from sqlalchemy.orm import Session
 
 from app.db import get_db
 from app.models.packing_task import PackingTask
+from app.repositories.idempotency_repo import IdempotencyRepository
+from app.services.flash_sale import flash_sale
 from app.services.fulfilment_service import FulfilmentException, FulfilmentService
+from app.services.outbox import outbox_dispatcher
+from app.services.reservation_archive import (
+    ReservationArchiveException,
+    ReservationArchiveService,
+)
+from app.utils.lock_manager import get_lock_manager
+from app.utils.tracing import recent_traces, stage_histograms
 
 # from app.schemas import ( # if you have common schemas; otherwise return raw dicts)
 #     PackingTaskCreate, PackingTaskUpdate, PackingTaskOut
@@ -49,3 +58,90 @@ def pack_and_book(task_id: int, db: Session = Depends(get_db)):
     except Exception as e:
         # internal error
         raise HTTPException(status_code=500, detail="Internal error booking shipment")
+
+
+@router.get("/outbox", summary="Outbox events per status")
+def outbox_stats(db: Session = Depends(get_db)):
+    return outbox_dispatcher.stats(db)
+
+
+@router.post("/outbox/dispatch", summary="Deliver due outbox events now")
+def outbox_dispatch():
+    return {"delivered": len(outbox_dispatcher.run_pending())}
+
+
+@router.get("/locks", summary="Per-SKU reservation lock contention")
+def lock_stats(top: int = 20, sort: str = "wait_total"):
+    manager = get_lock_manager()
+    return {
+        "backend": manager.backend,
+        "keys": manager.stats.snapshot(top=top, sort=sort),
+    }
+
+
+@router.post(
+    "/reservations/archive",
+    summary="Move old terminal reservations out of the hot table",
+)
+def archive_reservations(
+    older_than_days: float = None,
+    max_batches: int = None,
+    db: Session = Depends(get_db),
+):
+    try:
+        return ReservationArchiveService(db).compact(
+            older_than_days=older_than_days, max_batches=max_batches
+        )
+    except ReservationArchiveException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post(
+    "/idempotency/purge",
+    summary="Delete idempotency records past their retention window",
+)
+def purge_idempotency(max_batches: int = None, db: Session = Depends(get_db)):
+    return IdempotencyRepository(db).purge_expired(max_batches=max_batches)
+
+
+@router.get("/flash-sale", summary="Flash-sale SKUs and group-commit queue stats")
+def flash_sale_stats():
+    return flash_sale.stats()
+
+
+@router.put(
+    "/flash-sale", summary="Set the SKUs whose reservations are group-committed"
+)
+def flash_sale_configure(payload: dict):
+    """
+    payload: { "skus": ["CHOC1234", ...] } — an empty list turns flash-sale mode off
+    """
+    skus = payload.get("skus")
+    if not isinstance(skus, list):
+        raise HTTPException(status_code=400, detail="skus must be a list")
+    flash_sale.configure(str(s) for s in skus)
+    return flash_sale.stats()
+
+
+@router.get(
+    "/tracing/stages", summary="Latency histograms per checkout stage (span name)"
+)
+def tracing_stages(prefix: str = None):
+    """
+    Aggregates every finished span since start (or the last reset) by name:
+    count, errors, mean/p50/p90/p99/max in ms and non-empty buckets (le_<ms>).
+    Percentiles are bucket upper bounds.
+    """
+    return stage_histograms.snapshot(prefix=prefix)
+
+
+@router.get("/tracing/traces", summary="Most recent traces with their spans")
+def tracing_traces(limit: int = 20, name: str = None):
+    return recent_traces.traces(limit=limit, name=name)
+
+
+@router.post("/tracing/reset", summary="Clear stage histograms and recent traces")
+def tracing_reset():
+    stage_histograms.reset()
+    recent_traces.reset()
+    return {"reset": True}
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from app.config import settings
 from app.db import get_db
 from app.services.inventory_service import InventoryException, InventoryService
+from app.services.stock_feed import stock_feed
 
 router = APIRouter(prefix="/api/inventory", tags=["inventory"])
 
@@ -29,6 +37,35 @@ def reserve(payload: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/reserve/batch")
+def reserve_batch(payload: dict, db: Session = Depends(get_db)):
+    """
+    payload: { "lines": [{"sku": "CHOC1234", "qty": 2}, ...], "ttl_seconds": 900 }
+    reserves every line atomically; returns one reservation per line, in order
+    """
+    lines = payload.get("lines") or []
+    ttl = payload.get("ttl_seconds")
+    svc = InventoryService(db)
+    try:
+        reservations = svc.reserve_many(
+            [{"sku": l.get("sku"), "qty": int(l.get("qty", 0))} for l in lines],
+            ttl_seconds=ttl,
+        )
+        return {
+            "reservations": [
+                {
+                    "reservation_id": r.id,
+                    "sku": r.sku,
+                    "qty": r.quantity,
+                    "reserved_until": r.reserved_until.isoformat(),
+                }
+                for r in reservations
+            ]
+        }
+    except InventoryException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.post("/release")
 def release(payload: dict, db: Session = Depends(get_db)):
     """
@@ -43,6 +80,40 @@ def release(payload: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/reservations/extend")
+def extend_batch(payload: dict, db: Session = Depends(get_db)):
+    """
+    payload: { "reservation_ids": [1, 2], "ttl_seconds": 900 }
+    extends every still-active reservation; the rest are listed in not_active
+    """
+    ids = payload.get("reservation_ids") or []
+    ttl = payload.get("ttl_seconds")
+    svc = InventoryService(db)
+    try:
+        extended, not_active = svc.extend_many(ids, ttl_seconds=ttl)
+    except (InventoryException, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"extended": extended, "not_active": not_active}
+
+
+@router.post("/reservations/{reservation_id}/extend")
+def extend(reservation_id: int, payload: dict = None, db: Session = Depends(get_db)):
+    """
+    payload: { "ttl_seconds": 900 } (optional) — hold for another ttl_seconds from now
+    """
+    ttl = (payload or {}).get("ttl_seconds")
+    svc = InventoryService(db)
+    try:
+        r = svc.extend(reservation_id, ttl_seconds=ttl)
+        return {
+            "reservation_id": r.id,
+            "status": r.status,
+            "reserved_until": r.reserved_until.isoformat(),
+        }
+    except (InventoryException, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.post("/commit")
 def commit(payload: dict, db: Session = Depends(get_db)):
     """
@@ -58,6 +129,40 @@ def commit(payload: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _bulk_available(skus: List[str], db: Session):
+    skus = [s.strip() for s in skus if s and s.strip()]
+    if not skus:
+        raise HTTPException(status_code=400, detail="No SKUs given")
+    if len(skus) > settings.AVAILABILITY_MAX_SKUS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many SKUs (max {settings.AVAILABILITY_MAX_SKUS})",
+        )
+    svc = InventoryService(db)
+    found = svc.available_quantities(skus)
+    ordered = list(dict.fromkeys(skus))
+    return {
+        "items": [{"sku": s, "available": found[s]} for s in ordered if s in found],
+        "missing": [s for s in ordered if s not in found],
+    }
+
+
+@router.get("/available")
+def available_many(
+    skus: str = Query(..., description="comma-separated SKUs"),
+    db: Session = Depends(get_db),
+):
+    return _bulk_available(skus.split(","), db)
+
+
+@router.post("/available")
+def available_many_post(payload: dict, db: Session = Depends(get_db)):
+    """
+    payload: { "skus": ["CHOC1234", "TEA100", ...] } — for lists too long for a query string
+    """
+    return _bulk_available(payload.get("skus") or [], db)
+
+
 @router.get("/available/{sku}")
 def available(sku: str, db: Session = Depends(get_db)):
     svc = InventoryService(db)
@@ -66,3 +171,47 @@ def available(sku: str, db: Session = Depends(get_db)):
         return {"sku": sku, "available": avail}
     except InventoryException as e:
         raise HTTPException(status_code=404, detail=str(e))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@router.get("/stream")
+async def stream(
+    request: Request,
+    skus: Optional[str] = Query(None, description="comma-separated SKUs; omit for all"),
+):
+    """
+    Server-sent events: `availability` events carry {"items": [{"sku", "available", "delta"}]}
+    for SKUs whose availability changed. With `skus`, the first event is a snapshot.
+    """
+    wanted = [s.strip() for s in (skus or "").split(",") if s.strip()]
+    if len(wanted) > settings.AVAILABILITY_MAX_SKUS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many SKUs (max {settings.AVAILABILITY_MAX_SKUS})",
+        )
+    sub = stock_feed.subscribe(wanted or None)
+    heartbeat = settings.STOCK_FEED_HEARTBEAT_SECONDS
+
+    async def events():
+        try:
+            if wanted:
+                items = await run_in_threadpool(stock_feed.snapshot, wanted)
+                yield _sse("snapshot", {"items": items})
+            while not await request.is_disconnected():
+                try:
+                    data = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse("availability", data)
+        finally:
+            stock_feed.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,10 +1,15 @@
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
+from app.config import settings
 from app.db import get_db
+from app.repositories.order_repo import InvalidCursor, OrderRepository
+from app.services.checkout_worker import checkout_pool
 from app.services.order_service import OrderService, OrderServiceException
 
 router = APIRouter(tags=["orders"])
@@ -26,8 +31,24 @@ def create_order(
     payload: CreateOrderIn,
     db: Session = Depends(get_db),
     idempotency_key: Optional[str] = Header(None, convert_underscores=True),
+    prefer: Optional[str] = Header(None),
 ):
     svc = OrderService(db)
+    if settings.CHECKOUT_ASYNC or "respond-async" in (prefer or ""):
+        # accept now (202), run payment and the remaining stages on the worker pool
+        try:
+            resp = svc.submit_order(
+                payload.customer_id,
+                [it.dict() for it in payload.items],
+                payload.payment_method,
+                idempotency_key=idempotency_key,
+            )
+        except OrderServiceException as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        checkout_pool.notify()
+        return JSONResponse(
+            status_code=202, content=resp, headers={"Location": resp["statusUrl"]}
+        )
     try:
         resp = svc.create_order(
             payload.customer_id,
@@ -44,3 +65,130 @@ def create_order(
         raise HTTPException(
             status_code=500, detail=f"Internal server error: {type(e).__name__}"
         )
+
+
+@router.post("/checkout", summary="Create order (checkout), async gateway call")
+async def create_order_async(
+    payload: CreateOrderIn,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, convert_underscores=True),
+):
+    # database work runs in the threadpool; the payment call is awaited, so
+    # in-flight payments do not occupy threadpool slots
+    try:
+        return await OrderService(db).create_order_async(
+            payload.customer_id,
+            [it.dict() for it in payload.items],
+            payload.payment_method,
+            idempotency_key=idempotency_key,
+        )
+    except OrderServiceException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+class BatchOrderIn(CreateOrderIn):
+    idempotency_key: Optional[str] = None
+
+
+class CreateOrdersBatchIn(BaseModel):
+    orders: List[BatchOrderIn] = Field(
+        ..., min_length=1, max_length=settings.BATCH_MAX_ORDERS
+    )
+
+
+@router.post("/batch", summary="Create many orders in one request (B2B feeds)")
+async def create_orders_batch(
+    payload: CreateOrdersBatchIn, db: Session = Depends(get_db)
+):
+    # per-order outcomes in request order; only a failure of the batch as a
+    # whole (before any order was opened) is a 400
+    try:
+        results = await OrderService(db).create_orders_batch(
+            [
+                {
+                    "customer_id": o.customer_id,
+                    "items": [it.dict() for it in o.items],
+                    "payment_method": o.payment_method,
+                    "idempotency_key": o.idempotency_key,
+                }
+                for o in payload.orders
+            ]
+        )
+    except OrderServiceException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    succeeded = sum(1 for r in results if r["ok"])
+    return {
+        "results": results,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+    }
+
+
+@router.get("/{order_id}/status", summary="Checkout progress of an order")
+def order_status(order_id: int, db: Session = Depends(get_db)):
+    try:
+        return OrderService(db).checkout_status(order_id)
+    except OrderServiceException as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+def _order_summary(o) -> dict:
+    return {
+        "orderId": o.id,
+        "orderNumber": o.order_number,
+        "customerId": o.customer_id,
+        "status": o.status,
+        "totalCents": o.total_cents,
+        "createdAt": o.created_at.isoformat() if o.created_at else None,
+    }
+
+
+@router.get("", summary="List orders (newest first, keyset pagination)")
+def list_orders(
+    customer_id: Optional[int] = Query(None),
+    status: Optional[str] = Query(None),
+    created_from: Optional[datetime] = Query(None, description="inclusive"),
+    created_to: Optional[datetime] = Query(None, description="exclusive"),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db),
+):
+    try:
+        orders, next_cursor = OrderRepository(db).list(
+            customer_id=customer_id,
+            status=status,
+            created_from=created_from,
+            created_to=created_to,
+            cursor=cursor,
+            limit=limit,
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": [_order_summary(o) for o in orders], "nextCursor": next_cursor}
+
+
+@router.get("/{order_id}", summary="Get order with lines, invoice and packing tasks")
+def get_order(order_id: int, db: Session = Depends(get_db)):
+    o = OrderRepository(db).get_with_details(order_id)
+    if not o:
+        raise HTTPException(status_code=404, detail="Order not found")
+    resp = _order_summary(o)
+    resp["lines"] = [
+        {"sku": l.sku, "name": l.name, "qty": l.qty, "priceCents": l.price_cents}
+        for l in o.lines
+    ]
+    resp["invoice"] = (
+        {
+            "invoiceId": o.invoice.id,
+            "invoiceNo": o.invoice.invoice_no,
+            "totalCents": o.invoice.total_cents,
+            "taxCents": o.invoice.tax_cents,
+        }
+        if o.invoice
+        else None
+    )
+    resp["packingTasks"] = [
+        {"id": t.id, "status": t.status, "assignedTo": t.assigned_to}
+        for t in o.packing_tasks
+    ]
+    return resp
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 
 from pydantic import ConfigDict
 from pydantic_settings import BaseSettings
@@ -13,6 +13,88 @@ class Settings(BaseSettings):
     FRONTEND_ORIGINS: List[str] = ["http://localhost:3000"]
     PAYMENT_MOCK_DELAY_MS: int = 200
     RESERVATION_TTL_SECONDS: int = 900
+    # expiry engine: rows per set-based UPDATE and the safety-net sweep interval
+    RESERVATION_EXPIRY_CHUNK: int = 500
+    RESERVATION_SWEEP_SECONDS: int = 300
+    # "lock" (per-SKU lock + SUM check) or "cas" (conditional UPDATE on reserved_qty)
+    RESERVATION_MODE: str = "lock"
+    # per-SKU reservation locks: "local" (one worker), "file" (one host), "advisory" (Postgres)
+    LOCK_BACKEND: str = "file"
+    LOCK_STRIPES: int = 256
+    LOCK_TIMEOUT_SECONDS: float = 10.0
+    LOCK_DIR: str = ""
+    # async checkout (opt-in per request with "Prefer: respond-async", or for all
+    # requests with CHECKOUT_ASYNC): job table drained by a worker pool
+    CHECKOUT_ASYNC: bool = False
+    CHECKOUT_WORKERS: int = 4
+    CHECKOUT_POLL_SECONDS: float = 1.0
+    CHECKOUT_LEASE_SECONDS: float = 60.0
+    CHECKOUT_MAX_ATTEMPTS: int = 5
+    CHECKOUT_RETRY_SECONDS: float = 5.0
+    # synchronous checkout transactions: "staged" commits after every step;
+    # "unit" commits twice (order + reservations, then settlement) around the payment call
+    CHECKOUT_TRANSACTION_MODE: str = "staged"
+    # transactional outbox: post-checkout side effects (packing tasks, ...) are
+    # delivered by a dispatcher thread in batches, retried with a linear backoff
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_SECONDS: float = 1.0
+    OUTBOX_LEASE_SECONDS: float = 60.0
+    OUTBOX_MAX_ATTEMPTS: int = 10
+    OUTBOX_RETRY_SECONDS: float = 5.0
+    # per-process LRU + TTL cache of COMPLETED idempotency responses (0 disables)
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_CACHE_TTL_SECONDS: float = 300.0
+    # idempotency record retention per operation (hours), then batched purge
+    IDEMPOTENCY_TTL_HOURS: Dict[str, float] = {
+        "create_order": 24.0,
+        "return_receive": 168.0,
+    }
+    IDEMPOTENCY_DEFAULT_TTL_HOURS: float = 24.0
+    IDEMPOTENCY_PURGE_BATCH: int = 1000
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS: int = 900
+    # stored responses whose JSON is at least this long are kept zlib-compressed
+    IDEMPOTENCY_COMPRESS_MIN_BYTES: int = 1024
+    # POST /api/orders/batch: max orders per request and concurrent gateway charges
+    BATCH_MAX_ORDERS: int = 500
+    BATCH_PAYMENT_CONCURRENCY: int = 8
+    # payment resilience: retries with exponential backoff + full jitter, a circuit
+    # breaker failing fast after N consecutive transient errors, and a cap on
+    # concurrent in-flight charges (bulkhead)
+    PAYMENT_RETRY_ATTEMPTS: int = 3
+    PAYMENT_RETRY_BASE_MS: int = 50
+    PAYMENT_RETRY_MAX_MS: int = 1000
+    PAYMENT_BREAKER_FAILURES: int = 5
+    PAYMENT_BREAKER_RESET_SECONDS: float = 30.0
+    PAYMENT_MAX_IN_FLIGHT: int = 50
+    # in-process checkout tracing: per-stage latency histograms and the last N spans
+    TRACING_ENABLED: bool = True
+    TRACING_RECENT_SPANS: int = 2000
+    # flash sales: reserves for these SKUs are group-committed by one worker per SKU
+    FLASH_SALE_SKUS: List[str] = []
+    FLASH_SALE_BATCH: int = 200
+    FLASH_SALE_WAIT_SECONDS: float = 10.0
+    # bulk availability: micro-cache TTL (0 disables) and max SKUs per request
+    AVAILABILITY_CACHE_TTL_MS: int = 500
+    AVAILABILITY_MAX_SKUS: int = 1000
+    # per-process (stock, reserved) ledger for lock-free availability reads;
+    # reservation checks under the SKU lock always read the DB
+    INVENTORY_LEDGER_ENABLED: bool = True
+    INVENTORY_LEDGER_RESYNC_SECONDS: int = 60
+    # reservation archive: terminal rows older than N days leave the hot table,
+    # into inventory_reservations_history ("table") or gzipped JSONL files ("jsonl")
+    RESERVATION_ARCHIVE_AFTER_DAYS: int = 30
+    RESERVATION_ARCHIVE_BATCH: int = 1000
+    RESERVATION_ARCHIVE_INTERVAL_SECONDS: int = 3600
+    RESERVATION_ARCHIVE_MODE: str = "table"
+    RESERVATION_ARCHIVE_DIR: str = "./archive"
+    # inventory reconciliation: SKUs per page, schedule and report location
+    RECONCILE_BATCH_SIZE: int = 1000
+    RECONCILE_INTERVAL_SECONDS: int = 86400
+    RECONCILE_REPORT_DIR: str = "./reports"
+    # SSE stock feed: coalescing window, per-client buffer, keep-alive interval
+    STOCK_FEED_COALESCE_MS: int = 250
+    STOCK_FEED_QUEUE_SIZE: int = 100
+    STOCK_FEED_HEARTBEAT_SECONDS: int = 15
 
 
 settings = Settings()
@@ -51,11 +51,19 @@ def init_db():
         print("Resetting database (RESET_DB set or pytest detected)...")
         Base.metadata.drop_all(bind=engine)
 
+        # in-process availability state refers to the dropped rows
+        from app.services.inventory_ledger import ledger
+
+        ledger.invalidate()
+
     # List of model modules we expect to import here (add new modules here)
     model_modules = [
         "app.models.product",
         "app.models.inventory_reservation",
+        "app.models.inventory_checkpoint",
         "app.models.order",
+        "app.models.checkout_job",
+        "app.models.outbox",
         "app.models.shipment",
         "app.models.packing_task",
         "app.models.invoice",
@@ -14,8 +14,15 @@ from app.api.routes_order import router as order_router
 from app.api.routes_returns import router as returns_router
 from app.config import settings
 from app.db import SessionLocal, init_db
+from app.repositories.idempotency_repo import run_idempotency_purge_job
+from app.services.checkout_worker import checkout_pool
 from app.services.inventory_service import InventoryService
 from app.services.order_service import OrderService
+from app.services.outbox import outbox_dispatcher
+from app.services.reconciliation_service import run_reconciliation_job
+from app.services.reservation_archive import run_archive_job
+from app.services.reservation_expiry import expiry_engine
+from app.services.stock_feed import stock_feed
 
 
 @asynccontextmanager
@@ -23,28 +30,56 @@ async def lifespan(app: FastAPI):
     # startup
     init_db()
 
-    # scheduler for expiring reservations
+    # rebuild the in-process availability ledger from the DB
+    db = SessionLocal()
+    try:
+        InventoryService(db).warm_ledger()
+    finally:
+        db.close()
+
+    # reservations expire close to their deadline via the timer engine;
+    # the scheduler only runs a coarse safety-net sweep
+    expiry_engine.start()
+    stock_feed.start()
+    checkout_pool.start()
+    outbox_dispatcher.start()
     scheduler = BackgroundScheduler()
-
-    def expire_job():
-        db = SessionLocal()
-        try:
-            svc = InventoryService(db)
-            ids = svc.expire_overdue()
-            if ids:
-                app.logger = getattr(app, "logger", None)
-                # optional logging
-        finally:
-            db.close()
-
-    # run expire_job every 30 seconds
-    scheduler.add_job(expire_job, "interval", seconds=30, id="expire_reservations")
+    scheduler.add_job(
+        expiry_engine.run_once,
+        "interval",
+        seconds=settings.RESERVATION_SWEEP_SECONDS,
+        id="expire_reservations",
+    )
+    # keep inventory_reservations small: move old terminal rows to the archive
+    scheduler.add_job(
+        run_archive_job,
+        "interval",
+        seconds=settings.RESERVATION_ARCHIVE_INTERVAL_SECONDS,
+        id="archive_reservations",
+    )
+    # drop idempotency records whose retention window has passed
+    scheduler.add_job(
+        run_idempotency_purge_job,
+        "interval",
+        seconds=settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+        id="purge_idempotency",
+    )
+    scheduler.add_job(
+        run_reconciliation_job,
+        "interval",
+        seconds=settings.RECONCILE_INTERVAL_SECONDS,
+        id="reconcile_inventory",
+    )
     scheduler.start()
 
     try:
         yield
     finally:
         scheduler.shutdown(wait=False)
+        expiry_engine.stop()
+        stock_feed.stop()
+        checkout_pool.stop()
+        outbox_dispatcher.stop()
 
 
 app = FastAPI(title="Your Local Shop - Backend", version="0.1.0", lifespan=lifespan)
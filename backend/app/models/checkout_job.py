@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Index, Integer, String
+
+from app.db import Base
+
+
+class CheckoutJob(Base):
+    """
+    Durable work item for an asynchronous checkout. `stage` is the next stage
+    to run (reserve, charge, commit, complete, done); state produced by
+    earlier stages (reservation ids, payment result) is kept in `data`, so a
+    job picked up again after a crash resumes where it stopped.
+    """
+
+    __tablename__ = "checkout_jobs"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    order_id = Column(
+        Integer, ForeignKey("orders.id"), nullable=False, unique=True, index=True
+    )
+    status = Column(
+        String(32), nullable=False, default="queued"
+    )  # queued, running, done, failed
+    stage = Column(String(32), nullable=False, default="reserve")
+    attempts = Column(Integer, nullable=False, default=0)
+    payload = Column(JSON, nullable=False)  # items, payment_method
+    data = Column(JSON, nullable=True)
+    last_error = Column(String(1024), nullable=True)
+    available_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    locked_by = Column(String(64), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(
+        DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    __table_args__ = (
+        # worker claim: WHERE status = 'queued' AND available_at <= now
+        Index("ix_checkout_jobs_status_available", "status", "available_at"),
+    )
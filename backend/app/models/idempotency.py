@@ -1,8 +1,13 @@
+import base64
 import enum
+import json
+import zlib
 from datetime import datetime, timezone
 
-from sqlalchemy import JSON, Column, DateTime, Enum, Integer, String
+from sqlalchemy import JSON, Column, DateTime, Enum, Index, Integer, String
+from sqlalchemy.types import TypeDecorator
 
+from app.config import settings
 from app.db import Base
 
 
@@ -13,6 +18,35 @@ class IdempotencyStatus(enum.Enum):
     REFUNDED = "REFUNDED"
 
 
+class CompressedJSON(TypeDecorator):
+    """
+    JSON column that stores large values zlib-compressed. A value whose JSON
+    text reaches IDEMPOTENCY_COMPRESS_MIN_BYTES is written as
+    {"__zlib__": "<base64>"} (still valid JSON, so the column type and rows
+    written before compression existed are unchanged) and inflated on read.
+    """
+
+    impl = JSON
+    cache_ok = True
+    MARKER = "__zlib__"
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        raw = json.dumps(value, separators=(",", ":")).encode()
+        if len(raw) < settings.IDEMPOTENCY_COMPRESS_MIN_BYTES:
+            return value
+        packed = base64.b64encode(zlib.compress(raw)).decode("ascii")
+        if len(packed) >= len(raw):
+            return value
+        return {self.MARKER: packed}
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, dict) and len(value) == 1 and self.MARKER in value:
+            return json.loads(zlib.decompress(base64.b64decode(value[self.MARKER])))
+        return value
+
+
 class IdempotencyRecord(Base):
     __tablename__ = "idempotency_records"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -21,11 +55,21 @@ class IdempotencyRecord(Base):
     status = Column(
         Enum(IdempotencyStatus), nullable=False, default=IdempotencyStatus.IN_PROGRESS
     )
-    response_body = Column(JSON, nullable=True)
+    # SHA-256 of the canonical request (request_fingerprint); a replay must match
+    request_hash = Column(String(64), nullable=True)
+    response_body = Column(CompressedJSON, nullable=True)
     last_error = Column(String(1024), nullable=True)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(
         DateTime,
-        default=datetime.now(timezone.utc),
-        onupdate=datetime.now(timezone.utc),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+    # retention per operation (IDEMPOTENCY_TTL_HOURS); the purge job deletes
+    # rows past it. NULL (rows from before expiry existed) is never purged.
+    expires_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # purge job: WHERE expires_at < now ORDER BY expires_at LIMIT n
+        Index("ix_idempotency_records_expires_at", "expires_at"),
     )
@@ -0,0 +1,21 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+from app.db import Base
+
+
+class InventoryCheckpoint(Base):
+    """
+    Reconciliation baseline per SKU: the stock level together with the running
+    totals of committed reservation quantity and credit-note restocks at the
+    time it was taken. Expected stock later is
+    stock - (committed now - committed_total) + (restocked now - restocked_total).
+    """
+
+    __tablename__ = "inventory_checkpoints"
+    sku = Column(String(64), primary_key=True)
+    stock = Column(Integer, nullable=False)
+    committed_total = Column(Integer, nullable=False, default=0)
+    restocked_total = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
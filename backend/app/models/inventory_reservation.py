@@ -1,6 +1,6 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
 
 from app.db import Base
 
@@ -17,9 +17,31 @@ class InventoryReservation(Base):
     )  # reserved, committed, released, expired
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=True, index=True)
 
+    __table_args__ = (
+        # expiry scans: WHERE status = 'reserved' AND reserved_until <= now
+        Index("ix_inventory_reservations_status_until", "status", "reserved_until"),
+    )
+
     def is_active(self, now=None):
         if not now:
             now = datetime.now(timezone.utc)
         return self.status == "reserved" and (
             self.reserved_until is None or self.reserved_until > now
         )
+
+
+class InventoryReservationHistory(Base):
+    """
+    Terminal reservations (committed, released, expired) moved out of the hot
+    inventory_reservations table by the archive job. Rows keep their original id.
+    """
+
+    __tablename__ = "inventory_reservations_history"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    sku = Column(String(64), nullable=False, index=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    reserved_at = Column(DateTime, nullable=True)
+    reserved_until = Column(DateTime, nullable=True)
+    status = Column(String(32), nullable=False)
+    order_id = Column(Integer, nullable=True, index=True)
+    archived_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -7,6 +7,7 @@ from sqlalchemy import (
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
@@ -26,9 +27,16 @@ class Order(Base):
         String(32), nullable=False, default="IN_PROGRESS"
     )  # IN_PROGRESS, COMPLETED, FAILED, REFUNDED
     total_cents = Column(Integer, nullable=False, default=0)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+    created_at = Column(
+        DateTime, default=lambda: datetime.now(timezone.utc), nullable=False
+    )
     data = Column(JSON, nullable=True)
 
+    __table_args__ = (
+        # account history: WHERE customer_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_orders_customer_created", "customer_id", "created_at"),
+    )
+
     lines = relationship(
         "OrderLine", back_populates="order", cascade="all, delete-orphan"
     )
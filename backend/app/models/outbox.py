@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import JSON, Column, DateTime, Index, Integer, String
+
+from app.db import Base
+
+
+class OutboxEvent(Base):
+    """
+    Side effect of a committed state change (transactional outbox). Written in
+    the same transaction as the change itself, then delivered to its topic's
+    handlers by the outbox dispatcher, at least once: a handler may see the
+    same event again after a crash or a lost lease and must tolerate it.
+    """
+
+    __tablename__ = "outbox_events"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    topic = Column(String(64), nullable=False)  # e.g. order.completed
+    aggregate_id = Column(Integer, nullable=True, index=True)  # e.g. order id
+    payload = Column(JSON, nullable=False)
+    status = Column(
+        String(32), nullable=False, default="pending"
+    )  # pending, processing, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(1024), nullable=True)
+    available_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    locked_by = Column(String(64), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    processed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # dispatcher claim: WHERE status = 'pending' AND available_at <= now
+        Index("ix_outbox_events_status_available", "status", "available_at"),
+    )
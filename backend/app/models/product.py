@@ -14,6 +14,8 @@ class Product(Base):
     image = Column(String(512), nullable=True)
     active = Column(Boolean, default=True, nullable=False)
     stock = Column(Integer, default=0, nullable=False)
+    # sum of quantities held by reservations in status "reserved" (see InventoryService)
+    reserved_qty = Column(Integer, default=0, server_default="0", nullable=False)
 
     def __repr__(self):
         return f"<Product sku={self.sku} name={self.name}>"
@@ -1,10 +1,19 @@
+import hashlib
+import json
 import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
 
+from sqlalchemy import bindparam, delete, event, select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 
+from app.config import settings
 from app.db import SessionLocal  # new short-lived sessions for atomic begin
 from app.models.idempotency import IdempotencyRecord, IdempotencyStatus
+from app.utils.idem_lock import idempotency_waiters
+from app.utils.sql import insert_returning, supports_returning
+from app.utils.ttl_cache import TTLCache
 
 log = logging.getLogger("idempotency")
 log.setLevel(logging.DEBUG)
@@ -16,11 +25,109 @@ if not log.handlers:
     log.addHandler(h)
 
 
+# (request_hash, response_body) of COMPLETED records by key, filled once the
+# completion has committed:
+# retries of finished requests are answered without touching the database.
+# A COMPLETED record only changes through this repository, which evicts it.
+_completed_responses = TTLCache(
+    maxsize=settings.IDEMPOTENCY_CACHE_SIZE,
+    ttl_seconds=settings.IDEMPOTENCY_CACHE_TTL_SECONDS,
+)
+
+
+_PENDING_CACHE_KEY = "idempotency_completed_responses"
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was first used for a request with a different fingerprint."""
+
+
+def request_fingerprint(payload) -> str:
+    """
+    SHA-256 of the canonical JSON of `payload` (sorted keys, no whitespace), so
+    the same request always hashes the same whatever its key order.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def fingerprint_matches(stored: Optional[str], given: Optional[str]) -> bool:
+    # records from before fingerprinting, and callers without one, always match
+    return not stored or not given or stored == given
+
+
+def _check_fingerprint(key: str, stored: Optional[str], given: Optional[str]):
+    if not fingerprint_matches(stored, given):
+        raise IdempotencyKeyReused(
+            f"Idempotency key {key!r} was already used for a different request"
+        )
+
+
+def expires_at_for(operation: str, now: Optional[datetime] = None) -> datetime:
+    """End of the retention window of a record created now for `operation`."""
+    hours = settings.IDEMPOTENCY_TTL_HOURS.get(
+        operation, settings.IDEMPOTENCY_DEFAULT_TTL_HOURS
+    )
+    return (now or datetime.now(timezone.utc)) + timedelta(hours=hours)
+
+
+def _timestamps(operation: str) -> dict:
+    # one clock read, so expires_at - created_at is exactly the operation's TTL
+    now = datetime.now(timezone.utc)
+    return {
+        "created_at": now,
+        "updated_at": now,
+        "expires_at": expires_at_for(operation, now),
+    }
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed(session):
+    # only the outermost commit is durable: a rolled-back completion must never
+    # be replayed
+    if session.in_nested_transaction():
+        return
+    for key, entry in session.info.pop(_PENDING_CACHE_KEY, {}).items():
+        _completed_responses.set(key, entry)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_uncommitted(session):
+    # a savepoint rollback drops them all too: a cache miss is always safe
+    session.info.pop(_PENDING_CACHE_KEY, None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_leftovers(session, transaction):
+    # Session.close() ends the root transaction without an after_rollback event
+    if transaction.parent is None:
+        session.info.pop(_PENDING_CACHE_KEY, None)
+
+
 class IdempotencyRepository:
     def __init__(self, db: Session):
         # db is the caller's session (longer-lived)
         self.db = db
 
+    def cached_response(
+        self, key: str, request_hash: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        Response of a COMPLETED request from the in-process cache, or None.
+        Raises IdempotencyKeyReused if `request_hash` differs from the original's.
+        """
+        entry = _completed_responses.get(key)
+        if entry is None:
+            return None
+        stored_hash, body = entry
+        _check_fingerprint(key, stored_hash, request_hash)
+        return body
+
+    def ensure_same_request(self, rec, request_hash: Optional[str]):
+        """Raise IdempotencyKeyReused if `rec` was created for another request."""
+        if rec is not None:
+            _check_fingerprint(rec.key, rec.request_hash, request_hash)
+
     def get(self, key: str):
         """
         Return the idempotency record for `key`. Expire session state first so
@@ -49,34 +156,234 @@ class IdempotencyRepository:
                 .first()
             )
 
-    def begin(self, key: str, operation: str) -> tuple:
+    def begin(
+        self, key: str, operation: str, request_hash: Optional[str] = None
+    ) -> tuple:
         """
         Atomically ensure an idempotency row exists.
         Returns (IdempotencyRecord_from_caller_session, created_flag)
           - created_flag == True  -> this call successfully created the IN_PROGRESS row (owner)
           - created_flag == False -> row already existed (concurrent / previous request)
 
-        Uses a short-lived SessionLocal() to INSERT+COMMIT so visibility is immediate.
+        The claim is committed in a short-lived SessionLocal() so it is visible
+        to concurrent requests immediately. Where RETURNING is available this is
+        one INSERT ... ON CONFLICT (key) DO NOTHING RETURNING, plus one SELECT
+        in the caller's session only when the key was already taken.
+
+        `request_hash` (request_fingerprint of the request) is stored with a new
+        claim; an existing record with a different one raises
+        IdempotencyKeyReused instead of replaying another request's response.
         """
+        rec, created = self._claim(key, operation, request_hash)
+        if not created:
+            self.ensure_same_request(rec, request_hash)
+        return rec, created
+
+    def _claim(self, key: str, operation: str, request_hash: Optional[str]) -> tuple:
+        if supports_returning(self.db):
+            return self._begin_returning(key, operation, request_hash)
+        return self._begin_insert(key, operation, request_hash)
+
+    def _begin_returning(
+        self, key: str, operation: str, request_hash: Optional[str] = None
+    ) -> tuple:
+        table = IdempotencyRecord.__table__
+        row = {
+            "key": key,
+            "operation": operation,
+            "status": IdempotencyStatus.IN_PROGRESS,
+            "request_hash": request_hash,
+            **_timestamps(operation),
+        }
+        with SessionLocal() as s:
+            inserted = insert_returning(
+                s,
+                table,
+                [row],
+                returning=[c.name for c in table.columns],
+                conflict_target=("key",),
+            )
+            s.commit()
+        if not inserted:
+            log.debug(f"begin(): key={key!r} already claimed")
+            return self._fresh(key), False
+        # the RETURNING row becomes the caller's persistent instance, no reload
+        rec = IdempotencyRecord(**inserted[0]._asdict())
+        make_transient_to_detached(rec)
+        log.debug(f"begin(): claimed key={key!r} id={rec.id}")
+        return self.db.merge(rec, load=False), True
+
+    def _begin_insert(
+        self, key: str, operation: str, request_hash: Optional[str] = None
+    ) -> tuple:
+        # databases without RETURNING: INSERT, then read the row back
         created = False
-        log.debug(f"begin(): trying insert key={key!r}")
         try:
             with SessionLocal() as s:
-                rec = IdempotencyRecord(
-                    key=key, operation=operation, status=IdempotencyStatus.IN_PROGRESS
+                s.add(
+                    IdempotencyRecord(
+                        key=key,
+                        operation=operation,
+                        status=IdempotencyStatus.IN_PROGRESS,
+                        request_hash=request_hash,
+                        **_timestamps(operation),
+                    )
                 )
-                s.add(rec)
                 s.commit()
                 created = True
         except IntegrityError:
             log.debug(f"begin(): insert collision for key={key!r}")
-            created = False
+        return self._fresh(key), created
+
+    def _fresh(self, key: str) -> Optional[IdempotencyRecord]:
+        # one SELECT overwriting whatever the caller's session holds for the row
+        return (
+            self.db.query(IdempotencyRecord)
+            .filter(IdempotencyRecord.key == key)
+            .populate_existing()
+            .first()
+        )
+
+    def begin_many(
+        self,
+        keys: List[str],
+        operation: str,
+        request_hashes: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, tuple]:
+        """
+        begin() for a batch of keys in two round trips: one read of the records
+        that already exist, one multi-row INSERT ... ON CONFLICT DO NOTHING
+        (committed in a short-lived session) claiming the rest. Keys found in
+        the completed-response cache take no round trip at all.
+        Returns {key: (created, status, response_body, last_error, request_hash)};
+        comparing the stored request_hash (fingerprint_matches) is left to the
+        caller, so one reused key does not fail the whole batch.
+        """
+        request_hashes = request_hashes or {}
+        out = {}
+        for key in dict.fromkeys(keys):
+            entry = _completed_responses.get(key)
+            if entry is not None:
+                stored_hash, body = entry
+                out[key] = (False, IdempotencyStatus.COMPLETED, body, None, stored_hash)
+        keys = [k for k in dict.fromkeys(keys) if k not in out]
+        if not keys:
+            return out
+        out.update(
+            (
+                row.key,
+                (
+                    False,
+                    row.status,
+                    row.response_body,
+                    row.last_error,
+                    row.request_hash,
+                ),
+            )
+            for row in self.db.query(
+                IdempotencyRecord.key,
+                IdempotencyRecord.status,
+                IdempotencyRecord.response_body,
+                IdempotencyRecord.last_error,
+                IdempotencyRecord.request_hash,
+            ).filter(IdempotencyRecord.key.in_(keys))
+        )
+        new = [k for k in keys if k not in out]
+        if not new:
+            return out
+        if not supports_returning(self.db):
+            for key in new:
+                rec, created = self._claim(key, operation, request_hashes.get(key))
+                out[key] = (
+                    created,
+                    rec.status,
+                    rec.response_body,
+                    rec.last_error,
+                    rec.request_hash,
+                )
+            return out
+        now = datetime.now(timezone.utc)
+        rows = [
+            {
+                "key": key,
+                "operation": operation,
+                "status": IdempotencyStatus.IN_PROGRESS,
+                "request_hash": request_hashes.get(key),
+                "created_at": now,
+                "updated_at": now,
+                "expires_at": expires_at_for(operation, now),
+            }
+            for key in new
+        ]
+        with SessionLocal() as s:
+            claimed = {
+                row[0]
+                for row in insert_returning(
+                    s,
+                    IdempotencyRecord.__table__,
+                    rows,
+                    returning=("key",),
+                    conflict_target=("key",),
+                )
+            }
+            s.commit()
+        for key in new:
+            # keys missing from RETURNING were taken by a concurrent request
+            # (their fingerprint is unknown here; the later replay checks it)
+            out[key] = (
+                key in claimed,
+                IdempotencyStatus.IN_PROGRESS,
+                None,
+                None,
+                request_hashes.get(key) if key in claimed else None,
+            )
+        return out
 
-        # return the record as seen by the caller's session + the created flag
-        log.debug(
-            f"begin(): returning rec.key={self.get(key).key if self.get(key) else None} created={created}"
+    def peek(self, key: str) -> Optional[tuple]:
+        """
+        (status, response_body, last_error) for `key` as currently committed, or None.
+        A column query: no expire_all()/refresh(), one round trip.
+        """
+        row = (
+            self.db.query(
+                IdempotencyRecord.status,
+                IdempotencyRecord.response_body,
+                IdempotencyRecord.last_error,
+            )
+            .filter(IdempotencyRecord.key == key)
+            .first()
+        )
+        return tuple(row) if row else None
+
+    def wait_for_completion(self, key: str, timeout: float = 2.0) -> Optional[tuple]:
+        """
+        Wait for the owner of `key` to finish. Returns (status, response_body,
+        last_error) once the record is COMPLETED with a response or FAILED, or
+        None on timeout. Owners in this process wake us directly; otherwise the
+        record is re-read with exponential backoff.
+        """
+
+        def check():
+            row = self.peek(key)
+            if not row:
+                return None
+            status, body, _ = row
+            if status == IdempotencyStatus.COMPLETED and body:
+                return row
+            if status == IdempotencyStatus.FAILED:
+                return row
+            return None
+
+        return idempotency_waiters.wait(key, check, timeout)
+
+    def _notify_after_commit(self, key: str):
+        # waiters must not wake before the state they will read is committed
+        event.listen(
+            self.db,
+            "after_commit",
+            lambda s: idempotency_waiters.notify(key),
+            once=True,
         )
-        return self.get(key), created
 
     def store(self, key: str, operation: str, response_body: dict, merge: bool = True):
         """
@@ -84,6 +391,7 @@ class IdempotencyRepository:
         Useful for sub-operations (e.g. storing payment_result) while the overall operation
         remains IN_PROGRESS. If merge=True and the existing response_body is a dict, merge keys.
         """
+        _completed_responses.pop(key)
         rec = self.get(key)
         if not rec:
             # create a new IN_PROGRESS record with the partial response
@@ -92,6 +400,7 @@ class IdempotencyRepository:
                 operation=operation,
                 status=IdempotencyStatus.IN_PROGRESS,
                 response_body=response_body,
+                **_timestamps(operation),
             )
             self.db.add(rec)
             self.db.flush()
@@ -108,11 +417,15 @@ class IdempotencyRepository:
         self.db.flush()
         return rec
 
-    def mark_completed(self, key: str, response_body: dict):
+    def mark_completed(self, key: str, response_body: dict, in_session: bool = False):
         """
         Mark an idempotency record as COMPLETED and persist response_body.
         Use a short-lived session to ensure the update is committed/visible to other sessions immediately.
+        With in_session=True the update joins the caller's transaction instead, so
+        the response becomes visible atomically with the work it describes.
         """
+        if in_session:
+            return self._complete_in_session(key, response_body)
         # Use a short-lived session to ensure the completed state is committed and visible immediately.
         try:
             with SessionLocal() as s:
@@ -127,22 +440,85 @@ class IdempotencyRepository:
                     )
                 rec.status = IdempotencyStatus.COMPLETED
                 rec.response_body = response_body
+                request_hash = rec.request_hash  # read before commit expires rec
                 s.add(rec)
                 s.commit()
+                _completed_responses.set(key, (request_hash, response_body))
+                idempotency_waiters.notify(key)
                 log.debug(
                     f"mark_completed(): key={key!r} response_keys={list(response_body.keys()) if isinstance(response_body, dict) else type(response_body)}"
                 )
         except Exception:
             # fallback to caller session update (best-effort)
-            rec = self.get(key)
-            if not rec:
-                raise RuntimeError("Idempotency record missing")
-            rec.status = IdempotencyStatus.COMPLETED
-            rec.response_body = response_body
-            self.db.flush()
+            return self._complete_in_session(key, response_body)
         return self.get(key)
 
+    def _complete_in_session(self, key: str, response_body: dict):
+        # fresh read of this row only: get() would expire every object in the
+        # caller's session, which is mid-transaction here
+        rec = (
+            self.db.query(IdempotencyRecord)
+            .filter(IdempotencyRecord.key == key)
+            .populate_existing()
+            .first()
+        )
+        if not rec:
+            raise RuntimeError("Idempotency record missing")
+        rec.status = IdempotencyStatus.COMPLETED
+        rec.response_body = response_body
+        self.db.flush()
+        # cached once the caller commits (see _cache_committed)
+        self.db.info.setdefault(_PENDING_CACHE_KEY, {})[key] = (
+            rec.request_hash,
+            response_body,
+        )
+        self._notify_after_commit(key)
+        return rec
+
+    def mark_failed_many(self, errors: Dict[str, str]):
+        """
+        mark_failed for many existing records with one executemany UPDATE in the
+        caller's transaction; unlike mark_failed it leaves the session's other
+        objects unexpired.
+        """
+        if not errors:
+            return
+        for key in errors:
+            _completed_responses.pop(key)
+        table = IdempotencyRecord.__table__
+        self.db.execute(
+            table.update()
+            .where(table.c.key == bindparam("k"))
+            .values(
+                status=IdempotencyStatus.FAILED,
+                last_error=bindparam("err"),
+                updated_at=datetime.now(timezone.utc),
+            ),
+            [{"k": key, "err": msg[:1024]} for key, msg in errors.items()],
+        )
+        for key in errors:
+            self._notify_after_commit(key)
+
+    def release_many(self, keys: List[str]):
+        """
+        Drop the IN_PROGRESS claims on `keys` with one DELETE in the caller's
+        transaction, for work abandoned before it had any effect: the next
+        begin()/begin_many() claims the key afresh. Settled records are kept.
+        """
+        if not keys:
+            return
+        table = IdempotencyRecord.__table__
+        self.db.execute(
+            delete(table).where(
+                table.c.key.in_(keys),
+                table.c.status == IdempotencyStatus.IN_PROGRESS,
+            )
+        )
+        for key in keys:
+            self._notify_after_commit(key)
+
     def mark_failed(self, key: str, error_message: str):
+        _completed_responses.pop(key)
         rec = self.get(key)
         if not rec:
             rec = IdempotencyRecord(
@@ -150,11 +526,74 @@ class IdempotencyRepository:
                 operation="unknown",
                 status=IdempotencyStatus.FAILED,
                 last_error=error_message,
+                **_timestamps("unknown"),
             )
             self.db.add(rec)
             self.db.flush()
+            self._notify_after_commit(key)
             return rec
         rec.status = IdempotencyStatus.FAILED
         rec.last_error = error_message
         self.db.flush()
+        self._notify_after_commit(key)
         return rec
+
+    def purge_expired(
+        self,
+        batch_size: Optional[int] = None,
+        max_batches: Optional[int] = None,
+        now: Optional[datetime] = None,
+    ) -> dict:
+        """
+        Delete records whose expires_at has passed, oldest first, in batches of
+        `batch_size`: each batch is one indexed range read plus one DELETE by
+        primary key in its own short transaction, so writers inserting new keys
+        never wait behind one long delete. Returns {"purged", "batches"}.
+        """
+        batch_size = batch_size or settings.IDEMPOTENCY_PURGE_BATCH
+        now = now or datetime.now(timezone.utc)
+        table = IdempotencyRecord.__table__
+
+        # start from a clean transaction so every batch commits on its own
+        self.db.commit()
+        purged = batches = 0
+        while max_batches is None or batches < max_batches:
+            rows = self.db.execute(
+                select(table.c.id, table.c.key)
+                .where(table.c.expires_at < now)
+                .order_by(table.c.expires_at)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            try:
+                self.db.execute(
+                    delete(table).where(table.c.id.in_([r.id for r in rows]))
+                )
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            for r in rows:
+                _completed_responses.pop(r.key)
+            purged += len(rows)
+            batches += 1
+            if len(rows) < batch_size:
+                break
+        if purged:
+            log.info(
+                "purged %d expired idempotency records in %d batches", purged, batches
+            )
+        return {"purged": purged, "batches": batches}
+
+
+def run_idempotency_purge_job() -> dict:
+    """Scheduler entry point: one purge pass with its own session."""
+    db = SessionLocal()
+    try:
+        return IdempotencyRepository(db).purge_expired()
+    except Exception:
+        log.exception("idempotency purge run failed")
+        return {}
+    finally:
+        db.close()
@@ -0,0 +1,87 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, selectinload
+
+from app.models.order import Order
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order: Order) -> str:
+    raw = f"{order.created_at.isoformat()}|{order.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created, order_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created), int(order_id)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+class OrderRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_with_details(self, order_id: int) -> Optional[Order]:
+        """
+        Order with lines, invoice and packing tasks: one query for the order and
+        one selectinload per relationship, however many lines it has.
+        """
+        return (
+            self.db.query(Order)
+            .options(
+                selectinload(Order.lines),
+                selectinload(Order.invoice),
+                selectinload(Order.packing_tasks),
+            )
+            .filter(Order.id == order_id)
+            .first()
+        )
+
+    def list(
+        self,
+        customer_id: Optional[int] = None,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20,
+    ) -> Tuple[List[Order], Optional[str]]:
+        """
+        Newest first, keyset-paginated on (created_at, id): the next page starts
+        strictly after the last row of this one, so deep pages cost the same as
+        the first and rows inserted meanwhile are neither skipped nor repeated.
+        Returns (orders, next_cursor); next_cursor is None on the last page.
+        """
+        query = self.db.query(Order)
+        if customer_id is not None:
+            query = query.filter(Order.customer_id == customer_id)
+        if status:
+            query = query.filter(Order.status == status)
+        if created_from is not None:
+            query = query.filter(Order.created_at >= created_from)
+        if created_to is not None:
+            query = query.filter(Order.created_at < created_to)
+        if cursor:
+            after_created, after_id = decode_cursor(cursor)
+            query = query.filter(
+                or_(
+                    Order.created_at < after_created,
+                    and_(Order.created_at == after_created, Order.id < after_id),
+                )
+            )
+        rows = (
+            query.order_by(Order.created_at.desc(), Order.id.desc())
+            .limit(limit + 1)
+            .all()
+        )
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
@@ -3,7 +3,9 @@ from typing import List, Optional, Tuple
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
+from app.models.inventory_checkpoint import InventoryCheckpoint
 from app.models.product import Product
+from app.services.inventory_ledger import LedgerOp, record
 
 
 class ProductRepository:
@@ -62,5 +64,11 @@ class ProductRepository:
                 image=image,
             )
             self.db.add(p)
+        # a deliberate stock overwrite: reconciliation takes a new baseline next run
+        self.db.query(InventoryCheckpoint).filter(
+            InventoryCheckpoint.sku == sku
+        ).delete(synchronize_session=False)
         self.db.flush()
+        # stock may have been overwritten; let the availability ledger reload this SKU
+        record(self.db, LedgerOp(kind="invalidate", sku=sku))
         return p
@@ -0,0 +1,209 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import bindparam, or_, text
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models.checkout_job import CheckoutJob
+from app.models.order import Order
+from app.services.inventory_service import InventoryService
+from app.services.order_service import OrderService
+from app.utils.sql import supports_returning
+
+log = logging.getLogger("checkout_worker")
+
+
+class CheckoutWorkerPool:
+    """
+    Threads draining the checkout_jobs table.
+
+    A worker claims one job at a time with a conditional UPDATE (status ->
+    'running', lease in locked_until) and runs OrderService.run_checkout_job
+    with its own session. Jobs whose lease ran out (worker crashed mid-job)
+    are claimed again and resume from their recorded stage. Unexpected errors,
+    payment gateway errors included, requeue the job with a backoff until
+    CHECKOUT_MAX_ATTEMPTS is reached; then the job fails and an unpaid basket
+    is released.
+
+    Jobs live in the database, so any process running a pool can pick them up.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        workers: Optional[int] = None,
+        poll_seconds: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+    ):
+        self.session_factory = session_factory
+        self.workers = settings.CHECKOUT_WORKERS if workers is None else workers
+        self.poll_seconds = poll_seconds or settings.CHECKOUT_POLL_SECONDS
+        self.lease_seconds = lease_seconds or settings.CHECKOUT_LEASE_SECONDS
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._worker_id = f"{os.getpid()}"
+
+    # --- lifecycle -------------------------------------------------------------
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        for i in range(self.workers):
+            t = threading.Thread(
+                target=self._loop,
+                args=(f"{self._worker_id}-{i}",),
+                name=f"checkout-worker-{i}",
+                daemon=True,
+            )
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """Wake an idle worker (a job was just queued)."""
+        with self._cond:
+            self._cond.notify()
+
+    def _loop(self, worker: str):
+        while not self._stopping:
+            try:
+                ran = self.run_once(worker)
+            except Exception:
+                log.exception("checkout worker %s crashed on a job", worker)
+                ran = None
+            if ran is None:
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(timeout=self.poll_seconds)
+
+    # --- work ------------------------------------------------------------------
+
+    def _claim(self, db, worker: str) -> Optional[int]:
+        now = datetime.now(timezone.utc)
+        lease = now + timedelta(seconds=self.lease_seconds)
+        table = CheckoutJob.__table__
+        dt = table.c.available_at.type
+        params = {"now": now, "lease": lease, "worker": worker}
+
+        if supports_returning(db):
+            pick = (
+                "SELECT id FROM checkout_jobs"
+                " WHERE (status = 'queued' AND available_at <= :now)"
+                " OR (status = 'running' AND locked_until < :now)"
+                " ORDER BY id LIMIT 1"
+            )
+            if db.get_bind().dialect.name == "postgresql":
+                pick += " FOR UPDATE SKIP LOCKED"
+            stmt = text(
+                "UPDATE checkout_jobs SET status = 'running', attempts = attempts + 1,"
+                " locked_by = :worker, locked_until = :lease, updated_at = :now"
+                f" WHERE id = ({pick}) RETURNING id"
+            ).bindparams(
+                bindparam("now", type_=dt),
+                bindparam("lease", type_=dt),
+            )
+            job_id = db.execute(stmt, params).scalar()
+            db.commit()
+            return job_id
+
+        claimable = or_(
+            (CheckoutJob.status == "queued") & (CheckoutJob.available_at <= now),
+            (CheckoutJob.status == "running") & (CheckoutJob.locked_until < now),
+        )
+        job_id = (
+            db.query(CheckoutJob.id)
+            .filter(claimable)
+            .order_by(CheckoutJob.id)
+            .limit(1)
+            .scalar()
+        )
+        if job_id is None:
+            db.rollback()
+            return None
+        claimed = (
+            db.query(CheckoutJob)
+            .filter(CheckoutJob.id == job_id, claimable)
+            .update(
+                {
+                    CheckoutJob.status: "running",
+                    CheckoutJob.attempts: CheckoutJob.attempts + 1,
+                    CheckoutJob.locked_by: worker,
+                    CheckoutJob.locked_until: lease,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return job_id if claimed else None
+
+    def run_once(self, worker: Optional[str] = None) -> Optional[int]:
+        """Claim and run one job; returns its id, or None when nothing was due."""
+        worker = worker or self._worker_id
+        db = self.session_factory()
+        try:
+            job_id = self._claim(db, worker)
+            if job_id is None:
+                return None
+            job = db.get(CheckoutJob, job_id)
+            if job.attempts > settings.CHECKOUT_MAX_ATTEMPTS:
+                self._give_up(db, job, job.last_error or "too many attempts")
+                return job_id
+            try:
+                OrderService(db).run_checkout_job(job)
+            except Exception as e:
+                db.rollback()
+                log.exception("checkout job %s failed at stage %s", job_id, job.stage)
+                job = db.get(CheckoutJob, job_id)
+                if job.attempts >= settings.CHECKOUT_MAX_ATTEMPTS:
+                    self._give_up(db, job, f"{type(e).__name__}: {e}")
+                else:
+                    job.status = "queued"
+                    job.last_error = f"{type(e).__name__}: {e}"[:1024]
+                    job.locked_until = None
+                    job.available_at = datetime.now(timezone.utc) + timedelta(
+                        seconds=settings.CHECKOUT_RETRY_SECONDS * job.attempts
+                    )
+                    db.commit()
+            return job_id
+        finally:
+            db.close()
+
+    def _give_up(self, db, job: CheckoutJob, error: str):
+        job.status = "failed"
+        job.last_error = error[:1024]
+        job.locked_until = None
+        order = db.get(Order, job.order_id)
+        if order and order.status not in ("COMPLETED", "FAILED"):
+            order.status = "FAILED"
+        if job.stage in ("reserve", "charge"):
+            # never paid for: give the basket back instead of waiting for the TTL
+            inventory = InventoryService(db)
+            for rid in (job.data or {}).get("reservation_ids") or []:
+                inventory.release(rid)
+        db.commit()
+
+    def run_pending(self, limit: int = 100) -> List[int]:
+        """Drain due jobs in the calling thread (tests, CLI)."""
+        done = []
+        while len(done) < limit:
+            job_id = self.run_once()
+            if job_id is None:
+                break
+            done.append(job_id)
+        return done
+
+
+checkout_pool = CheckoutWorkerPool()
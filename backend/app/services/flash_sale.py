@@ -0,0 +1,199 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+from app.config import settings
+from app.db import SessionLocal
+
+log = logging.getLogger("flash_sale")
+
+
+class _SkuQueue:
+    __slots__ = ("pending", "worker", "batches", "requests", "max_batch")
+
+    def __init__(self):
+        # (qty, ttl_seconds, reservation_mode, future)
+        self.pending: Deque[Tuple[int, Optional[int], Optional[str], Future]] = deque()
+        self.worker: Optional[threading.Thread] = None
+        self.batches = 0
+        self.requests = 0
+        self.max_batch = 0
+
+
+class FlashSaleCoalescer:
+    """
+    Group commit for hot SKUs.
+
+    Reserve requests for a flash-sale SKU are queued per SKU instead of each
+    taking the SKU lock and running its own transaction. One worker thread
+    per SKU drains the queue: everything waiting (up to `batch_size`) is
+    settled by InventoryService.reserve_group in a single transaction, and
+    each caller's future is resolved with its own reservation id or error.
+    A batch only holds requests of one reservation mode, settled in that mode.
+    While a batch is being written the next one accumulates, so throughput
+    grows with batch size rather than with lock round trips.
+
+    Workers exit after `idle_seconds` without work and restart on demand.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        skus: Optional[Iterable[str]] = None,
+        batch_size: Optional[int] = None,
+        idle_seconds: float = 30.0,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.FLASH_SALE_BATCH
+        self.idle_seconds = idle_seconds
+        self._skus = frozenset(settings.FLASH_SALE_SKUS if skus is None else skus)
+        self._cond = threading.Condition()
+        self._queues: Dict[str, _SkuQueue] = {}
+
+    # --- configuration ---------------------------------------------------------
+
+    @property
+    def skus(self) -> frozenset:
+        return self._skus
+
+    def configure(self, skus: Iterable[str]):
+        """Replace the set of flash-sale SKUs; queued requests are still served."""
+        self._skus = frozenset(skus)
+
+    def handles(self, sku: str) -> bool:
+        return sku in self._skus
+
+    # --- requests --------------------------------------------------------------
+
+    def submit(
+        self,
+        sku: str,
+        qty: int,
+        ttl_seconds: Optional[int] = None,
+        timeout: Optional[float] = None,
+        reservation_mode: Optional[str] = None,
+    ) -> int:
+        """
+        Queue a reservation and wait for its batch; returns the reservation id.
+        A caller that times out after its batch started gets its reservation
+        released as soon as the batch settles, instead of holding the stock
+        until the reservation's TTL.
+        """
+        from app.services.inventory_service import InventoryException
+
+        fut: Future = Future()
+        with self._cond:
+            q = self._queues.get(sku)
+            if q is None:
+                q = self._queues[sku] = _SkuQueue()
+            q.pending.append((qty, ttl_seconds, reservation_mode, fut))
+            if q.worker is None:
+                q.worker = threading.Thread(
+                    target=self._run,
+                    args=(sku, q),
+                    name=f"flash-sale-{sku}",
+                    daemon=True,
+                )
+                q.worker.start()
+            else:
+                self._cond.notify_all()
+
+        timeout = settings.FLASH_SALE_WAIT_SECONDS if timeout is None else timeout
+        try:
+            rid = fut.result(timeout=timeout)
+        except FutureTimeout:
+            # still queued: withdraw it; already in a batch: nobody will hold
+            # the reservation it makes, so give it back once it exists
+            if not fut.cancel():
+                fut.add_done_callback(
+                    lambda f: self._release_abandoned(f, reservation_mode)
+                )
+            raise InventoryException("Reservation queue busy; try again")
+        if rid is None:
+            raise InventoryException("Not enough stock")
+        return rid
+
+    # --- worker ----------------------------------------------------------------
+
+    def _run(self, sku: str, q: _SkuQueue):
+        while True:
+            with self._cond:
+                if not q.pending:
+                    self._cond.wait_for(
+                        lambda: bool(q.pending), timeout=self.idle_seconds
+                    )
+                if not q.pending:
+                    q.worker = None
+                    return
+                batch = []
+                mode = q.pending[0][2]
+                while (
+                    q.pending
+                    and len(batch) < self.batch_size
+                    and q.pending[0][2] == mode
+                ):
+                    item = q.pending.popleft()
+                    # skip callers that gave up before their batch started
+                    if item[3].set_running_or_notify_cancel():
+                        batch.append(item)
+            if batch:
+                self._settle(sku, q, batch, mode)
+
+    def _settle(self, sku: str, q: _SkuQueue, batch, mode: Optional[str] = None):
+        from app.services.inventory_service import InventoryService
+
+        db = self.session_factory()
+        try:
+            ids = InventoryService(db, reservation_mode=mode).reserve_group(
+                sku, [(qty, ttl) for qty, ttl, _, _ in batch]
+            )
+        except Exception as e:
+            db.rollback()
+            log.warning("flash-sale batch for %s failed: %s", sku, e)
+            for _, _, _, fut in batch:
+                fut.set_exception(e)
+            return
+        finally:
+            db.close()
+        with self._cond:
+            q.batches += 1
+            q.requests += len(batch)
+            q.max_batch = max(q.max_batch, len(batch))
+        for rid, (_, _, _, fut) in zip(ids, batch):
+            fut.set_result(rid)
+
+    def _release_abandoned(self, fut: Future, mode: Optional[str]):
+        from app.services.inventory_service import InventoryService
+
+        if fut.cancelled() or fut.exception() is not None or fut.result() is None:
+            return
+        db = self.session_factory()
+        try:
+            InventoryService(db, reservation_mode=mode).release(fut.result())
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            log.warning("could not release abandoned reservation: %s", e)
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "skus": sorted(self._skus),
+                "queues": {
+                    sku: {
+                        "pending": len(q.pending),
+                        "batches": q.batches,
+                        "requests": q.requests,
+                        "max_batch": q.max_batch,
+                    }
+                    for sku, q in self._queues.items()
+                },
+            }
+
+
+flash_sale = FlashSaleCoalescer()
@@ -12,6 +12,15 @@ class FulfilmentException(Exception):
     pass
 
 
+def on_order_completed(db: Session, payload: Dict):
+    """Outbox handler for order.completed: queue the order for packing."""
+    order_id = payload["order_id"]
+    # delivery is at least once: a redelivered event must not add a second task
+    if db.query(PackingTask.id).filter(PackingTask.order_id == order_id).first():
+        return
+    FulfilmentService(db).create_packing_task_for_order(order_id)
+
+
 class FulfilmentService:
     def __init__(
         self, db: Session, courier_adapter: Optional[MockCourierAdapter] = None
@@ -0,0 +1,271 @@
+import heapq
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+
+_PENDING_KEY = "inventory_ledger_ops"
+
+
+def _as_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    # SQLite hands DateTime columns back naive; they were written as UTC.
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+@dataclass
+class LedgerOp:
+    """
+    A single committed change to a SKU's (stock, reserved) position.
+
+    kind: reserve | extend | release | expire | commit | stock | invalidate
+    `stock` carries the absolute stock value after the change (commit/stock ops),
+    which keeps replays idempotent when an entry was loaded mid-transaction;
+    when it is unknown the SKU is simply reloaded.
+    """
+
+    kind: str
+    sku: str
+    reservation_id: Optional[int] = None
+    quantity: int = 0
+    reserved_until: Optional[datetime] = None
+    stock: Optional[int] = None
+
+
+class _SkuEntry:
+    __slots__ = ("stock", "reserved", "holds", "deadlines", "loaded_at")
+
+    def __init__(self, stock: int):
+        self.stock = stock
+        self.reserved = 0
+        # reservation_id -> (quantity, reserved_until)
+        self.holds: Dict[int, Tuple[int, Optional[datetime]]] = {}
+        # lazy min-heap of (reserved_until, reservation_id); stale items are skipped on pop
+        self.deadlines: List[Tuple[datetime, int]] = []
+        self.loaded_at = time.monotonic()
+
+    def add(self, rid: int, qty: int, until: Optional[datetime]):
+        if rid in self.holds:
+            return
+        self.holds[rid] = (qty, until)
+        self.reserved += qty
+        if until is not None:
+            heapq.heappush(self.deadlines, (until, rid))
+
+    def extend(self, rid: int, qty: int, until: Optional[datetime]):
+        if rid not in self.holds:
+            self.add(rid, qty, until)
+            return
+        # the old heap item no longer matches the hold and is skipped by prune
+        self.holds[rid] = (self.holds[rid][0], until)
+        if until is not None:
+            heapq.heappush(self.deadlines, (until, rid))
+
+    def drop(self, rid: int) -> int:
+        hold = self.holds.pop(rid, None)
+        if hold is None:
+            return 0
+        self.reserved -= hold[0]
+        return hold[0]
+
+    def prune(self, now: datetime):
+        while self.deadlines and self.deadlines[0][0] <= now:
+            until, rid = heapq.heappop(self.deadlines)
+            hold = self.holds.get(rid)
+            # only drop if the hold still carries this deadline (it may have been re-added)
+            if hold is not None and hold[1] == until:
+                self.drop(rid)
+
+
+class InventoryLedger:
+    """
+    Write-through, per-process view of (stock, reserved) per SKU.
+
+    Entries are loaded lazily from the DB, updated from committed LedgerOps and
+    reloaded when they age past `resync_seconds` or disagree with a locked
+    product row (drift). Reads are O(1) amortised: lapsed reservations are
+    pruned off a per-SKU deadline heap, so availability stays correct between
+    expire_overdue runs.
+
+    The ledger only sees writes made by this process; deployments running
+    several workers should rely on the resync window or disable it.
+    """
+
+    def __init__(self, resync_seconds: float = 60.0):
+        self.resync_seconds = resync_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _SkuEntry] = {}
+        # bumped on every op/invalidation so a slow loader cannot install stale data
+        self._generations: Dict[str, int] = {}
+
+    # --- reads -------------------------------------------------------------
+
+    def _fresh_entry(self, sku: str) -> Optional[_SkuEntry]:
+        entry = self._entries.get(sku)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.loaded_at > self.resync_seconds:
+            del self._entries[sku]
+            return None
+        return entry
+
+    def available(self, sku: str, now: Optional[datetime] = None) -> Optional[int]:
+        """Return cached availability, or None when the SKU must be read from the DB."""
+        now = _as_utc(now) or datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._fresh_entry(sku)
+            if entry is None:
+                return None
+            entry.prune(now)
+            return max(0, entry.stock - entry.reserved)
+
+    def reserved(
+        self, sku: str, stock: int, now: Optional[datetime] = None
+    ) -> Optional[int]:
+        """
+        Return the active reserved quantity for `sku` if the cached entry agrees
+        with `stock` (read from a locked product row). A mismatch is treated as
+        drift and the entry is dropped.
+        """
+        now = _as_utc(now) or datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._fresh_entry(sku)
+            if entry is None:
+                return None
+            if entry.stock != stock:
+                self._drop(sku)
+                return None
+            entry.prune(now)
+            return entry.reserved
+
+    def generation(self, sku: str) -> int:
+        with self._lock:
+            return self._generations.get(sku, 0)
+
+    # --- writes ------------------------------------------------------------
+
+    def load(
+        self,
+        sku: str,
+        stock: int,
+        holds: Iterable[Tuple[int, int, Optional[datetime]]],
+        generation: int,
+    ) -> bool:
+        """
+        Install an entry built from DB rows `(reservation_id, quantity, reserved_until)`.
+        Skipped when an op for the SKU was applied after `generation` was read.
+        """
+        entry = _SkuEntry(int(stock))
+        for rid, qty, until in holds:
+            entry.add(rid, int(qty), _as_utc(until))
+        with self._lock:
+            if self._generations.get(sku, 0) != generation:
+                return False
+            self._entries[sku] = entry
+            return True
+
+    def apply(self, op: LedgerOp):
+        with self._lock:
+            self._generations[op.sku] = self._generations.get(op.sku, 0) + 1
+            entry = self._entries.get(op.sku)
+            if entry is None:
+                return
+            if op.kind == "reserve":
+                entry.add(op.reservation_id, op.quantity, _as_utc(op.reserved_until))
+            elif op.kind == "extend":
+                entry.extend(op.reservation_id, op.quantity, _as_utc(op.reserved_until))
+            elif op.kind in ("release", "expire"):
+                entry.drop(op.reservation_id)
+            elif op.kind in ("commit", "stock") and op.stock is not None:
+                entry.drop(op.reservation_id)
+                entry.stock = op.stock
+            else:
+                self._drop(op.sku)
+
+    def invalidate(self, sku: Optional[str] = None):
+        # generations stay monotonic so loaders that started earlier are rejected
+        with self._lock:
+            if sku is None:
+                for key in list(self._entries):
+                    self._drop(key)
+            else:
+                self._drop(sku)
+
+    def _drop(self, sku: str):
+        self._entries.pop(sku, None)
+        self._generations[sku] = self._generations.get(sku, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"skus": len(self._entries)}
+
+
+ledger = InventoryLedger(resync_seconds=settings.INVENTORY_LEDGER_RESYNC_SECONDS)
+
+# callables invoked with the list of ops from each committed transaction
+_listeners: List[Callable[[List[LedgerOp]], None]] = []
+
+
+def add_listener(fn: Callable[[List[LedgerOp]], None]):
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def remove_listener(fn: Callable[[List[LedgerOp]], None]):
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+
+def record(session: Session, op: LedgerOp):
+    """Queue `op` on the session; it is applied to the ledger once the session commits."""
+    session.info.setdefault(_PENDING_KEY, []).append(op)
+
+
+def has_pending(session: Session, sku: str) -> bool:
+    return any(op.sku == sku for op in session.info.get(_PENDING_KEY, ()))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session):
+    # SAVEPOINT releases also fire after_commit; only the outermost commit is durable.
+    if session.in_nested_transaction():
+        return
+    ops = session.info.pop(_PENDING_KEY, None)
+    if not ops:
+        return
+    for op in ops:
+        ledger.apply(op)
+    for fn in list(_listeners):
+        try:
+            fn(ops)
+        except Exception:
+            # listeners must never break the committing request
+            pass
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    if session.in_nested_transaction():
+        # We cannot tell which queued ops belonged to the rolled-back savepoint,
+        # so downgrade them all to invalidations; the SKUs reload on next read.
+        ops = session.info.get(_PENDING_KEY)
+        if ops:
+            session.info[_PENDING_KEY] = [
+                LedgerOp(kind="invalidate", sku=op.sku) for op in ops
+            ]
+        return
+    session.info.pop(_PENDING_KEY, None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_leftovers(session, transaction):
+    # Session.close() ends the root transaction without an after_rollback event.
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
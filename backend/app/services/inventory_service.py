@@ -1,61 +1,259 @@
-import os
 import sys
-import tempfile
+from contextlib import ExitStack
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from filelock import FileLock, Timeout
-from sqlalchemy import func
+from sqlalchemy import Integer, and_, bindparam, case, func, text
 from sqlalchemy.orm import Session
 
 from app.config import settings
 from app.models.inventory_reservation import InventoryReservation
 from app.models.product import Product
+from app.services.flash_sale import flash_sale
+from app.services.inventory_ledger import (
+    LedgerOp,
+    add_listener,
+    has_pending,
+    ledger,
+    record,
+)
+from app.utils.lock_manager import LockTimeout, get_lock_manager
+from app.utils.sql import insert_returning_ids, supports_returning
+from app.utils.tracing import tracer
 from app.utils.transactions import smart_transaction
+from app.utils.ttl_cache import TTLCache
 
 
 class InventoryException(Exception):
     pass
 
 
+class _CounterRace(Exception):
+    """A conditional counter UPDATE lost to a concurrent writer (cas mode)."""
+
+
+# absorbs polling storms on the bulk availability endpoint; entries are dropped
+# as soon as this process commits a change to the SKU
+_availability_cache = TTLCache(
+    maxsize=10000, ttl_seconds=settings.AVAILABILITY_CACHE_TTL_MS / 1000.0
+)
+
+
+def _evict_availability(ops):
+    for op in ops:
+        _availability_cache.pop(op.sku)
+
+
+add_listener(_evict_availability)
+
+
+RESERVATION_MODES = ("lock", "cas")
+
+
 class InventoryService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, reservation_mode: Optional[str] = None):
         self.db = db
+        self.locks = get_lock_manager()
+        # "lock": per-SKU lock + SUM check; "cas": conditional UPDATE on Product.reserved_qty
+        self.reservation_mode = reservation_mode or settings.RESERVATION_MODE
+        if self.reservation_mode not in RESERVATION_MODES:
+            raise InventoryException(
+                f"Unknown reservation mode: {self.reservation_mode}"
+            )
 
     def _now(self) -> datetime:
         return datetime.now(timezone.utc)
 
-    def available_quantity(self, sku: str) -> int:
-        """
-        Determine available quantity = product.stock - sum(active reservations)
-        """
+    def _product_query(self, sku: str):
         qry = self.db.query(Product).filter(Product.sku == sku)
-
-        # Only add active filter if the Product model actually has that attribute
         if hasattr(Product, "active"):
             qry = qry.filter(Product.active == True)
+        return qry
 
-        # Acquire row-level lock when available (SQLAlchemy with_for_update)
-        try:
-            product = qry.with_for_update().first()
-        except Exception:
-            # Some DB dialects/environments don't support with_for_update; fall back to plain first()
-            product = qry.first()
+    def _adjust_reserved_qty(self, sku: str, delta: int):
+        """Keep the Product.reserved_qty counter in step with active reservations."""
+        self.db.query(Product).filter(Product.sku == sku).update(
+            {Product.reserved_qty: Product.reserved_qty + delta},
+            synchronize_session=False,
+        )
 
-        if not product:
-            raise InventoryException("SKU not found")
-        now = self._now()
-        reserved_sum = (
-            self.db.query(func.coalesce(func.sum(InventoryReservation.quantity), 0))
+    def _reserved_quantity(
+        self, sku: str, stock: int, now: datetime, from_ledger: bool = False
+    ) -> int:
+        """
+        Sum of active reservations for `sku`, read from the DB and (re)loaded into
+        the in-process ledger. Lock-free reads pass `from_ledger` to be served from
+        the ledger when its entry agrees with `stock`; checks made under the SKU
+        lock never do, as the ledger cannot see other processes' reservations.
+        """
+        use_ledger = settings.INVENTORY_LEDGER_ENABLED
+        if use_ledger:
+            cached = ledger.reserved(sku, stock, now) if from_ledger else None
+            if cached is not None:
+                return cached
+            generation = ledger.generation(sku)
+
+        holds = (
+            self.db.query(
+                InventoryReservation.id,
+                InventoryReservation.quantity,
+                InventoryReservation.reserved_until,
+            )
             .filter(
                 InventoryReservation.sku == sku,
                 InventoryReservation.status == "reserved",
                 InventoryReservation.reserved_until > now,
             )
-            .scalar()
-            or 0
+            .all()
+        )
+        # don't publish state that includes this session's uncommitted writes
+        if use_ledger and not has_pending(self.db, sku):
+            ledger.load(sku, stock, holds, generation)
+        return sum(int(h.quantity) for h in holds)
+
+    def _reserved_quantities(
+        self, stocks: Dict[str, int], now: datetime
+    ) -> Dict[str, int]:
+        """
+        Batched _reserved_quantity for checks under the SKU locks: `stocks` maps
+        sku -> locked product stock. One query across all SKUs, which also
+        reloads their ledger entries.
+        """
+        if not stocks:
+            return {}
+        use_ledger = settings.INVENTORY_LEDGER_ENABLED
+        generations = {sku: ledger.generation(sku) for sku in stocks}
+
+        holds = {sku: [] for sku in stocks}
+        for h in self.db.query(
+            InventoryReservation.id,
+            InventoryReservation.sku,
+            InventoryReservation.quantity,
+            InventoryReservation.reserved_until,
+        ).filter(
+            InventoryReservation.sku.in_(list(stocks)),
+            InventoryReservation.status == "reserved",
+            InventoryReservation.reserved_until > now,
+        ):
+            holds[h.sku].append((h.id, h.quantity, h.reserved_until))
+        out = {}
+        for sku, stock in stocks.items():
+            if use_ledger and not has_pending(self.db, sku):
+                ledger.load(sku, stock, holds[sku], generations[sku])
+            out[sku] = sum(int(qty) for _, qty, _ in holds[sku])
+        return out
+
+    def warm_ledger(self) -> int:
+        """
+        Rebuild the availability ledger for every active SKU from the DB.
+        Called on startup; returns the number of SKUs loaded.
+        """
+        if not settings.INVENTORY_LEDGER_ENABLED:
+            return 0
+        ledger.invalidate()
+        now = self._now()
+        qry = self.db.query(Product.sku, Product.stock)
+        if hasattr(Product, "active"):
+            qry = qry.filter(Product.active == True)
+        products = qry.all()
+        generations = {p.sku: ledger.generation(p.sku) for p in products}
+
+        holds = {}
+        for h in self.db.query(
+            InventoryReservation.id,
+            InventoryReservation.sku,
+            InventoryReservation.quantity,
+            InventoryReservation.reserved_until,
+        ).filter(
+            InventoryReservation.status == "reserved",
+            InventoryReservation.reserved_until > now,
+        ):
+            holds.setdefault(h.sku, []).append((h.id, h.quantity, h.reserved_until))
+
+        loaded = 0
+        for p in products:
+            if ledger.load(p.sku, p.stock, holds.get(p.sku, ()), generations[p.sku]):
+                loaded += 1
+        return loaded
+
+    def available_quantity(self, sku: str) -> int:
+        """
+        Determine available quantity = product.stock - sum(active reservations)
+        """
+        if self.reservation_mode == "cas":
+            product = self._product_query(sku).first()
+            if not product:
+                raise InventoryException("SKU not found")
+            return max(0, product.stock - (product.reserved_qty or 0))
+
+        if settings.INVENTORY_LEDGER_ENABLED:
+            cached = ledger.available(sku, self._now())
+            if cached is not None:
+                return cached
+
+        # read-only path: no row lock
+        product = self._product_query(sku).first()
+        if not product:
+            raise InventoryException("SKU not found")
+        reserved_sum = self._reserved_quantity(
+            sku, product.stock, self._now(), from_ledger=True
         )
-        return max(0, product.stock - int(reserved_sum))
+        return max(0, product.stock - reserved_sum)
+
+    def available_quantities(
+        self, skus: List[str], use_cache: bool = True
+    ) -> Dict[str, int]:
+        """
+        Availability for many SKUs at once, without row locks. Unknown or inactive
+        SKUs are absent from the result. Ledger hits and (optionally) the sub-second
+        micro-cache are consulted first; everything else is one grouped
+        products LEFT JOIN inventory_reservations query.
+        """
+        out: Dict[str, int] = {}
+        missing = []
+        for sku in dict.fromkeys(skus):
+            cached = _availability_cache.get(sku) if use_cache else None
+            if cached is None and self.reservation_mode == "lock":
+                if settings.INVENTORY_LEDGER_ENABLED:
+                    cached = ledger.available(sku, self._now())
+            if cached is None:
+                missing.append(sku)
+            else:
+                out[sku] = cached
+        if not missing:
+            return out
+
+        if self.reservation_mode == "cas":
+            qry = self.db.query(
+                Product.sku, Product.stock - Product.reserved_qty
+            ).filter(Product.sku.in_(missing))
+        else:
+            qry = (
+                self.db.query(
+                    Product.sku,
+                    Product.stock
+                    - func.coalesce(func.sum(InventoryReservation.quantity), 0),
+                )
+                .outerjoin(
+                    InventoryReservation,
+                    and_(
+                        InventoryReservation.sku == Product.sku,
+                        InventoryReservation.status == "reserved",
+                        InventoryReservation.reserved_until > self._now(),
+                    ),
+                )
+                .filter(Product.sku.in_(missing))
+                .group_by(Product.sku, Product.stock)
+            )
+        if hasattr(Product, "active"):
+            qry = qry.filter(Product.active == True)
+
+        for sku, available in qry.all():
+            available = max(0, int(available))
+            out[sku] = available
+            if use_cache:
+                _availability_cache.set(sku, available)
+        return out
 
     def reserve(
         self, sku: str, qty: int, ttl_seconds: Optional[int] = None
@@ -66,14 +264,19 @@ class InventoryService:
         now = self._now()
         reserved_until = now + timedelta(seconds=ttl_seconds)
 
-        tempdir = tempfile.gettempdir()
-        locks_dir = os.path.join(tempdir, "yourlocalshop_locks")
-        os.makedirs(locks_dir, exist_ok=True)
-        lockfile = os.path.join(locks_dir, f"reserve_{sku}.lock")
+        if flash_sale.handles(sku) and not self.db.in_transaction():
+            # hot SKU: join the next group commit instead of queueing on the lock;
+            # only outside a caller's transaction, as the batch commits on its own
+            rid = flash_sale.submit(
+                sku, qty, ttl_seconds, reservation_mode=self.reservation_mode
+            )
+            return self.db.get(InventoryReservation, rid)
+
+        if self.reservation_mode == "cas":
+            return self._reserve_cas(sku, qty, now, reserved_until)
 
-        lock = FileLock(lockfile)
         try:
-            with lock.acquire(timeout=10):
+            with self.locks.acquire(sku):
                 # Use smart_transaction to handle nested tx correctly
                 with smart_transaction(self.db):
                     qry = self.db.query(Product).filter(Product.sku == sku)
@@ -88,24 +291,14 @@ class InventoryService:
                     if not product:
                         raise InventoryException("SKU not found")
 
-                    reserved_sum = (
-                        self.db.query(
-                            func.coalesce(func.sum(InventoryReservation.quantity), 0)
-                        )
-                        .filter(
-                            InventoryReservation.sku == sku,
-                            InventoryReservation.status == "reserved",
-                            InventoryReservation.reserved_until > now,
-                        )
-                        .scalar()
-                        or 0
-                    )
+                    reserved_sum = self._reserved_quantity(sku, product.stock, now)
 
-                    available = product.stock - int(reserved_sum)
+                    available = product.stock - reserved_sum
                     if available < qty:
                         raise InventoryException(
                             f"Not enough stock. Available={available}"
                         )
+                    product.reserved_qty = Product.reserved_qty + qty
 
                     r = InventoryReservation(
                         sku=sku,
@@ -116,13 +309,411 @@ class InventoryService:
                     )
                     self.db.add(r)
                     self.db.flush()  # ensure id assigned
+                    record(
+                        self.db,
+                        LedgerOp(
+                            kind="reserve",
+                            sku=sku,
+                            reservation_id=r.id,
+                            quantity=qty,
+                            reserved_until=reserved_until,
+                        ),
+                    )
                     # commit happens at smart_transaction context exit
                 # after commit the row is durable — refresh the instance from the DB session
                 self.db.refresh(r)
                 return r
-        except Timeout:
+        except LockTimeout:
             raise InventoryException("Could not acquire reservation lock; try again")
 
+    def _reserve_cas(
+        self, sku: str, qty: int, now: datetime, reserved_until: datetime
+    ) -> InventoryReservation:
+        """
+        Lock-free reservation: claim `qty` with a single conditional
+        UPDATE products SET reserved_qty = reserved_qty + :qty
+        WHERE sku = :sku AND stock - reserved_qty >= :qty
+        and insert the reservation row in the same transaction.
+        """
+        with smart_transaction(self.db):
+            claimed = (
+                self._product_query(sku)
+                .filter(Product.stock - Product.reserved_qty >= qty)
+                .update(
+                    {Product.reserved_qty: Product.reserved_qty + qty},
+                    synchronize_session=False,
+                )
+            )
+            if not claimed:
+                # distinguish an unknown SKU from insufficient stock
+                product = self._product_query(sku).first()
+                if not product:
+                    raise InventoryException("SKU not found")
+                available = max(0, product.stock - (product.reserved_qty or 0))
+                raise InventoryException(f"Not enough stock. Available={available}")
+
+            r = InventoryReservation(
+                sku=sku,
+                quantity=qty,
+                reserved_at=now,
+                reserved_until=reserved_until,
+                status="reserved",
+            )
+            self.db.add(r)
+            self.db.flush()
+            record(
+                self.db,
+                LedgerOp(
+                    kind="reserve",
+                    sku=sku,
+                    reservation_id=r.id,
+                    quantity=qty,
+                    reserved_until=reserved_until,
+                ),
+            )
+        self.db.refresh(r)
+        return r
+
+    def reserve_many(
+        self, lines: List[Dict], ttl_seconds: Optional[int] = None
+    ) -> List[InventoryReservation]:
+        """
+        Reserve a whole basket atomically in one transaction.
+
+        lines: list of {sku: str, qty: int}; one reservation is created per line and
+        returned in the same order. Either every line is reserved or none is.
+        Per-SKU locks and product row locks are taken in sorted SKU order, so two
+        baskets sharing SKUs cannot deadlock.
+        """
+        if not lines:
+            return []
+        wanted: Dict[str, int] = {}
+        for line in lines:
+            qty = int(line.get("qty", 0))
+            if qty <= 0:
+                raise InventoryException("Quantity must be positive")
+            wanted[line["sku"]] = wanted.get(line["sku"], 0) + qty
+        skus = sorted(wanted)
+
+        ttl_seconds = ttl_seconds or settings.RESERVATION_TTL_SECONDS
+        now = self._now()
+        reserved_until = now + timedelta(seconds=ttl_seconds)
+
+        try:
+            with ExitStack() as held:
+                if self.reservation_mode == "lock":
+                    # acquire_many sorts and de-duplicates the lock slots
+                    with tracer.span("inventory.lock_wait", skus=len(skus)):
+                        held.enter_context(self.locks.acquire_many(skus))
+                with smart_transaction(self.db):
+                    ids = self._reserve_many_locked(lines, wanted, now, reserved_until)
+        except LockTimeout:
+            raise InventoryException("Could not acquire reservation lock; try again")
+
+        # one query to bring the committed rows back into the session
+        by_id = {
+            r.id: r
+            for r in self.db.query(InventoryReservation).filter(
+                InventoryReservation.id.in_(ids)
+            )
+        }
+        return [by_id[rid] for rid in ids]
+
+    def _reserve_many_locked(
+        self,
+        lines: List[Dict],
+        wanted: Dict[str, int],
+        now: datetime,
+        reserved_until: datetime,
+    ) -> List[int]:
+        skus = sorted(wanted)
+        qry = self.db.query(Product).filter(Product.sku.in_(skus))
+        if hasattr(Product, "active"):
+            qry = qry.filter(Product.active == True)
+        qry = qry.order_by(Product.sku)
+        try:
+            products = {p.sku: p for p in qry.with_for_update().all()}
+        except Exception:
+            products = {p.sku: p for p in qry.all()}
+
+        missing = [sku for sku in skus if sku not in products]
+        if missing:
+            raise InventoryException(f"SKU not found: {', '.join(missing)}")
+
+        if self.reservation_mode == "cas":
+            reserved = {sku: products[sku].reserved_qty or 0 for sku in skus}
+        else:
+            reserved = self._reserved_quantities(
+                {sku: products[sku].stock for sku in skus}, now
+            )
+        for sku in skus:
+            available = products[sku].stock - reserved[sku]
+            if available < wanted[sku]:
+                raise InventoryException(
+                    f"Not enough stock for {sku}. Available={max(0, available)}"
+                )
+
+        # one UPDATE for every counter
+        delta = case(wanted, value=Product.sku, else_=0)
+        counters = self.db.query(Product).filter(Product.sku.in_(skus))
+        if self.reservation_mode == "cas":
+            # no per-SKU lock in this mode: re-check in the UPDATE for dialects without row locks
+            counters = counters.filter(Product.stock - Product.reserved_qty >= delta)
+        claimed = counters.update(
+            {Product.reserved_qty: Product.reserved_qty + delta},
+            synchronize_session=False,
+        )
+        if claimed != len(skus):
+            raise InventoryException("Not enough stock (race)")
+
+        rows = [
+            {
+                "sku": line["sku"],
+                "quantity": int(line["qty"]),
+                "reserved_at": now,
+                "reserved_until": reserved_until,
+                "status": "reserved",
+            }
+            for line in lines
+        ]
+        ids = insert_returning_ids(
+            self.db, InventoryReservation.__table__, rows, match=("sku", "quantity")
+        )
+        for rid, row in zip(ids, rows):
+            record(
+                self.db,
+                LedgerOp(
+                    kind="reserve",
+                    sku=row["sku"],
+                    reservation_id=rid,
+                    quantity=row["quantity"],
+                    reserved_until=reserved_until,
+                ),
+            )
+        return ids
+
+    def reserve_baskets(
+        self, baskets: List[List[Dict]], ttl_seconds: Optional[int] = None
+    ) -> List[Optional[List[InventoryReservation]]]:
+        """
+        Grouped reserve_many for a batch of independent baskets: one lock pass
+        over the union of their SKUs, one product read, one counter UPDATE and
+        one multi-row INSERT. Baskets are granted whole, first come first
+        served while stock lasts; returns each basket's reservations (in line
+        order), or None for baskets that did not fit or name an unknown SKU.
+        """
+        if not baskets:
+            return []
+        for basket in baskets:
+            if any(int(line.get("qty", 0)) <= 0 for line in basket):
+                raise InventoryException("Quantity must be positive")
+        skus = sorted({line["sku"] for basket in baskets for line in basket})
+
+        ttl_seconds = ttl_seconds or settings.RESERVATION_TTL_SECONDS
+        now = self._now()
+        reserved_until = now + timedelta(seconds=ttl_seconds)
+
+        try:
+            with ExitStack() as held:
+                if self.reservation_mode == "lock":
+                    with tracer.span("inventory.lock_wait", skus=len(skus)):
+                        held.enter_context(self.locks.acquire_many(skus))
+                # cas mode re-reads and retries when a concurrent writer moved a counter
+                for _ in range(3):
+                    try:
+                        with smart_transaction(self.db):
+                            granted = self._reserve_baskets_locked(
+                                baskets, skus, now, reserved_until
+                            )
+                        break
+                    except _CounterRace:
+                        continue
+                else:
+                    raise InventoryException("Not enough stock (race)")
+        except LockTimeout:
+            raise InventoryException("Could not acquire reservation lock; try again")
+
+        ids = [rid for basket_ids in granted if basket_ids for rid in basket_ids]
+        by_id = {
+            r.id: r
+            for r in self.db.query(InventoryReservation).filter(
+                InventoryReservation.id.in_(ids)
+            )
+        }
+        return [
+            [by_id[rid] for rid in basket_ids] if basket_ids else None
+            for basket_ids in granted
+        ]
+
+    def _reserve_baskets_locked(
+        self,
+        baskets: List[List[Dict]],
+        skus: List[str],
+        now: datetime,
+        reserved_until: datetime,
+    ) -> List[Optional[List[int]]]:
+        qry = self.db.query(Product).filter(Product.sku.in_(skus))
+        if hasattr(Product, "active"):
+            qry = qry.filter(Product.active == True)
+        qry = qry.order_by(Product.sku)
+        try:
+            products = {p.sku: p for p in qry.with_for_update().all()}
+        except Exception:
+            products = {p.sku: p for p in qry.all()}
+
+        if self.reservation_mode == "cas":
+            reserved = {sku: p.reserved_qty or 0 for sku, p in products.items()}
+        else:
+            reserved = self._reserved_quantities(
+                {sku: p.stock for sku, p in products.items()}, now
+            )
+        available = {sku: p.stock - reserved[sku] for sku, p in products.items()}
+
+        wanted: Dict[str, int] = {}
+        rows, slots = [], []
+        for i, basket in enumerate(baskets):
+            need: Dict[str, int] = {}
+            for line in basket:
+                need[line["sku"]] = need.get(line["sku"], 0) + int(line["qty"])
+            if any(available.get(sku, 0) < qty for sku, qty in need.items()):
+                continue
+            for sku, qty in need.items():
+                available[sku] -= qty
+                wanted[sku] = wanted.get(sku, 0) + qty
+            for line in basket:
+                slots.append(i)
+                rows.append(
+                    {
+                        "sku": line["sku"],
+                        "quantity": int(line["qty"]),
+                        "reserved_at": now,
+                        "reserved_until": reserved_until,
+                        "status": "reserved",
+                    }
+                )
+        out: List[Optional[List[int]]] = [None] * len(baskets)
+        if not rows:
+            return out
+
+        delta = case(wanted, value=Product.sku, else_=0)
+        counters = self.db.query(Product).filter(Product.sku.in_(list(wanted)))
+        if self.reservation_mode == "cas":
+            counters = counters.filter(Product.stock - Product.reserved_qty >= delta)
+        claimed = counters.update(
+            {Product.reserved_qty: Product.reserved_qty + delta},
+            synchronize_session=False,
+        )
+        if claimed != len(wanted):
+            # roll the savepoint back: some counters may already have moved
+            raise _CounterRace()
+
+        # reserved_until is shared by the whole batch
+        ids = insert_returning_ids(
+            self.db, InventoryReservation.__table__, rows, match=("sku", "quantity")
+        )
+        for i, rid, row in zip(slots, ids, rows):
+            out[i] = (out[i] or []) + [rid]
+            record(
+                self.db,
+                LedgerOp(
+                    kind="reserve",
+                    sku=row["sku"],
+                    reservation_id=rid,
+                    quantity=row["quantity"],
+                    reserved_until=reserved_until,
+                ),
+            )
+        return out
+
+    def reserve_group(
+        self, sku: str, requests: List[Tuple[int, int]]
+    ) -> List[Optional[int]]:
+        """
+        Group commit for one hot SKU: settle many independent reserve requests
+        (qty, ttl_seconds) with one availability check, one counter UPDATE, one
+        multi-row INSERT and one commit. Requests are granted first come, first
+        served while stock lasts; returns the reservation id per request, or None
+        for requests that did not fit. Used by the flash-sale coalescer.
+        """
+        now = self._now()
+        try:
+            with ExitStack() as held:
+                if self.reservation_mode == "lock":
+                    held.enter_context(self.locks.acquire(sku))
+                # cas mode re-reads and retries when a concurrent writer moved the counter
+                for _ in range(3):
+                    with smart_transaction(self.db):
+                        granted = self._reserve_group_locked(sku, requests, now)
+                    if granted is not None:
+                        return granted
+                raise InventoryException("Not enough stock (race)")
+        except LockTimeout:
+            raise InventoryException("Could not acquire reservation lock; try again")
+
+    def _reserve_group_locked(
+        self, sku: str, requests: List[Tuple[int, int]], now: datetime
+    ) -> Optional[List[Optional[int]]]:
+        try:
+            product = self._product_query(sku).with_for_update().first()
+        except Exception:
+            product = self._product_query(sku).first()
+        if not product:
+            raise InventoryException("SKU not found")
+
+        if self.reservation_mode == "cas":
+            available = product.stock - (product.reserved_qty or 0)
+        else:
+            available = product.stock - self._reserved_quantity(sku, product.stock, now)
+
+        rows, slots = [], []
+        for i, (qty, ttl) in enumerate(requests):
+            if qty <= available:
+                available -= qty
+                slots.append(i)
+                rows.append(
+                    {
+                        "sku": sku,
+                        "quantity": qty,
+                        "reserved_at": now,
+                        "reserved_until": now
+                        + timedelta(seconds=ttl or settings.RESERVATION_TTL_SECONDS),
+                        "status": "reserved",
+                    }
+                )
+        out: List[Optional[int]] = [None] * len(requests)
+        if not rows:
+            return out
+
+        total = sum(r["quantity"] for r in rows)
+        counters = self.db.query(Product).filter(Product.sku == sku)
+        if self.reservation_mode == "cas":
+            counters = counters.filter(Product.stock - Product.reserved_qty >= total)
+        if not counters.update(
+            {Product.reserved_qty: Product.reserved_qty + total},
+            synchronize_session=False,
+        ):
+            return None
+
+        ids = insert_returning_ids(
+            self.db,
+            InventoryReservation.__table__,
+            rows,
+            match=("quantity", "reserved_until"),
+        )
+        for i, rid, row in zip(slots, ids, rows):
+            out[i] = rid
+            record(
+                self.db,
+                LedgerOp(
+                    kind="reserve",
+                    sku=sku,
+                    reservation_id=rid,
+                    quantity=row["quantity"],
+                    reserved_until=row["reserved_until"],
+                ),
+            )
+        return out
+
     def release(self, reservation_id: int) -> InventoryReservation:
         r = (
             self.db.query(InventoryReservation)
@@ -135,9 +726,103 @@ class InventoryService:
         if r.status != "reserved":
             return r
         r.status = "released"
+        self._adjust_reserved_qty(r.sku, -r.quantity)
         self.db.flush()
+        record(self.db, LedgerOp(kind="release", sku=r.sku, reservation_id=r.id))
         return r
 
+    def extend(
+        self, reservation_id: int, ttl_seconds: Optional[int] = None
+    ) -> InventoryReservation:
+        """
+        Heartbeat: hold an active reservation for another `ttl_seconds` from now.
+        One conditional UPDATE, no SKU lock and no availability check, since the
+        quantity held does not change. Lapsed or finished reservations are refused.
+        """
+        extended, _ = self.extend_many([reservation_id], ttl_seconds=ttl_seconds)
+        if not extended:
+            raise InventoryException("Reservation not active")
+        return self.db.get(InventoryReservation, reservation_id)
+
+    def extend_many(
+        self, reservation_ids: List[int], ttl_seconds: Optional[int] = None
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Extend several reservations with a single UPDATE. Not all-or-nothing:
+        returns (extended_ids, not_active_ids), each in request order.
+        """
+        ids = list(dict.fromkeys(int(i) for i in reservation_ids))
+        if not ids:
+            return [], []
+        ttl_seconds = ttl_seconds or settings.RESERVATION_TTL_SECONDS
+        if ttl_seconds <= 0:
+            raise InventoryException("ttl_seconds must be positive")
+        now = self._now()
+        until = now + timedelta(seconds=ttl_seconds)
+
+        with smart_transaction(self.db):
+            rows = self._extend_rows(ids, now, until)
+            for rid, sku, qty in rows:
+                record(
+                    self.db,
+                    LedgerOp(
+                        kind="extend",
+                        sku=sku,
+                        reservation_id=rid,
+                        quantity=qty,
+                        reserved_until=until,
+                    ),
+                )
+
+        done = {rid for rid, _, _ in rows}
+        for obj in list(self.db.identity_map.values()):
+            if isinstance(obj, InventoryReservation) and obj.id in done:
+                self.db.expire(obj, ["reserved_until"])
+        return [i for i in ids if i in done], [i for i in ids if i not in done]
+
+    def _extend_rows(
+        self, ids: List[int], now: datetime, until: datetime
+    ) -> List[tuple]:
+        """UPDATE reserved_until where still active; returns (id, sku, quantity) rows."""
+        table = InventoryReservation.__table__
+        if supports_returning(self.db):
+            stmt = text(
+                "UPDATE inventory_reservations SET reserved_until = :until"
+                " WHERE id IN :ids AND status = 'reserved' AND reserved_until > :now"
+                " RETURNING id, sku, quantity"
+            ).bindparams(
+                bindparam("until", type_=table.c.reserved_until.type),
+                bindparam("now", type_=table.c.reserved_until.type),
+                bindparam("ids", expanding=True),
+            )
+            return [
+                tuple(r)
+                for r in self.db.execute(stmt, {"until": until, "now": now, "ids": ids})
+            ]
+
+        active = and_(
+            InventoryReservation.id.in_(ids),
+            InventoryReservation.status == "reserved",
+            InventoryReservation.reserved_until > now,
+        )
+        rows = [
+            tuple(r)
+            for r in self.db.query(
+                InventoryReservation.id,
+                InventoryReservation.sku,
+                InventoryReservation.quantity,
+            )
+            .filter(active)
+            .with_for_update()
+        ]
+        if rows:
+            self.db.query(InventoryReservation).filter(
+                InventoryReservation.id.in_([r[0] for r in rows])
+            ).update(
+                {InventoryReservation.reserved_until: until}, synchronize_session=False
+            )
+        return rows
+
     def commit(
         self, reservation_id: int, order_id: Optional[int] = None
     ) -> InventoryReservation:
@@ -156,6 +841,9 @@ class InventoryService:
         if r.status != "reserved":
             raise InventoryException("Reservation not active")
 
+        if self.reservation_mode == "cas":
+            return self._commit_cas(r, order_id)
+
         # Use the SKU from the reservation (was a NameError previously because `sku` didn't exist)
         product = (
             self.db.query(Product)
@@ -167,47 +855,226 @@ class InventoryService:
             raise InventoryException("SKU not found")
 
         now = self._now()
-        reserved_sum = (
-            self.db.query(func.coalesce(func.sum(InventoryReservation.quantity), 0))
-            .filter(
-                InventoryReservation.sku == r.sku,
-                InventoryReservation.status == "reserved",
-                InventoryReservation.reserved_until > now,
-            )
-            .scalar()
-            or 0
-        )
+        reserved_sum = self._reserved_quantity(r.sku, product.stock, now)
 
         # available after excluding this reservation
-        available = product.stock - (int(reserved_sum) - r.quantity)
+        available = product.stock - (reserved_sum - r.quantity)
         if available < r.quantity:
             raise InventoryException("Not enough stock to commit (race)")
 
         product.stock = product.stock - r.quantity
+        product.reserved_qty = Product.reserved_qty - r.quantity
         r.status = "committed"
         r.order_id = order_id
         self.db.flush()
+        record(
+            self.db,
+            LedgerOp(
+                kind="commit", sku=r.sku, reservation_id=r.id, stock=product.stock
+            ),
+        )
+        return r
+
+    def _commit_cas(
+        self, r: InventoryReservation, order_id: Optional[int]
+    ) -> InventoryReservation:
+        # stock and the counter move together in one conditional UPDATE
+        updated = (
+            self.db.query(Product)
+            .filter(Product.sku == r.sku, Product.stock >= r.quantity)
+            .update(
+                {
+                    Product.stock: Product.stock - r.quantity,
+                    Product.reserved_qty: Product.reserved_qty - r.quantity,
+                },
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            raise InventoryException("Not enough stock to commit (race)")
+        r.status = "committed"
+        r.order_id = order_id
+        self.db.flush()
+        record(self.db, LedgerOp(kind="commit", sku=r.sku, reservation_id=r.id))
         return r
 
-    def expire_overdue(self) -> List[int]:
+    def commit_many(
+        self, reservation_ids: List[int], order_id: Optional[int] = None
+    ) -> List[InventoryReservation]:
         """
-        Find reservations whose reserved_until < now and are still 'reserved', mark them 'expired'.
-        Return list of expired reservation ids.
+        Batched commit: settle several reservations (one basket) atomically with
+        a fixed number of statements, whatever the basket size. Either every
+        reservation is committed or none is.
         """
-        # Use smart_transaction to be robust if a caller has already started a transaction
+        if not reservation_ids:
+            return []
         with smart_transaction(self.db):
-            now = self._now()
-            expired = (
+            rows = (
                 self.db.query(InventoryReservation)
-                .filter(
-                    InventoryReservation.status == "reserved",
-                    InventoryReservation.reserved_until <= now,
-                )
+                .filter(InventoryReservation.id.in_(reservation_ids))
+                .order_by(InventoryReservation.id)
+                .with_for_update()
                 .all()
             )
-            ids = []
-            for r in expired:
-                r.status = "expired"
-                ids.append(r.id)
-            self.db.flush()
-            return ids
+            by_id = {r.id: r for r in rows}
+            for rid in reservation_ids:
+                r = by_id.get(rid)
+                if not r:
+                    raise InventoryException("Reservation not found")
+                if r.status != "reserved":
+                    raise InventoryException("Reservation not active")
+            wanted: Dict[str, int] = {}
+            for r in rows:
+                wanted[r.sku] = wanted.get(r.sku, 0) + int(r.quantity)
+            skus = sorted(wanted)
+
+            counters = self.db.query(Product).filter(Product.sku.in_(skus))
+            delta = case(wanted, value=Product.sku, else_=0)
+            if self.reservation_mode == "cas":
+                counters = counters.filter(Product.stock >= delta)
+                stocks = {}
+            else:
+                products = {
+                    p.sku: p
+                    for p in self.db.query(Product)
+                    .filter(Product.sku.in_(skus))
+                    .order_by(Product.sku)
+                    .with_for_update()
+                }
+                missing = [sku for sku in skus if sku not in products]
+                if missing:
+                    raise InventoryException("SKU not found")
+                reserved = self._reserved_quantities(
+                    {sku: products[sku].stock for sku in skus}, self._now()
+                )
+                for sku in skus:
+                    # same check as commit(): stock must still cover every active hold
+                    if products[sku].stock - reserved[sku] < 0:
+                        raise InventoryException("Not enough stock to commit (race)")
+                stocks = {sku: products[sku].stock - wanted[sku] for sku in skus}
+
+            # one UPDATE for every SKU, one for every reservation
+            updated = counters.update(
+                {
+                    Product.stock: Product.stock - delta,
+                    Product.reserved_qty: Product.reserved_qty - delta,
+                },
+                synchronize_session=False,
+            )
+            if updated != len(skus):
+                raise InventoryException("Not enough stock to commit (race)")
+            for sku in stocks:
+                # loaded above; the bulk UPDATE bypassed the identity map
+                self.db.expire(products[sku])
+            self.db.query(InventoryReservation).filter(
+                InventoryReservation.id.in_(reservation_ids)
+            ).update(
+                {
+                    InventoryReservation.status: "committed",
+                    InventoryReservation.order_id: order_id,
+                },
+                synchronize_session="evaluate",
+            )
+            for r in rows:
+                record(
+                    self.db,
+                    LedgerOp(
+                        kind="commit",
+                        sku=r.sku,
+                        reservation_id=r.id,
+                        stock=stocks.get(r.sku),
+                    ),
+                )
+        return [by_id[rid] for rid in reservation_ids]
+
+    def expire_overdue(self, chunk_size: Optional[int] = None) -> List[int]:
+        """
+        Mark reservations still 'reserved' whose reserved_until has passed as 'expired'.
+        Works in chunks of set-based UPDATE ... RETURNING (one short transaction, or
+        savepoint, per chunk) driven by the (status, reserved_until) index.
+        Return list of expired reservation ids.
+        """
+        chunk_size = chunk_size or settings.RESERVATION_EXPIRY_CHUNK
+        now = self._now()
+        ids: List[int] = []
+        while True:
+            # Use smart_transaction to be robust if a caller has already started a transaction
+            with smart_transaction(self.db):
+                rows = self._expire_chunk(now, chunk_size)
+                released: Dict[str, int] = {}
+                for rid, sku, qty in rows:
+                    released[sku] = released.get(sku, 0) + qty
+                    record(
+                        self.db, LedgerOp(kind="expire", sku=sku, reservation_id=rid)
+                    )
+                if released:
+                    delta = case(released, value=Product.sku, else_=0)
+                    self.db.query(Product).filter(Product.sku.in_(released)).update(
+                        {Product.reserved_qty: Product.reserved_qty - delta},
+                        synchronize_session=False,
+                    )
+            ids.extend(rid for rid, _, _ in rows)
+            if len(rows) < chunk_size:
+                break
+
+        # keep any loaded ORM instances consistent with the set-based update
+        expired = set(ids)
+        for obj in list(self.db.identity_map.values()):
+            if isinstance(obj, InventoryReservation) and obj.id in expired:
+                self.db.expire(obj, ["status"])
+        return ids
+
+    def _expire_chunk(self, now: datetime, limit: int) -> List[tuple]:
+        """Expire up to `limit` overdue reservations; returns (id, sku, quantity) rows."""
+        table = InventoryReservation.__table__
+        binds = [
+            bindparam("now", type_=table.c.reserved_until.type),
+            bindparam("limit", type_=Integer()),
+        ]
+        params = {"now": now, "limit": limit}
+        pick = (
+            "SELECT id FROM inventory_reservations"
+            " WHERE status = 'reserved' AND reserved_until <= :now"
+            " ORDER BY reserved_until LIMIT :limit"
+        )
+        if self.db.get_bind().dialect.name == "postgresql":
+            # let concurrent expirers work on disjoint rows
+            pick += " FOR UPDATE SKIP LOCKED"
+
+        if supports_returning(self.db):
+            stmt = text(
+                "UPDATE inventory_reservations SET status = 'expired'"
+                f" WHERE id IN ({pick}) RETURNING id, sku, quantity"
+            ).bindparams(*binds)
+            return [tuple(r) for r in self.db.execute(stmt, params)]
+
+        rows = [
+            tuple(r)
+            for r in self.db.query(
+                InventoryReservation.id,
+                InventoryReservation.sku,
+                InventoryReservation.quantity,
+            )
+            .filter(
+                InventoryReservation.status == "reserved",
+                InventoryReservation.reserved_until <= now,
+            )
+            .order_by(InventoryReservation.reserved_until)
+            .limit(limit)
+            .with_for_update()
+        ]
+        if rows:
+            self.db.query(InventoryReservation).filter(
+                InventoryReservation.id.in_([r[0] for r in rows])
+            ).update(
+                {InventoryReservation.status: "expired"}, synchronize_session=False
+            )
+        return rows
+
+    def next_expiry(self) -> Optional[datetime]:
+        """Earliest reserved_until among active reservations (index-backed MIN)."""
+        return (
+            self.db.query(func.min(InventoryReservation.reserved_until))
+            .filter(InventoryReservation.status == "reserved")
+            .scalar()
+        )
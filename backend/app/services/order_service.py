@@ -1,255 +1,332 @@
+import asyncio
+import logging
 from datetime import datetime, timezone
 from typing import Dict, List, Optional
 from uuid import uuid4
 
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app.adapters.mock_payment import (
+    AsyncMockPaymentAdapter,
     MockPaymentAdapter,
     PaymentDeclined,
-    PaymentTransientError,
 )
+from app.adapters.resilient_payment import (
+    AsyncResilientPaymentAdapter,
+    ResilientPaymentAdapter,
+)
+from app.config import settings
+from app.models.checkout_job import CheckoutJob
 from app.models.idempotency import IdempotencyRecord, IdempotencyStatus
+from app.models.inventory_reservation import InventoryReservation
 from app.models.order import Invoice, Order, OrderLine
 from app.models.product import Product
-from app.repositories.idempotency_repo import IdempotencyRepository
-from app.services.fulfilment_service import FulfilmentService
+from app.repositories.idempotency_repo import (
+    IdempotencyKeyReused,
+    IdempotencyRepository,
+    fingerprint_matches,
+    request_fingerprint,
+)
 from app.services.inventory_service import InventoryException, InventoryService
+from app.services.outbox import ORDER_COMPLETED, enqueue
+from app.utils.tracing import annotate, traced, tracer
 from app.utils.transactions import smart_transaction
 
+log = logging.getLogger("order_service")
+
 
 class OrderServiceException(Exception):
     pass
 
 
+_KEY_REUSED = "Idempotency key was already used for a different request"
+
+
 class OrderService:
     def __init__(self, db: Session):
         self.db = db
         self.idem_repo = IdempotencyRepository(db)
         self.inventory = InventoryService(db)
-        self.payment_adapter = MockPaymentAdapter(self.idem_repo, delay_ms=200)
+        self.payment_adapter = ResilientPaymentAdapter(
+            MockPaymentAdapter(self.idem_repo, delay_ms=200)
+        )
+        self.async_payment_adapter = AsyncResilientPaymentAdapter(
+            AsyncMockPaymentAdapter(delay_ms=200)
+        )
 
     def _gen_order_number(self) -> str:
         return f"ORD-{uuid4().hex[:10].upper()}"
 
-    def create_order(
-        self,
-        customer_id: Optional[int],
-        items: List[Dict],
-        payment_method: Dict,
-        idempotency_key: Optional[str] = None,
-    ) -> Dict:
+    def _release_all(self, reservations):
+        for r in reservations:
+            try:
+                self.inventory.release(r.id)
+            except Exception:
+                # log but continue
+                pass
+
+    @staticmethod
+    def _request_hash(
+        customer_id: Optional[int], items: List[Dict], payment_method: Dict
+    ) -> str:
+        """Fingerprint of a checkout request, stored with its idempotency key."""
+        return request_fingerprint(
+            {
+                "customer_id": customer_id,
+                "items": [
+                    {"sku": it.get("sku"), "qty": int(it.get("qty", 1))} for it in items
+                ],
+                "payment_method": payment_method,
+            }
+        )
+
+    @traced("checkout.idempotency")
+    def _idempotent_response(
+        self, idempotency_key: Optional[str], request_hash: Optional[str] = None
+    ):
         """
-        items: list of {sku: str, qty: int}
-        payment_method: dict (mock)
-        idempotency_key: string key for idempotency
-        Returns a dict response to be returned by API.
+        Returns (stored_response, rec). A stored response means the request was
+        already handled and should be returned as-is; otherwise `rec` is the
+        IN_PROGRESS marker this call now owns (None without a key).
+        A key already used with a different `request_hash` is refused.
         """
         # --- Idempotency check (improved) ---
         rec = None
         created = False
         if idempotency_key:
-            # quick fresh read
-            try:
-                rec = self.idem_repo.get(idempotency_key)
-            except Exception:
-                rec = None
             try:
-                self.db.expire_all()
-            except Exception:
-                pass
-
-            def _is_completed(r):
-                if not r:
-                    return False
+                # retry of a request completed in this process: no database access
+                cached = self.idem_repo.cached_response(idempotency_key, request_hash)
+                if cached is not None:
+                    annotate(idempotency_cache="hit")
+                    return cached, None
+                # quick fresh read
                 try:
-                    if r.status == IdempotencyStatus.COMPLETED:
-                        return True
+                    rec = self.idem_repo.get(idempotency_key)
+                except Exception:
+                    rec = None
+                try:
+                    self.db.expire_all()
                 except Exception:
                     pass
-                if getattr(r.status, "name", None) == "COMPLETED":
-                    return True
-                if str(r.status).upper() == "COMPLETED":
-                    return True
-                return False
-
-            if rec and _is_completed(rec) and getattr(rec, "response_body", None):
-                return rec.response_body
-
-            # Try to create the IN_PROGRESS marker (returns (rec, created))
-            rec, created = self.idem_repo.begin(idempotency_key, "create_order")
-            print(
-                f"[ORDER-IDEMP] begin returned created={created}, rec_id={(rec.id if rec else None)}, status={(rec.status if rec else None)}"
-            )
 
-            # If we did NOT create the marker, wait briefly for the owner to finish and return their result.
-            if not created:
+                def _is_completed(r):
+                    if not r:
+                        return False
+                    try:
+                        if r.status == IdempotencyStatus.COMPLETED:
+                            return True
+                    except Exception:
+                        pass
+                    if getattr(r.status, "name", None) == "COMPLETED":
+                        return True
+                    if str(r.status).upper() == "COMPLETED":
+                        return True
+                    return False
+
+                self.idem_repo.ensure_same_request(rec, request_hash)
                 if rec and _is_completed(rec) and getattr(rec, "response_body", None):
-                    return rec.response_body
-                import time
+                    return rec.response_body, rec
 
-                timeout = 2.0
-                start = time.time()
-                while time.time() - start < timeout:
-                    rec = self.idem_repo.get(idempotency_key)
-                    if _is_completed(rec) and getattr(rec, "response_body", None):
-                        return rec.response_body
-                    time.sleep(0.05)
-                # Owner hasn't finished within timeout — refuse to proceed to prevent duplicates
-                raise OrderServiceException(
-                    "Duplicate request in progress, try again later"
+                # Try to create the IN_PROGRESS marker (returns (rec, created))
+                rec, created = self.idem_repo.begin(
+                    idempotency_key, "create_order", request_hash
                 )
+                annotate(idempotency_owner=created)
 
-        # --- Validate items / compute total ---
+                # If we did NOT create the marker, wait briefly for the owner to finish and return their result.
+                if not created:
+                    if (
+                        rec
+                        and _is_completed(rec)
+                        and getattr(rec, "response_body", None)
+                    ):
+                        return rec.response_body, rec
+                    # woken by the owner's mark_completed/mark_failed; backoff re-reads cover other processes
+                    done = self.idem_repo.wait_for_completion(
+                        idempotency_key, timeout=2.0
+                    )
+                    if done and done[0] == IdempotencyStatus.COMPLETED:
+                        return done[1], rec
+                    if done:
+                        raise OrderServiceException(
+                            f"Original request failed: {done[2] or 'unknown error'}"
+                        )
+                    # Owner hasn't finished within timeout — refuse to proceed to prevent duplicates
+                    raise OrderServiceException(
+                        "Duplicate request in progress, try again later"
+                    )
+            except IdempotencyKeyReused as e:
+                raise OrderServiceException(str(e))
+        return None, rec
+
+    @traced("checkout.load_products")
+    def _price_items(self, items: List[Dict]):
+        """Load the products for `items`; returns (product_map, total_cents)."""
         try:
+            # one IN query for the whole basket instead of one SELECT per line
+            skus = {it["sku"] for it in items}
+            product_map = {
+                p.sku: p for p in self.db.query(Product).filter(Product.sku.in_(skus))
+            }
             total_cents = 0
-            # load products and ensure stock exists (use the InventoryService for reservations later)
-            product_map = {}
             for it in items:
                 sku = it["sku"]
-                qty = int(it.get("qty", 1))
-                prod = self.db.query(Product).filter(Product.sku == sku).first()
+                prod = product_map.get(sku)
                 if not prod:
                     raise OrderServiceException(f"Product SKU not found: {sku}")
-                product_map[sku] = prod
-                total_cents += (prod.price_cents or 0) * qty
+                total_cents += (prod.price_cents or 0) * int(it.get("qty", 1))
         except Exception as e:
             raise OrderServiceException(str(e))
+        return product_map, total_cents
 
-        # Begin main checkout orchestration
-        order = None
-        invoice = None
-        payment_tx = None
+    @staticmethod
+    def _line_rows(order_id: int, items: List[Dict], product_map: Dict) -> List[Dict]:
+        """Column dicts for the basket's order lines, built in one pass."""
+        # price column names are resolved once per basket, not per line
+        cols = OrderLine.__table__.c
+        price_col = next(
+            (c for c in ("price_cents", "unit_price_cents", "unit_price") if c in cols),
+            "price_cents",
+        )
+        rows = []
+        for it in items:
+            prod = product_map[it["sku"]]
+            prod_price = getattr(prod, "price_cents", None)
+            if prod_price is None:
+                # fallback names on Product
+                prod_price = (
+                    getattr(prod, "price", None)
+                    or getattr(prod, "unit_price_cents", None)
+                    or 0
+                )
+            row = {
+                "order_id": order_id,
+                "sku": it["sku"],
+                "qty": int(it.get("qty", 1)),
+                price_col: prod_price,
+            }
+            if "name" in cols:
+                row["name"] = getattr(prod, "name", None)
+            rows.append(row)
+        return rows
 
-        # 1) create order record in IN_PROGRESS
+    @traced("checkout.create_order")
+    def _create_order_record(
+        self,
+        customer_id: Optional[int],
+        items: List[Dict],
+        product_map: Dict,
+        total_cents: int,
+        status: str = "IN_PROGRESS",
+        job_payload: Optional[Dict] = None,
+        commit: bool = True,
+    ) -> Order:
+        """
+        Insert the order and its lines (plus a checkout job, if given) and commit;
+        with commit=False they are only flushed into the caller's transaction.
+        """
         try:
             order = Order(
                 order_number=self._gen_order_number(),
                 customer_id=customer_id,
-                status="IN_PROGRESS",
+                status=status,
                 total_cents=total_cents,
             )
             self.db.add(order)
             self.db.flush()
-            # create order lines
-            for it in items:
-                sku = it["sku"]
-                qty = int(it.get("qty", 1))
-                prod = product_map[sku]
-
-                # create order line instance (avoid passing unknown kwargs to constructor)
-                ol = OrderLine(order_id=order.id, sku=sku, qty=qty)
-
-                # 1) set descriptive name if the OrderLine model requires a name column
-                if hasattr(ol, "name"):
-                    ol.name = getattr(prod, "name", None)
-
-                # 2) set price field — adapt to the actual model columns (try common candidates)
-                # Prefer price_cents if present, otherwise try unit_price_cents, unit_price, price_cents, etc.
-                prod_price = getattr(prod, "price_cents", None)
-                if prod_price is None:
-                    # fallback names on Product
-                    prod_price = (
-                        getattr(prod, "price", None)
-                        or getattr(prod, "unit_price_cents", None)
-                        or 0
-                    )
-
-                if hasattr(ol, "price_cents"):
-                    ol.price_cents = prod_price
-                elif hasattr(ol, "unit_price_cents"):
-                    ol.unit_price_cents = prod_price
-                elif hasattr(ol, "unit_price"):
-                    ol.unit_price = prod_price
-                else:
-                    # last-resort: attach attribute (if model truly lacks a column, this is harmless)
-                    setattr(ol, "price_cents", prod_price)
-
-                self.db.add(ol)
-            print(
-                f"[ORDER-IDEMP] marking completed for key={idempotency_key}, resp_order_id={order.id}"
+            # all lines in a single executemany INSERT
+            self.db.execute(
+                insert(OrderLine.__table__),
+                self._line_rows(order.id, items, product_map),
             )
-            self.db.commit()
-            self.db.refresh(order)
+            if job_payload is not None:
+                # same transaction: an accepted order always has its job
+                self.db.add(CheckoutJob(order_id=order.id, payload=job_payload))
+            if commit:
+                self.db.commit()
+                self.db.refresh(order)
+            return order
         except Exception as e:
             # cleanup and bubble up
             self.db.rollback()
             raise OrderServiceException(f"Failed to create order: {e}")
 
-        # 2) Reserve inventory (transaction-aware)
-        reservations = []
+    @traced("checkout.reserve")
+    def _reserve_items(self, items: List[Dict]):
+        # whole basket in one transaction (all-or-nothing)
         try:
-            for l in items:
-                # Make sure we call reserve(sku, qty) — NOT passing the whole 'lines' list
-                r = self.inventory.reserve(l["sku"], l["qty"])
-                reservations.append(r)
+            return self.inventory.reserve_many(
+                [{"sku": l["sku"], "qty": int(l.get("qty", 1))} for l in items]
+            )
         except InventoryException as e:
-            # release any created reservations
-            for r in reservations:
-                try:
-                    self.inventory.release(r.id)
-                except Exception:
-                    pass
             raise OrderServiceException(f"Inventory reservation failed: {str(e)}")
 
-        # 3) Charge payment (with simple retry for transient errors)
+    @traced("checkout.payment")
+    def _charge(
+        self,
+        order: Order,
+        reservations,
+        total_cents: int,
+        payment_method: Dict,
+        idempotency_key: Optional[str],
+        requeue_failures: bool = False,
+    ) -> Dict:
+        """
+        Charge through the resilient adapter (backoff retries, circuit breaker,
+        bulkhead); on failure release the basket and fail the order. With
+        `requeue_failures` only a decline does that: other errors (gateway
+        brownout, breaker open, bulkhead full) propagate untouched so a
+        checkout job is retried later with the same idempotency key.
+        """
         try:
-            max_retries = 2
-            attempt = 0
-            while True:
-                try:
-                    payment_tx = self.payment_adapter.charge(
-                        self.db,
-                        total_cents,
-                        payment_method,
-                        idempotency_key=idempotency_key,
-                    )
-                    break
-                except PaymentTransientError as e:
-                    attempt += 1
-                    if attempt > max_retries:
-                        raise
-                    # small backoff (adapter handles delay)
-                    continue
+            return self.payment_adapter.charge(
+                self.db,
+                total_cents,
+                payment_method,
+                idempotency_key=idempotency_key,
+            )
         except PaymentDeclined as e:
-            # release reservation and mark order failed
-            try:
-                self.inventory.release(order.id)
-            except Exception:
-                # log but continue
-                pass
-            order.status = "FAILED"
-            self.db.add(order)
-            self.db.commit()
+            # release reservations and mark order failed
+            self._abandon(order, reservations)
             raise OrderServiceException("Payment declined: " + str(e))
         except Exception as e:
-            # treat as payment failure: release reservation and mark failed
-            try:
-                self.inventory.release(order.id)
-            except Exception:
-                pass
-            order.status = "FAILED"
-            self.db.add(order)
-            self.db.commit()
+            if requeue_failures:
+                raise
+            # treat as payment failure: release reservations and mark failed
+            self._abandon(order, reservations)
             raise OrderServiceException("Payment failed: " + str(e))
 
-        # 4) Commit inventory (finalize reserved quantities)
+    def _refund(self, payment_tx):
         try:
-            # commit each reservation we created earlier (pass order.id so reservation records link to the order)
-            for res in reservations:
-                # res is an InventoryReservation instance; commit expects reservation id
-                self.inventory.commit(res.id, order_id=order.id)
+            if (
+                payment_tx
+                and isinstance(payment_tx, dict)
+                and payment_tx.get("transaction_id")
+            ):
+                with tracer.span("payment.refund"):
+                    self.payment_adapter.refund(payment_tx.get("transaction_id"))
+        except Exception:
+            pass
+
+    @traced("checkout.inventory_commit")
+    def _commit_reservations(self, order: Order, reservations, payment_tx):
+        """Finalize reserved quantities; a failure here refunds the payment and fails the order."""
+        try:
+            # commit the reservations we created earlier in one batch (pass order.id so reservation records link to the order)
+            pending = [
+                res.id
+                for res in reservations
+                # already done by an earlier attempt of this checkout
+                if not (res.status == "committed" and res.order_id == order.id)
+            ]
+            if pending:
+                self.inventory.commit_many(pending, order_id=order.id)
         except InventoryException as commit_exc:
             # This is a severe issue (payment already captured) — try to compensate by refunding payment, then mark order failed
-            try:
-                if (
-                    payment_tx
-                    and isinstance(payment_tx, dict)
-                    and payment_tx.get("transaction_id")
-                ):
-                    self.payment_adapter.refund(payment_tx.get("transaction_id"))
-            except Exception:
-                pass
+            self._refund(payment_tx)
             order.status = "FAILED"
             self.db.add(order)
             self.db.commit()
@@ -257,30 +334,16 @@ class OrderService:
                 f"Inventory commit failed after payment: {str(commit_exc)}"
             )
 
-        # 5) Create invoice and mark order completed
+    @traced("checkout.invoice")
+    def _complete_order(self, order: Order, total_cents: int, payment_tx) -> Invoice:
+        """Create the invoice and mark the order COMPLETED (commits)."""
         try:
-            invoice = Invoice(
-                order_id=order.id,
-                invoice_no=f"INV-{uuid4().hex[:8].upper()}",
-                total_cents=total_cents,
-                tax_cents=0,
-                data={"payment": payment_tx},
-            )
-            self.db.add(invoice)
-            order.status = "COMPLETED"
-            self.db.add(order)
+            invoice = self._add_invoice(order, total_cents, payment_tx)
             self.db.commit()
+            return invoice
         except Exception as e:
             # if invoice creation fails, attempt refund (best-effort) and mark order failed
-            try:
-                if (
-                    payment_tx
-                    and isinstance(payment_tx, dict)
-                    and payment_tx.get("transaction_id")
-                ):
-                    self.payment_adapter.refund(payment_tx.get("transaction_id"))
-            except Exception:
-                pass
+            self._refund(payment_tx)
             order.status = "FAILED"
             self.db.add(order)
             self.db.commit()
@@ -288,22 +351,28 @@ class OrderService:
                 f"Failed to create invoice/order completion: {str(e)}"
             )
 
-        # 6) Enqueue fulfilment / packing task (best-effort)
-        try:
-            fulfil = FulfilmentService(self.db)
-            fulfil.create_packing_task_for_order(order.id)
-        except Exception:
-            # non-fatal for checkout path; log in real app
-            pass
+    def _add_invoice(self, order: Order, total_cents: int, payment_tx) -> Invoice:
+        invoice = Invoice(
+            order_id=order.id,
+            invoice_no=f"INV-{uuid4().hex[:8].upper()}",
+            total_cents=total_cents,
+            tax_cents=0,
+            data={"payment": payment_tx},
+        )
+        self.db.add(invoice)
+        order.status = "COMPLETED"
+        self.db.add(order)
+        self._enqueue_order_completed(order)
+        return invoice
 
-        # 7) store idempotency response if key provided
-        resp = {
-            "orderId": order.id,
-            "orderNumber": order.order_number,
-            "status": order.status,
-            "invoiceId": invoice.id if invoice else None,
-            "payment": payment_tx,
-        }
+    @traced("checkout.outbox")
+    def _enqueue_order_completed(self, order: Order):
+        # packing task and other downstream work: delivered by the outbox
+        # dispatcher once the completion commits, in the same transaction
+        enqueue(self.db, ORDER_COMPLETED, {"order_id": order.id}, aggregate_id=order.id)
+
+    @traced("checkout.store_response")
+    def _store_response(self, idempotency_key: Optional[str], rec, resp: Dict):
         if idempotency_key and rec:
             try:
                 # store the canonical response and mark COMPLETED
@@ -311,8 +380,11 @@ class OrderService:
             except Exception:
                 # fall back to manual write if something goes wrong
                 try:
-                    print(
-                        f"[ORDER-IDEMP] marking completed for key={idempotency_key}, resp_order_id={order.id}"
+                    log.warning(
+                        "mark_completed failed for key=%s (order %s); storing the"
+                        " response in the caller's session",
+                        idempotency_key,
+                        resp.get("orderId"),
                     )
                     rec.status = IdempotencyStatus.COMPLETED
                     rec.response_body = resp
@@ -321,5 +393,598 @@ class OrderService:
                 except Exception:
                     pass
 
+    @staticmethod
+    def _order_response(order: Order, invoice, payment_tx) -> Dict:
+        return {
+            "orderId": order.id,
+            "orderNumber": order.order_number,
+            "status": order.status,
+            "invoiceId": invoice.id if invoice else None,
+            "payment": payment_tx,
+        }
+
+    @traced("checkout")
+    def create_order(
+        self,
+        customer_id: Optional[int],
+        items: List[Dict],
+        payment_method: Dict,
+        idempotency_key: Optional[str] = None,
+    ) -> Dict:
+        """
+        items: list of {sku: str, qty: int}
+        payment_method: dict (mock)
+        idempotency_key: string key for idempotency
+        Returns a dict response to be returned by API.
+        """
+        annotate(mode=settings.CHECKOUT_TRANSACTION_MODE, lines=len(items))
+        stored, rec = self._idempotent_response(
+            idempotency_key, self._request_hash(customer_id, items, payment_method)
+        )
+        if stored is not None:
+            annotate(replay=True)
+            return stored
+
+        # --- Validate items / compute total ---
+        product_map, total_cents = self._price_items(items)
+
+        if settings.CHECKOUT_TRANSACTION_MODE == "unit":
+            return self._create_order_unit(
+                customer_id,
+                items,
+                payment_method,
+                idempotency_key,
+                rec,
+                product_map,
+                total_cents,
+            )
+
+        # Begin main checkout orchestration
+        # 1) create order record in IN_PROGRESS
+        order = self._create_order_record(customer_id, items, product_map, total_cents)
+        annotate(order_id=order.id)
+
+        # 2) Reserve inventory
+        reservations = self._reserve_items(items)
+
+        # 3) Charge payment
+        payment_tx = self._charge(
+            order, reservations, total_cents, payment_method, idempotency_key
+        )
+
+        # 4) Commit inventory (finalize reserved quantities)
+        self._commit_reservations(order, reservations, payment_tx)
+
+        # 5) Create invoice, mark order completed, queue order.completed (outbox)
+        invoice = self._complete_order(order, total_cents, payment_tx)
+
+        # 6) store idempotency response if key provided
+        resp = self._order_response(order, invoice, payment_tx)
+        self._store_response(idempotency_key, rec, resp)
+
         self.db.commit()
         return resp
+
+    def _create_order_unit(
+        self,
+        customer_id: Optional[int],
+        items: List[Dict],
+        payment_method: Dict,
+        idempotency_key: Optional[str],
+        rec,
+        product_map: Dict,
+        total_cents: int,
+    ) -> Dict:
+        """
+        create_order with two commits instead of one per step:
+
+        1. order, lines and reservations, committed together before the payment
+           call so no transaction (or lock) is held while the gateway works;
+        2. after a successful charge: inventory commit, invoice, outbox event
+           and the idempotency response, in one transaction. The inventory commit
+           runs in a savepoint; if any part of the settlement fails, the
+           transaction is rolled back and the charge refunded.
+
+        Failures before the charge leave nothing behind but the idempotency marker.
+        """
+        order, reservations = self._open_unit(
+            customer_id, items, product_map, total_cents
+        )
+        # compensation on failure: release reservations, fail the order (one commit)
+        payment_tx = self._charge(
+            order, reservations, total_cents, payment_method, idempotency_key
+        )
+        return self._settle_unit(
+            order,
+            reservations,
+            total_cents,
+            payment_tx,
+            idempotency_key,
+            owns_key=rec is not None,
+        )
+
+    @traced("checkout.open")
+    def _open_unit(
+        self,
+        customer_id: Optional[int],
+        items: List[Dict],
+        product_map: Dict,
+        total_cents: int,
+    ):
+        """First unit: order, lines and reservations in one commit."""
+        try:
+            order = self._create_order_record(
+                customer_id, items, product_map, total_cents, commit=False
+            )
+            reservations = self._reserve_items(items)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            if isinstance(e, OrderServiceException):
+                raise
+            raise OrderServiceException(f"Failed to create order: {e}")
+        return order, reservations
+
+    @traced("checkout.settle")
+    def _settle_unit(
+        self,
+        order: Order,
+        reservations,
+        total_cents: int,
+        payment_tx: Dict,
+        idempotency_key: Optional[str],
+        owns_key: bool,
+    ) -> Dict:
+        """
+        Second unit: everything that follows a captured payment, in one commit.
+        With `owns_key` (this call claimed `idempotency_key`) the stored response
+        is completed in the same commit.
+        """
+        try:
+            if not self.db.in_transaction():
+                self.db.begin()
+            reservation_ids = [r.id for r in reservations]
+            # write first: on SQLite a transaction opened by the SAVEPOINT below
+            # would read before taking the write lock and could deadlock with a
+            # concurrent settlement instead of waiting for it
+            with tracer.span("checkout.invoice"):
+                invoice = self._add_invoice(order, total_cents, payment_tx)
+                self.db.flush()
+            try:
+                with tracer.span("checkout.inventory_commit"):
+                    self.inventory.commit_many(reservation_ids, order_id=order.id)
+            except InventoryException as e:
+                raise OrderServiceException(
+                    f"Inventory commit failed after payment: {str(e)}"
+                )
+            self.db.flush()
+            resp = self._order_response(order, invoice, payment_tx)
+            if idempotency_key and owns_key:
+                self.idem_repo.mark_completed(idempotency_key, resp, in_session=True)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            self._refund(payment_tx)
+            self._abandon(order, reservations)
+            if isinstance(e, OrderServiceException):
+                raise
+            raise OrderServiceException(
+                f"Failed to create invoice/order completion: {str(e)}"
+            )
+        return resp
+
+    def _abandon(self, order: Order, reservations):
+        """Release the basket and fail the order (one commit)."""
+        self._release_all(reservations)
+        order.status = "FAILED"
+        self.db.add(order)
+        self.db.commit()
+
+    @traced("checkout")
+    async def create_order_async(
+        self,
+        customer_id: Optional[int],
+        items: List[Dict],
+        payment_method: Dict,
+        idempotency_key: Optional[str] = None,
+    ) -> Dict:
+        """
+        create_order for async routes. Database work (the two units of the "unit"
+        transaction mode) runs in the threadpool; the gateway call is awaited on
+        the event loop through an AsyncPaymentAdapter, so a slow payment holds
+        no thread. ORM objects are only touched inside the threadpool calls.
+        """
+
+        def open_checkout():
+            stored, rec = self._idempotent_response(
+                idempotency_key,
+                self._request_hash(customer_id, items, payment_method),
+            )
+            if stored is not None:
+                return stored, None
+            product_map, total_cents = self._price_items(items)
+            order, reservations = self._open_unit(
+                customer_id, items, product_map, total_cents
+            )
+            return None, (rec, order, reservations, total_cents)
+
+        annotate(mode="async", lines=len(items))
+        stored, opened = await run_in_threadpool(open_checkout)
+        if stored is not None:
+            annotate(replay=True)
+            return stored
+        rec, order, reservations, total_cents = opened
+
+        try:
+            with tracer.span("checkout.payment"):
+                payment_tx = await self.async_payment_adapter.charge(
+                    total_cents, payment_method
+                )
+        except PaymentDeclined as e:
+            await run_in_threadpool(self._abandon, order, reservations)
+            raise OrderServiceException("Payment declined: " + str(e))
+        except Exception as e:
+            await run_in_threadpool(self._abandon, order, reservations)
+            raise OrderServiceException("Payment failed: " + str(e))
+
+        return await run_in_threadpool(
+            self._settle_unit,
+            order,
+            reservations,
+            total_cents,
+            payment_tx,
+            idempotency_key,
+            rec is not None,
+        )
+
+    # --- batch checkout --------------------------------------------------------
+
+    @traced("checkout.batch")
+    async def create_orders_batch(self, orders: List[Dict]) -> List[Dict]:
+        """
+        Checkout for a batch of independent orders (B2B and marketplace feeds).
+        orders: list of {customer_id, items, payment_method, idempotency_key}.
+
+        Work shared by the batch is done once: one idempotency claim for every
+        key, one product query for every SKU, one grouped reservation pass and
+        one commit opening all accepted orders. Charges are awaited at most
+        BATCH_PAYMENT_CONCURRENCY at a time, then each paid order settles in
+        its own transaction as in the "unit" mode. Returns one result per
+        order, in request order: {index, ok, response} or {index, ok, error}.
+        An order repeating an earlier key of the same batch shares its result.
+        """
+        annotate(orders=len(orders))
+        results, opened, repeats = await run_in_threadpool(self._open_batch, orders)
+
+        limit = asyncio.Semaphore(max(1, settings.BATCH_PAYMENT_CONCURRENCY))
+
+        async def charge(entry):
+            async with limit:
+                try:
+                    txn = await self.async_payment_adapter.charge(
+                        entry["total_cents"], entry["payment_method"]
+                    )
+                    return txn, None
+                except PaymentDeclined as e:
+                    return None, "Payment declined: " + str(e)
+                except Exception as e:
+                    return None, "Payment failed: " + str(e)
+
+        with tracer.span("checkout.payment", orders=len(opened)):
+            charges = await asyncio.gather(*(charge(entry) for entry in opened))
+        await run_in_threadpool(self._settle_batch, opened, charges, results)
+
+        for i, first in repeats.items():
+            results[i] = dict(results[first], index=i)
+        return [results[i] for i in range(len(orders))]
+
+    @traced("checkout.open")
+    def _open_batch(self, orders: List[Dict]):
+        """
+        First unit for the whole batch. Returns (results, opened, repeats):
+        final results by index for orders that are already decided (replays,
+        rejections), the opened orders awaiting payment, and {index: index of
+        the first order with the same key}.
+        """
+        results: Dict[int, Dict] = {}
+        failed_keys: Dict[str, str] = {}
+        keys = [o.get("idempotency_key") for o in orders]
+        hashes = [
+            self._request_hash(o.get("customer_id"), o["items"], o["payment_method"])
+            if key
+            else None
+            for o, key in zip(orders, keys)
+        ]
+
+        with tracer.span("checkout.idempotency"):
+            claims = self.idem_repo.begin_many(
+                [k for k in keys if k],
+                "create_order",
+                {k: h for k, h in zip(keys, hashes) if k},
+            )
+
+        def reject(i: int, error: str):
+            results[i] = {"index": i, "ok": False, "error": error}
+            if keys[i] and claims[keys[i]][0]:
+                failed_keys[keys[i]] = error
+
+        pending, repeats, first_index = [], {}, {}
+        for i, key in enumerate(keys):
+            if key and key in first_index:
+                if hashes[i] != hashes[first_index[key]]:
+                    results[i] = {"index": i, "ok": False, "error": _KEY_REUSED}
+                else:
+                    repeats[i] = first_index[key]
+                continue
+            if key:
+                first_index[key] = i
+                created, status, body, error, stored_hash = claims[key]
+                if not created and not fingerprint_matches(stored_hash, hashes[i]):
+                    results[i] = {"index": i, "ok": False, "error": _KEY_REUSED}
+                    continue
+                if not created:
+                    if status == IdempotencyStatus.COMPLETED and body:
+                        results[i] = {"index": i, "ok": True, "response": body}
+                    elif status == IdempotencyStatus.FAILED:
+                        error = error or "unknown error"
+                        reject(i, f"Original request failed: {error}")
+                    else:
+                        reject(i, "Duplicate request in progress, try again later")
+                    continue
+            if not orders[i]["items"]:
+                reject(i, "Order has no items")
+                continue
+            pending.append(i)
+
+        try:
+            # one IN query for every SKU of the batch
+            with tracer.span("checkout.load_products"):
+                skus = {it["sku"] for i in pending for it in orders[i]["items"]}
+                product_map = (
+                    {
+                        p.sku: p
+                        for p in self.db.query(Product).filter(Product.sku.in_(skus))
+                    }
+                    if skus
+                    else {}
+                )
+            priced = []
+            for i in pending:
+                items = orders[i]["items"]
+                missing = next(
+                    (it["sku"] for it in items if it["sku"] not in product_map), None
+                )
+                if missing:
+                    reject(i, f"Product SKU not found: {missing}")
+                    continue
+                total_cents = sum(
+                    (product_map[it["sku"]].price_cents or 0) * int(it.get("qty", 1))
+                    for it in items
+                )
+                # written before the reservation savepoint (see _settle_unit)
+                order = self._create_order_record(
+                    orders[i].get("customer_id"),
+                    items,
+                    product_map,
+                    total_cents,
+                    commit=False,
+                )
+                priced.append((i, order, total_cents))
+
+            with tracer.span("checkout.reserve", orders=len(priced)):
+                try:
+                    granted = self.inventory.reserve_baskets(
+                        [
+                            [
+                                {"sku": it["sku"], "qty": int(it.get("qty", 1))}
+                                for it in orders[i]["items"]
+                            ]
+                            for i, _, _ in priced
+                        ]
+                    )
+                    shortage = "not enough stock"
+                except InventoryException as e:
+                    granted, shortage = [None] * len(priced), str(e)
+
+            opened = []
+            for (i, order, total_cents), reservations in zip(priced, granted):
+                if reservations is None:
+                    order.status = "FAILED"
+                    reject(i, f"Inventory reservation failed: {shortage}")
+                    continue
+                opened.append(
+                    {
+                        "index": i,
+                        "order": order,
+                        "reservations": reservations,
+                        "total_cents": total_cents,
+                        "payment_method": orders[i]["payment_method"],
+                        "key": keys[i] if keys[i] and claims[keys[i]][0] else None,
+                    }
+                )
+            self.idem_repo.mark_failed_many(failed_keys)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            # nothing was reserved or charged: release every key this batch
+            # claimed so retries are not refused
+            self.idem_repo.release_many([k for k, claim in claims.items() if claim[0]])
+            self.db.commit()
+            raise OrderServiceException(f"Failed to open batch: {e}")
+        return results, opened, repeats
+
+    def _settle_batch(self, opened: List[Dict], charges: List[tuple], results: Dict):
+        """Settle each charged order in its own transaction; abandon the others."""
+        failed_keys: Dict[str, str] = {}
+        for entry, (payment_tx, error) in zip(opened, charges):
+            i, key = entry["index"], entry["key"]
+            try:
+                if error:
+                    self._abandon(entry["order"], entry["reservations"])
+                    raise OrderServiceException(error)
+                resp = self._settle_unit(
+                    entry["order"],
+                    entry["reservations"],
+                    entry["total_cents"],
+                    payment_tx,
+                    key,
+                    # only keys this batch claimed are set on its entries
+                    owns_key=key is not None,
+                )
+                results[i] = {"index": i, "ok": True, "response": resp}
+            except OrderServiceException as e:
+                results[i] = {"index": i, "ok": False, "error": str(e)}
+                if key:
+                    failed_keys[key] = str(e)
+        if failed_keys:
+            self.idem_repo.mark_failed_many(failed_keys)
+            self.db.commit()
+
+    # --- asynchronous checkout -------------------------------------------------
+
+    @traced("checkout.submit")
+    def submit_order(
+        self,
+        customer_id: Optional[int],
+        items: List[Dict],
+        payment_method: Dict,
+        idempotency_key: Optional[str] = None,
+    ) -> Dict:
+        """
+        Accept a checkout without running it: validate, persist the order as
+        PENDING together with its CheckoutJob, and return a handle. The
+        remaining stages run on the checkout worker pool (run_checkout_job).
+        With an idempotency key, repeats return the same handle.
+        """
+        stored, rec = self._idempotent_response(
+            idempotency_key, self._request_hash(customer_id, items, payment_method)
+        )
+        if stored is not None:
+            return stored
+
+        product_map, total_cents = self._price_items(items)
+        order = self._create_order_record(
+            customer_id,
+            items,
+            product_map,
+            total_cents,
+            status="PENDING",
+            job_payload={
+                "items": [
+                    {"sku": it["sku"], "qty": int(it.get("qty", 1))} for it in items
+                ],
+                "payment_method": payment_method,
+            },
+        )
+        resp = {
+            "orderId": order.id,
+            "orderNumber": order.order_number,
+            "status": order.status,
+            "statusUrl": f"/api/orders/{order.id}/status",
+        }
+        self._store_response(idempotency_key, rec, resp)
+        self.db.commit()
+        return resp
+
+    def _advance(self, job: CheckoutJob, stage: str, **data):
+        job.stage = stage
+        if data:
+            # reassign: JSON columns do not track in-place changes
+            job.data = {**(job.data or {}), **data}
+        self.db.add(job)
+        self.db.commit()
+
+    @traced("checkout.job")
+    def run_checkout_job(self, job: CheckoutJob) -> CheckoutJob:
+        """
+        Run the remaining stages of an accepted checkout, committing after each
+        one. Business failures (stock, payment decline) fail the job and the
+        order; anything else, gateway errors included, propagates so the worker
+        can retry the job later.
+        """
+        annotate(order_id=job.order_id, stage=job.stage, attempt=job.attempts)
+        order = self.db.get(Order, job.order_id)
+        items = job.payload["items"]
+        data = job.data or {}
+        reservations = []
+        try:
+            if job.stage == "reserve":
+                order.status = "IN_PROGRESS"
+                reservations = self._reserve_items(items)
+                self._advance(
+                    job, "charge", reservation_ids=[r.id for r in reservations]
+                )
+            elif data.get("reservation_ids"):
+                rows = {
+                    r.id: r
+                    for r in self.db.query(InventoryReservation).filter(
+                        InventoryReservation.id.in_(data["reservation_ids"])
+                    )
+                }
+                reservations = [rows[rid] for rid in data["reservation_ids"]]
+
+            if job.stage == "charge":
+                # per-order key: a job re-run after a crash reuses the stored charge
+                payment_tx = self._charge(
+                    order,
+                    reservations,
+                    order.total_cents,
+                    job.payload["payment_method"],
+                    f"checkout-order-{order.id}",
+                    requeue_failures=True,
+                )
+                self._advance(job, "commit", payment=payment_tx)
+
+            payment_tx = (job.data or {}).get("payment")
+            if job.stage == "commit":
+                self._commit_reservations(order, reservations, payment_tx)
+                self._advance(job, "complete")
+
+            if job.stage == "complete":
+                # the order.completed outbox event commits with the invoice
+                invoice = self._complete_order(order, order.total_cents, payment_tx)
+                job.status = "done"
+                job.locked_until = None
+                self._advance(job, "done", invoice_id=invoice.id)
+
+            if job.stage == "fulfil":
+                # jobs completed before the outbox existed
+                self._enqueue_order_completed(order)
+                job.status = "done"
+                job.locked_until = None
+                self._advance(job, "done")
+        except OrderServiceException as e:
+            self.db.rollback()
+            if order.status not in ("FAILED", "COMPLETED"):
+                order.status = "FAILED"
+            job.status = "failed"
+            job.last_error = str(e)[:1024]
+            job.locked_until = None
+            self.db.add_all([order, job])
+            self.db.commit()
+        return job
+
+    def checkout_status(self, order_id: int) -> Dict:
+        order = self.db.get(Order, order_id)
+        if not order:
+            raise OrderServiceException("Order not found")
+        resp = {
+            "orderId": order.id,
+            "orderNumber": order.order_number,
+            "status": order.status,
+        }
+        job = (
+            self.db.query(CheckoutJob).filter(CheckoutJob.order_id == order_id).first()
+        )
+        if job:
+            data = job.data or {}
+            resp.update(
+                {
+                    "stage": job.stage,
+                    "attempts": job.attempts,
+                    "error": job.last_error,
+                    "invoiceId": data.get("invoice_id"),
+                    "payment": data.get("payment"),
+                }
+            )
+        return resp
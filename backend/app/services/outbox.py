@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import bindparam, event, func, or_, text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models.outbox import OutboxEvent
+from app.services.fulfilment_service import on_order_completed
+from app.utils.sql import supports_returning
+from app.utils.tracing import tracer
+
+log = logging.getLogger("outbox")
+
+ORDER_COMPLETED = "order.completed"
+
+# topic -> handlers(db, payload); each runs inside the dispatcher's transaction
+Handler = Callable[[Session, Dict], None]
+HANDLERS: Dict[str, List[Handler]] = {ORDER_COMPLETED: [on_order_completed]}
+
+
+def enqueue(
+    db: Session, topic: str, payload: Dict, aggregate_id: Optional[int] = None
+) -> OutboxEvent:
+    """
+    Add an outbox event to the caller's transaction: it becomes visible to the
+    dispatcher only if that transaction commits, and the dispatcher is woken then.
+    """
+    ev = OutboxEvent(topic=topic, aggregate_id=aggregate_id, payload=payload)
+    db.add(ev)
+    event.listen(db, "after_commit", lambda s: outbox_dispatcher.notify(), once=True)
+    return ev
+
+
+class OutboxDispatcher:
+    """
+    Thread draining the outbox_events table.
+
+    Due events are claimed in batches of OUTBOX_BATCH_SIZE with a conditional
+    UPDATE (status -> 'processing', lease in locked_until), so several
+    processes can run a dispatcher. Each event is delivered in its own
+    savepoint and marked done in the same savepoint as its handlers' writes;
+    the batch commits once. A failing event is retried after
+    OUTBOX_RETRY_SECONDS * attempts and marked 'failed' after
+    OUTBOX_MAX_ATTEMPTS. Events whose lease ran out (dispatcher crashed
+    mid-batch) are claimed again: delivery is at least once.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        handlers: Optional[Dict[str, List[Handler]]] = None,
+        batch_size: Optional[int] = None,
+        poll_seconds: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+    ):
+        self.session_factory = session_factory
+        self.handlers = HANDLERS if handlers is None else handlers
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.poll_seconds = poll_seconds or settings.OUTBOX_POLL_SECONDS
+        self.lease_seconds = lease_seconds or settings.OUTBOX_LEASE_SECONDS
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._pending_wakeup = False
+        self._worker_id = f"outbox-{os.getpid()}"
+
+    # --- lifecycle -------------------------------------------------------------
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._loop, name="outbox-dispatcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def notify(self):
+        """Wake the dispatcher (an event was just committed)."""
+        with self._cond:
+            self._pending_wakeup = True
+            self._cond.notify()
+
+    def _loop(self):
+        while not self._stopping:
+            try:
+                delivered = self.run_once()
+            except Exception:
+                log.exception("outbox dispatcher crashed on a batch")
+                delivered = []
+            if not delivered:
+                with self._cond:
+                    if not self._stopping and not self._pending_wakeup:
+                        self._cond.wait(timeout=self.poll_seconds)
+                    self._pending_wakeup = False
+
+    # --- work ------------------------------------------------------------------
+
+    def _claim(self, db: Session, worker: str) -> List[int]:
+        now = datetime.now(timezone.utc)
+        lease = now + timedelta(seconds=self.lease_seconds)
+        dt = OutboxEvent.__table__.c.available_at.type
+        params = {"now": now, "lease": lease, "worker": worker, "n": self.batch_size}
+
+        if supports_returning(db):
+            pick = (
+                "SELECT id FROM outbox_events"
+                " WHERE (status = 'pending' AND available_at <= :now)"
+                " OR (status = 'processing' AND locked_until < :now)"
+                " ORDER BY id LIMIT :n"
+            )
+            if db.get_bind().dialect.name == "postgresql":
+                pick += " FOR UPDATE SKIP LOCKED"
+            stmt = text(
+                "UPDATE outbox_events SET status = 'processing',"
+                " attempts = attempts + 1, locked_by = :worker, locked_until = :lease"
+                f" WHERE id IN ({pick}) RETURNING id"
+            ).bindparams(
+                bindparam("now", type_=dt),
+                bindparam("lease", type_=dt),
+            )
+            ids = sorted(row[0] for row in db.execute(stmt, params))
+            db.commit()
+            return ids
+
+        claimable = or_(
+            (OutboxEvent.status == "pending") & (OutboxEvent.available_at <= now),
+            (OutboxEvent.status == "processing") & (OutboxEvent.locked_until < now),
+        )
+        ids = [
+            row.id
+            for row in db.query(OutboxEvent.id)
+            .filter(claimable)
+            .order_by(OutboxEvent.id)
+            .limit(self.batch_size)
+        ]
+        if not ids:
+            db.rollback()
+            return []
+        db.query(OutboxEvent).filter(OutboxEvent.id.in_(ids), claimable).update(
+            {
+                OutboxEvent.status: "processing",
+                OutboxEvent.attempts: OutboxEvent.attempts + 1,
+                OutboxEvent.locked_by: worker,
+                OutboxEvent.locked_until: lease,
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+        # only the rows this claim won
+        return [
+            row.id
+            for row in db.query(OutboxEvent.id).filter(
+                OutboxEvent.id.in_(ids),
+                OutboxEvent.locked_by == worker,
+                OutboxEvent.locked_until == lease,
+            )
+        ]
+
+    def run_once(self, worker: Optional[str] = None) -> List[int]:
+        """Claim and deliver one batch; returns the ids of the delivered events."""
+        worker = worker or self._worker_id
+        db = self.session_factory()
+        try:
+            ids = self._claim(db, worker)
+            if not ids:
+                return []
+            delivered = []
+            with tracer.span("outbox.batch", events=len(ids)):
+                events = (
+                    db.query(OutboxEvent)
+                    .filter(OutboxEvent.id.in_(ids))
+                    .order_by(OutboxEvent.id)
+                    .all()
+                )
+                for ev in events:
+                    if self._deliver(db, ev):
+                        delivered.append(ev.id)
+                db.commit()
+            return delivered
+        finally:
+            db.close()
+
+    def _deliver(self, db: Session, ev: OutboxEvent) -> bool:
+        error = None
+        try:
+            with db.begin_nested(), tracer.span("outbox.deliver", topic=ev.topic):
+                # mark done first: on SQLite the savepoint must write before it
+                # reads, and the mark commits or rolls back with the handlers
+                ev.status = "done"
+                ev.processed_at = datetime.now(timezone.utc)
+                ev.locked_until = None
+                db.flush()
+                for handler in self.handlers.get(ev.topic, ()):
+                    handler(db, ev.payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:1024]
+            log.warning("outbox event %s (%s) failed: %s", ev.id, ev.topic, error)
+        if error is None:
+            return True
+        ev.last_error = error
+        ev.locked_until = None
+        if ev.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            ev.status = "failed"
+        else:
+            ev.status = "pending"
+            ev.available_at = datetime.now(timezone.utc) + timedelta(
+                seconds=settings.OUTBOX_RETRY_SECONDS * ev.attempts
+            )
+        return False
+
+    def run_pending(self, limit: int = 1000) -> List[int]:
+        """Deliver due events in the calling thread (tests, CLI)."""
+        done: List[int] = []
+        while len(done) < limit:
+            delivered = self.run_once()
+            if not delivered:
+                break
+            done.extend(delivered)
+        return done
+
+    def stats(self, db: Session) -> Dict[str, int]:
+        """Event count per status."""
+        return dict(
+            db.query(OutboxEvent.status, func.count(OutboxEvent.id))
+            .group_by(OutboxEvent.status)
+            .all()
+        )
+
+
+outbox_dispatcher = OutboxDispatcher()
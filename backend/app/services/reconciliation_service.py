@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models.credit_note import CreditNote
+from app.models.inventory_checkpoint import InventoryCheckpoint
+from app.models.inventory_reservation import (
+    InventoryReservation,
+    InventoryReservationHistory,
+)
+from app.models.product import Product
+from app.models.return_line import ReturnLine
+from app.models.return_request import ReturnRequest
+
+log = logging.getLogger("reconciliation")
+
+
+class ReconciliationService:
+    """
+    Checks every product against what its history says it should hold:
+
+    - stock: checkpoint stock - committed since + restocked since, where
+      "committed" sums committed reservations (hot table and history) and
+      "restocked" sums return lines that received a credit note;
+    - reserved_qty: the counter must equal the quantity of reservations still
+      in status 'reserved'.
+
+    Products are scanned in keyset pages of `batch_size` SKUs, each read with
+    yield_per in its own short read transaction, so memory stays bounded and
+    no transaction or lock lives for the whole scan. A SKU only lands in the
+    report if it is still inconsistent when re-read in a fresh transaction,
+    which filters out writes that raced the first read.
+
+    SKUs without a checkpoint get one (the "baseline") instead of a verdict.
+    """
+
+    def __init__(self, db: Session, batch_size: Optional[int] = None):
+        self.db = db
+        self.batch_size = batch_size or settings.RECONCILE_BATCH_SIZE
+
+    # --- reads -------------------------------------------------------------
+
+    def _pages(self) -> Iterator[List[tuple]]:
+        last = None
+        while True:
+            q = self.db.query(Product.sku, Product.stock, Product.reserved_qty)
+            if last is not None:
+                q = q.filter(Product.sku > last)
+            rows = [
+                tuple(r)
+                for r in q.order_by(Product.sku)
+                .limit(self.batch_size)
+                .yield_per(self.batch_size)
+            ]
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+            if len(rows) < self.batch_size:
+                return
+
+    def _reservation_totals(self, model, skus: List[str]) -> Dict[str, tuple]:
+        committed = func.sum(
+            case((model.status == "committed", model.quantity), else_=0)
+        )
+        reserved = func.sum(case((model.status == "reserved", model.quantity), else_=0))
+        return {
+            sku: (int(c or 0), int(r or 0))
+            for sku, c, r in self.db.query(model.sku, committed, reserved)
+            .filter(model.sku.in_(skus))
+            .group_by(model.sku)
+        }
+
+    def _totals(self, skus: List[str]) -> Dict[str, Dict[str, int]]:
+        """committed / reserved / restocked running totals for `skus`."""
+        out = {s: {"committed": 0, "reserved": 0, "restocked": 0} for s in skus}
+        for model in (InventoryReservation, InventoryReservationHistory):
+            for sku, (c, r) in self._reservation_totals(model, skus).items():
+                out[sku]["committed"] += c
+                out[sku]["reserved"] += r
+        restocked = (
+            self.db.query(ReturnLine.sku, func.sum(ReturnLine.qty))
+            .join(ReturnRequest, ReturnRequest.id == ReturnLine.return_id)
+            .join(CreditNote, CreditNote.return_id == ReturnRequest.id)
+            .filter(ReturnLine.sku.in_(skus))
+            .group_by(ReturnLine.sku)
+        )
+        for sku, qty in restocked:
+            out[sku]["restocked"] = int(qty or 0)
+        return out
+
+    def _checkpoints(self, skus: List[str]) -> Dict[str, InventoryCheckpoint]:
+        return {
+            c.sku: c
+            for c in self.db.query(InventoryCheckpoint).filter(
+                InventoryCheckpoint.sku.in_(skus)
+            )
+        }
+
+    # --- checks ------------------------------------------------------------
+
+    @staticmethod
+    def _verdict(row: tuple, totals: Dict[str, int], cp: InventoryCheckpoint):
+        sku, stock, reserved_qty = row
+        expected = (
+            cp.stock
+            - (totals["committed"] - cp.committed_total)
+            + (totals["restocked"] - cp.restocked_total)
+        )
+        issues = []
+        if stock != expected:
+            issues.append("stock")
+        if (reserved_qty or 0) != totals["reserved"]:
+            issues.append("reserved_qty")
+        if not issues:
+            return None
+        return {
+            "sku": sku,
+            "issues": issues,
+            "stock": stock,
+            "expected_stock": expected,
+            "stock_diff": stock - expected,
+            "reserved_qty": reserved_qty,
+            "reserved_active": totals["reserved"],
+            "committed_since_checkpoint": totals["committed"] - cp.committed_total,
+            "restocked_since_checkpoint": totals["restocked"] - cp.restocked_total,
+        }
+
+    def _check_page(self, rows: List[tuple], rebaseline: bool):
+        skus = [r[0] for r in rows]
+        totals = self._totals(skus)
+        cps = self._checkpoints(skus)
+        suspects, baselines = [], []
+        for row in rows:
+            cp = cps.get(row[0])
+            if cp is None or rebaseline:
+                baselines.append((row, totals[row[0]], cp))
+            elif self._verdict(row, totals[row[0]], cp):
+                suspects.append(row[0])
+        return suspects, baselines
+
+    def _recheck(self, skus: List[str]) -> List[dict]:
+        rows = [
+            tuple(r)
+            for r in self.db.query(Product.sku, Product.stock, Product.reserved_qty)
+            .filter(Product.sku.in_(skus))
+            .order_by(Product.sku)
+        ]
+        totals = self._totals(skus)
+        cps = self._checkpoints(skus)
+        out = []
+        for row in rows:
+            cp = cps.get(row[0])
+            verdict = cp and self._verdict(row, totals[row[0]], cp)
+            if verdict:
+                out.append(verdict)
+        return out
+
+    def _write_baselines(self, baselines, now: datetime):
+        for (sku, stock, _), totals, cp in baselines:
+            if cp is None:
+                cp = InventoryCheckpoint(sku=sku)
+                self.db.add(cp)
+            cp.stock = stock
+            cp.committed_total = totals["committed"]
+            cp.restocked_total = totals["restocked"]
+            cp.created_at = now
+
+    # --- entry point -------------------------------------------------------
+
+    def run(self, rebaseline: bool = False, report_path: Optional[str] = None) -> dict:
+        """
+        Scan all products and write discrepancies as JSON lines to `report_path`
+        (default: a timestamped file under RECONCILE_REPORT_DIR); the last line
+        is the summary, which is also returned.
+        With `rebaseline`, every SKU's checkpoint is reset to its current state.
+        """
+        now = datetime.now(timezone.utc)
+        if report_path is None:
+            os.makedirs(settings.RECONCILE_REPORT_DIR, exist_ok=True)
+            report_path = os.path.join(
+                settings.RECONCILE_REPORT_DIR,
+                f"reconcile-{now.strftime('%Y%m%dT%H%M%S')}.jsonl",
+            )
+
+        summary = {"scanned": 0, "baselined": 0, "discrepancies": 0}
+        # never inherit (or keep open) a caller's read snapshot
+        self.db.commit()
+        with open(report_path, "w", encoding="utf-8") as fh:
+            for rows in self._pages():
+                suspects, baselines = self._check_page(rows, rebaseline)
+                self._write_baselines(baselines, now)
+                self.db.commit()
+                if suspects:
+                    found = self._recheck(suspects)
+                    self.db.commit()
+                    for item in found:
+                        fh.write(json.dumps(item) + "\n")
+                    summary["discrepancies"] += len(found)
+                summary["scanned"] += len(rows)
+                summary["baselined"] += len(baselines)
+                # the next page starts from a clean identity map
+                self.db.expunge_all()
+            summary["report"] = report_path
+            summary["finished_at"] = datetime.now(timezone.utc).isoformat()
+            fh.write(json.dumps({"summary": summary}) + "\n")
+
+        if summary["discrepancies"]:
+            log.warning(
+                "inventory reconciliation: %d discrepancies, see %s",
+                summary["discrepancies"],
+                report_path,
+            )
+        return summary
+
+
+def run_reconciliation_job() -> dict:
+    """Scheduler entry point: one full reconciliation pass with its own session."""
+    db = SessionLocal()
+    try:
+        return ReconciliationService(db).run()
+    except Exception:
+        db.rollback()
+        log.exception("inventory reconciliation failed")
+        return {}
+    finally:
+        db.close()
@@ -0,0 +1,210 @@
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import case, delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models.inventory_checkpoint import InventoryCheckpoint
+from app.models.inventory_reservation import (
+    InventoryReservation,
+    InventoryReservationHistory,
+)
+
+log = logging.getLogger("reservation_archive")
+
+TERMINAL_STATUSES = ("committed", "released", "expired")
+ARCHIVE_MODES = ("table", "jsonl")
+
+_COLUMNS = (
+    "id",
+    "sku",
+    "quantity",
+    "reserved_at",
+    "reserved_until",
+    "status",
+    "order_id",
+)
+
+
+class ReservationArchiveException(Exception):
+    pass
+
+
+class ReservationArchiveService:
+    """
+    Moves terminal reservations older than a cutoff out of inventory_reservations,
+    either into inventory_reservations_history or into a gzipped JSONL file.
+
+    Work is done in batches of `batch_size` rows, each in its own short
+    transaction (copy, then delete by primary key), so the hot table never sees
+    one long-running delete. Active ('reserved') rows are never touched.
+    """
+
+    def __init__(self, db: Session, mode: Optional[str] = None):
+        self.db = db
+        self.mode = mode or settings.RESERVATION_ARCHIVE_MODE
+        if self.mode not in ARCHIVE_MODES:
+            raise ReservationArchiveException(f"Unknown archive mode: {self.mode}")
+
+    def _pick(self, cutoff: datetime, limit: int) -> List[int]:
+        q = (
+            select(InventoryReservation.id)
+            .where(
+                InventoryReservation.status.in_(TERMINAL_STATUSES),
+                InventoryReservation.reserved_at < cutoff,
+            )
+            .order_by(InventoryReservation.id)
+            .limit(limit)
+        )
+        if self.db.get_bind().dialect.name == "postgresql":
+            q = q.with_for_update(skip_locked=True)
+        return list(self.db.execute(q).scalars())
+
+    def _copy_to_history(self, ids: List[int], now: datetime):
+        src = InventoryReservation.__table__
+        cols = [src.c[c] for c in _COLUMNS]
+        self.db.execute(
+            insert(InventoryReservationHistory.__table__).from_select(
+                list(_COLUMNS) + ["archived_at"],
+                select(
+                    *cols, literal(now, InventoryReservationHistory.archived_at.type)
+                ).where(src.c.id.in_(ids)),
+            )
+        )
+
+    def _write_jsonl(self, fh, ids: List[int]):
+        src = InventoryReservation.__table__
+        rows = self.db.execute(
+            select(*[src.c[c] for c in _COLUMNS])
+            .where(src.c.id.in_(ids))
+            .order_by(src.c.id)
+        )
+        for row in rows:
+            rec = dict(row._mapping)
+            for k in ("reserved_at", "reserved_until"):
+                if rec[k] is not None:
+                    rec[k] = rec[k].isoformat()
+            fh.write(json.dumps(rec, separators=(",", ":")) + "\n")
+        fh.flush()
+
+    def _fold_into_checkpoints(self, ids: List[int]):
+        """
+        Committed rows leaving the database entirely would lower the committed
+        totals reconciliation compares against; lower the checkpoints by the
+        same amount so expected stock is unchanged.
+        """
+        committed = dict(
+            self.db.query(
+                InventoryReservation.sku, func.sum(InventoryReservation.quantity)
+            )
+            .filter(
+                InventoryReservation.id.in_(ids),
+                InventoryReservation.status == "committed",
+            )
+            .group_by(InventoryReservation.sku)
+        )
+        if committed:
+            delta = case(committed, value=InventoryCheckpoint.sku, else_=0)
+            self.db.query(InventoryCheckpoint).filter(
+                InventoryCheckpoint.sku.in_(committed)
+            ).update(
+                {
+                    InventoryCheckpoint.committed_total: InventoryCheckpoint.committed_total
+                    - delta
+                },
+                synchronize_session=False,
+            )
+
+    def compact(
+        self,
+        older_than_days: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        max_batches: Optional[int] = None,
+        now: Optional[datetime] = None,
+    ) -> dict:
+        """
+        Archive terminal reservations whose reserved_at is older than
+        `older_than_days`. Returns {"mode", "archived", "batches", "file"}.
+
+        JSONL export is at-least-once: a crash between writing a batch and
+        committing its delete leaves those rows in both places.
+        """
+        days = (
+            settings.RESERVATION_ARCHIVE_AFTER_DAYS
+            if older_than_days is None
+            else older_than_days
+        )
+        batch_size = batch_size or settings.RESERVATION_ARCHIVE_BATCH
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(days=days)
+
+        # start from a clean transaction so every batch commits on its own
+        self.db.commit()
+
+        fh = path = None
+        archived = batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                ids = self._pick(cutoff, batch_size)
+                if not ids:
+                    break
+                try:
+                    if self.mode == "table":
+                        self._copy_to_history(ids, now)
+                    else:
+                        if fh is None:
+                            directory = settings.RESERVATION_ARCHIVE_DIR
+                            os.makedirs(directory, exist_ok=True)
+                            path = os.path.join(
+                                directory,
+                                f"reservations-{now.strftime('%Y%m%dT%H%M%S')}.jsonl.gz",
+                            )
+                            fh = gzip.open(path, "at", encoding="utf-8")
+                        self._write_jsonl(fh, ids)
+                        self._fold_into_checkpoints(ids)
+                    self.db.execute(
+                        delete(InventoryReservation.__table__).where(
+                            InventoryReservation.__table__.c.id.in_(ids),
+                            InventoryReservation.__table__.c.status.in_(
+                                TERMINAL_STATUSES
+                            ),
+                        )
+                    )
+                    self.db.commit()
+                except Exception:
+                    self.db.rollback()
+                    raise
+                archived += len(ids)
+                batches += 1
+                if len(ids) < batch_size:
+                    break
+        finally:
+            if fh is not None:
+                fh.close()
+
+        if archived:
+            log.info("archived %d reservations in %d batches", archived, batches)
+        return {
+            "mode": self.mode,
+            "archived": archived,
+            "batches": batches,
+            "file": path,
+        }
+
+
+def run_archive_job() -> dict:
+    """Scheduler entry point: one compaction pass with its own session."""
+    db = SessionLocal()
+    try:
+        return ReservationArchiveService(db).compact()
+    except Exception:
+        log.exception("reservation archive run failed")
+        return {}
+    finally:
+        db.close()
@@ -0,0 +1,144 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from app.db import SessionLocal
+from app.services.inventory_ledger import LedgerOp, add_listener, remove_listener
+from app.services.inventory_service import InventoryService
+
+log = logging.getLogger("reservation_expiry")
+
+
+def _as_utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+class ReservationExpiryEngine:
+    """
+    Expires reservations close to their reserved_until instead of on a fixed scan.
+
+    - Deadlines of reservations committed by this process are pushed onto an
+      in-memory min-heap (via the inventory ledger's commit listener).
+    - A daemon thread sleeps until the earliest deadline, then runs
+      InventoryService.expire_overdue (chunked UPDATE ... RETURNING) once for
+      everything that is due.
+    - Runs never overlap: a second trigger while one is in flight is skipped.
+    - After every run, and on start-up, the next deadline is also read from the
+      DB (MIN over the (status, reserved_until) index), which covers restarts and
+      reservations made by other processes.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_sleep_seconds: float = 60.0,
+        retry_seconds: float = 0.1,
+    ):
+        self.session_factory = session_factory
+        self.max_sleep_seconds = max_sleep_seconds
+        self.retry_seconds = retry_seconds
+        self._heap: List[datetime] = []
+        self._cond = threading.Condition()
+        self._run_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    # --- scheduling ------------------------------------------------------------
+
+    def schedule(self, deadline: Optional[datetime]):
+        if deadline is None:
+            return
+        deadline = _as_utc(deadline)
+        with self._cond:
+            heapq.heappush(self._heap, deadline)
+            if self._heap[0] == deadline:
+                self._cond.notify()
+
+    def _on_commit(self, ops: List[LedgerOp]):
+        for op in ops:
+            if op.kind in ("reserve", "extend"):
+                self.schedule(op.reserved_until)
+
+    # --- lifecycle -------------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        add_listener(self._on_commit)
+        # catch up on anything that lapsed while we were down
+        self.run_once()
+        self._thread = threading.Thread(
+            target=self._loop, name="reservation-expiry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        remove_listener(self._on_commit)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    now = datetime.now(timezone.utc)
+                    if self._heap and self._heap[0] <= now:
+                        break
+                    wait = self.max_sleep_seconds
+                    if self._heap:
+                        wait = min(wait, (self._heap[0] - now).total_seconds())
+                    self._cond.wait(timeout=max(wait, 0.01))
+                if self._stopping:
+                    return
+                # everything due is handled by a single run
+                now = datetime.now(timezone.utc)
+                while self._heap and self._heap[0] <= now:
+                    heapq.heappop(self._heap)
+            self.run_once()
+
+    # --- work ------------------------------------------------------------------
+
+    def run_once(self) -> List[int]:
+        """Expire everything overdue now; returns expired ids ([] if a run is already in flight)."""
+        if not self._run_lock.acquire(blocking=False):
+            return []
+        db = self.session_factory()
+        try:
+            svc = InventoryService(db)
+            ids = svc.expire_overdue()
+            nxt = svc.next_expiry()
+            db.commit()
+            if ids:
+                log.info("expired %d reservations", len(ids))
+            if nxt is not None:
+                # rows still overdue here are locked by someone else: back off briefly
+                floor = datetime.now(timezone.utc) + timedelta(
+                    seconds=self.retry_seconds
+                )
+                self.schedule(max(_as_utc(nxt), floor))
+            return ids
+        except Exception:
+            db.rollback()
+            log.exception("reservation expiry run failed")
+            return []
+        finally:
+            db.close()
+            self._run_lock.release()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending_deadlines": len(self._heap),
+                "next_deadline": self._heap[0].isoformat() if self._heap else None,
+                "running": self._run_lock.locked(),
+            }
+
+
+expiry_engine = ReservationExpiryEngine()
@@ -12,6 +12,7 @@ from app.models.product import Product
 from app.models.return_line import ReturnLine
 from app.models.return_request import ReturnRequest
 from app.repositories.idempotency_repo import IdempotencyRepository
+from app.services.inventory_ledger import LedgerOp, record
 from app.services.inventory_service import InventoryService
 from app.utils.transactions import smart_transaction
 
@@ -101,6 +102,9 @@ class ReturnService:
         idem_key = None
         if idempotency_key:
             idem_key = f"return.receive:{rma_id}:{idempotency_key}"
+            cached = self.idem_repo.cached_response(idem_key)
+            if cached is not None:
+                return cached
             try:
                 rec, created = self.idem_repo.begin(
                     idem_key, operation="return_receive"
@@ -128,15 +132,9 @@ class ReturnService:
                 if rec and _is_completed(rec) and getattr(rec, "response_body", None):
                     return rec.response_body
 
-                import time
-
-                timeout = 2.0
-                start = time.time()
-                while time.time() - start < timeout:
-                    rec = self.idem_repo.get(idem_key)
-                    if _is_completed(rec) and getattr(rec, "response_body", None):
-                        return rec.response_body
-                    time.sleep(0.05)
+                done = self.idem_repo.wait_for_completion(idem_key, timeout=2.0)
+                if done and done[0] == IdempotencyStatus.COMPLETED:
+                    return done[1]
 
         rr = self.get_return(rma_id)
         if not rr:
@@ -219,6 +217,10 @@ class ReturnService:
                     if prod:
                         prod.stock = (prod.stock or 0) + rl.qty
                         self.db.add(prod)
+                        record(
+                            self.db,
+                            LedgerOp(kind="stock", sku=prod.sku, stock=prod.stock),
+                        )
                 rr.status = "REFUNDED"
                 self.db.add(rr)
 
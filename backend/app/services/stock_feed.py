@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+from app.config import settings
+from app.db import SessionLocal
+from app.services.inventory_ledger import LedgerOp, add_listener, remove_listener
+from app.services.inventory_service import InventoryService
+
+log = logging.getLogger("stock_feed")
+
+
+@dataclass(eq=False)
+class Subscription:
+    """One SSE client: an asyncio queue owned by the client's event loop."""
+
+    loop: asyncio.AbstractEventLoop
+    skus: Optional[FrozenSet[str]] = None  # None = every SKU
+    queue: asyncio.Queue = field(default=None)
+    dropped: int = 0
+
+    def wants(self, sku: str) -> bool:
+        return self.skus is None or sku in self.skus
+
+    def _put(self, event: dict):
+        # runs on the subscriber's loop; a slow client loses its oldest event
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+
+class StockFeedBroker:
+    """
+    Fans availability changes out to server-sent-event subscribers.
+
+    - The inventory ledger's commit listener reports which SKUs were reserved,
+      released, expired, committed or restocked; those SKUs are only marked dirty.
+    - After `coalesce_ms` one flush computes availability for every dirty SKU
+      somebody subscribes to (a single grouped query via available_quantities)
+      and pushes {"sku", "available", "delta"} items to each matching subscriber.
+    - A burst of reservations on one SKU inside the window becomes one event.
+
+    Only changes committed in this process are seen; with several workers each
+    worker feeds its own subscribers.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        coalesce_ms: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ):
+        self.session_factory = session_factory
+        self.coalesce_seconds = (
+            settings.STOCK_FEED_COALESCE_MS if coalesce_ms is None else coalesce_ms
+        ) / 1000.0
+        self.queue_size = queue_size or settings.STOCK_FEED_QUEUE_SIZE
+        self._lock = threading.Lock()
+        self._subs: Set[Subscription] = set()
+        self._dirty: Set[str] = set()
+        self._last: Dict[str, int] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    # --- lifecycle -------------------------------------------------------------
+
+    def start(self):
+        add_listener(self._on_commit)
+
+    def stop(self):
+        remove_listener(self._on_commit)
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self._dirty.clear()
+
+    # --- subscribers -----------------------------------------------------------
+
+    def subscribe(
+        self, skus: Optional[Iterable[str]] = None, loop=None
+    ) -> Subscription:
+        self.start()
+        loop = loop or asyncio.get_running_loop()
+        sub = Subscription(
+            loop=loop,
+            skus=frozenset(skus) if skus else None,
+            queue=asyncio.Queue(maxsize=self.queue_size),
+        )
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+
+    # --- change intake ---------------------------------------------------------
+
+    def _on_commit(self, ops: List[LedgerOp]):
+        with self._lock:
+            if not self._subs:
+                return
+            # extensions move a deadline but not availability
+            self._dirty.update(op.sku for op in ops if op.kind != "extend")
+            if self._dirty and self._timer is None:
+                self._timer = threading.Timer(self.coalesce_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def snapshot(self, skus: Iterable[str]) -> List[dict]:
+        """Current availability for `skus` (initial event for a new subscriber)."""
+        found = self._query(list(skus))
+        with self._lock:
+            for sku, avail in found.items():
+                self._last.setdefault(sku, avail)
+        return [{"sku": s, "available": a, "delta": None} for s, a in found.items()]
+
+    def _query(self, skus: List[str]) -> Dict[str, int]:
+        if not skus:
+            return {}
+        db = self.session_factory()
+        try:
+            return InventoryService(db).available_quantities(skus, use_cache=False)
+        finally:
+            db.close()
+
+    def flush(self):
+        """Publish availability for every dirty SKU that has a subscriber."""
+        with self._lock:
+            self._timer = None
+            dirty, self._dirty = self._dirty, set()
+            subs = list(self._subs)
+        wanted = sorted(s for s in dirty if any(sub.wants(s) for sub in subs))
+        if not wanted:
+            return
+        try:
+            found = self._query(wanted)
+        except Exception:
+            log.exception("stock feed flush failed")
+            return
+
+        items = []
+        with self._lock:
+            for sku in wanted:
+                if sku not in found:
+                    continue
+                prev = self._last.get(sku)
+                if prev == found[sku]:
+                    continue
+                self._last[sku] = found[sku]
+                items.append(
+                    {
+                        "sku": sku,
+                        "available": found[sku],
+                        "delta": None if prev is None else found[sku] - prev,
+                    }
+                )
+        if not items:
+            return
+        for sub in subs:
+            mine = [i for i in items if sub.wants(i["sku"])]
+            if mine:
+                try:
+                    sub.loop.call_soon_threadsafe(sub._put, {"items": mine})
+                except RuntimeError:
+                    # the subscriber's loop is gone
+                    self.unsubscribe(sub)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subs),
+                "dirty": len(self._dirty),
+                "dropped": sum(s.dropped for s in self._subs),
+            }
+
+
+stock_feed = StockFeedBroker()
@@ -0,0 +1,89 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class IdempotencyWaiters:
+    """
+    In-process completion registry keyed by idempotency key.
+
+    A request that lost the race for a key waits on an Event instead of
+    sleep-polling; the owner calls notify(key) once its COMPLETED/FAILED state
+    is committed and every waiter in this process wakes immediately. Owners in
+    other processes cannot signal us, so waiting also re-checks the database
+    with exponential backoff (poll_initial doubling up to poll_max).
+    """
+
+    def __init__(self, poll_initial: float = 0.05, poll_max: float = 0.5):
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self._lock = threading.Lock()
+        # key -> (event, number of waiters)
+        self._events: Dict[str, list] = {}
+
+    def _register(self, key: str) -> threading.Event:
+        with self._lock:
+            slot = self._events.get(key)
+            if slot is None:
+                slot = self._events[key] = [threading.Event(), 0]
+            slot[1] += 1
+            return slot[0]
+
+    def _unregister(self, key: str, event: threading.Event):
+        with self._lock:
+            slot = self._events.get(key)
+            if slot is not None and slot[0] is event:
+                slot[1] -= 1
+                if slot[1] <= 0:
+                    del self._events[key]
+
+    def notify(self, key: str):
+        """Wake everyone waiting on `key` (call after the owner's commit)."""
+        with self._lock:
+            slot = self._events.pop(key, None)
+        if slot is not None:
+            slot[0].set()
+
+    def wait(
+        self, key: str, check: Callable[[], Optional[T]], timeout: float
+    ) -> Optional[T]:
+        """
+        Return the first non-None result of `check()` within `timeout` seconds,
+        else None. `check` runs once up front, after every notification and on
+        each backoff tick.
+        """
+        event = self._register(key)
+        try:
+            # registered before the first check, so a notify in between is not lost
+            result = check()
+            if result is not None:
+                return result
+            deadline = time.monotonic() + timeout
+            delay = self.poll_initial
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                if event.wait(min(delay, remaining)):
+                    result = check()
+                    if result is not None:
+                        return result
+                    # notified but not visible yet: keep listening on a fresh event
+                    self._unregister(key, event)
+                    event = self._register(key)
+                else:
+                    result = check()
+                    if result is not None:
+                        return result
+                    delay = min(delay * 2, self.poll_max)
+        finally:
+            self._unregister(key, event)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(slot[1] for slot in self._events.values())
+
+
+idempotency_waiters = IdempotencyWaiters()
@@ -0,0 +1,255 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from filelock import FileLock, Timeout
+from sqlalchemy import text
+
+from app.config import settings
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class LockStats:
+    """Per-key wait/hold timings and timeout counts (seconds)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys: Dict[str, Dict[str, float]] = {}
+
+    def _entry(self, key: str) -> Dict[str, float]:
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = {
+                "acquired": 0,
+                "timeouts": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+                "hold_total": 0.0,
+                "hold_max": 0.0,
+            }
+        return entry
+
+    def record(self, key: str, waited: float, held: float):
+        with self._lock:
+            e = self._entry(key)
+            e["acquired"] += 1
+            e["wait_total"] += waited
+            e["wait_max"] = max(e["wait_max"], waited)
+            e["hold_total"] += held
+            e["hold_max"] = max(e["hold_max"], held)
+
+    def timeout(self, key: str, waited: float):
+        with self._lock:
+            e = self._entry(key)
+            e["timeouts"] += 1
+            e["wait_total"] += waited
+            e["wait_max"] = max(e["wait_max"], waited)
+
+    def snapshot(self, top: int = 20, sort: str = "wait_total") -> List[Dict]:
+        with self._lock:
+            rows = [dict(v, key=k) for k, v in self._keys.items()]
+        rows.sort(key=lambda r: r.get(sort, 0), reverse=True)
+        for r in rows:
+            n = r["acquired"] or 1
+            r["wait_avg"] = r["wait_total"] / n
+            r["hold_avg"] = r["hold_total"] / n
+        return rows[:top]
+
+    def reset(self):
+        with self._lock:
+            self._keys.clear()
+
+
+class LockManager:
+    """
+    Named mutual-exclusion locks (one per SKU) with contention metrics.
+
+    Subclasses implement _acquire/_release for one "slot"; keys map onto slots
+    through `slot_for`, so striped backends share a bounded number of locks.
+    acquire_many takes each distinct slot once, in sorted order, so callers
+    locking several keys cannot deadlock each other.
+    """
+
+    backend = "base"
+
+    def __init__(self):
+        self.stats = LockStats()
+
+    def slot_for(self, key: str):
+        return key
+
+    def _acquire(self, slot, timeout: float):
+        raise NotImplementedError
+
+    def _release(self, slot, handle):
+        raise NotImplementedError
+
+    @contextmanager
+    def acquire(self, key: str, timeout: Optional[float] = None) -> Iterator[None]:
+        with self.acquire_many([key], timeout=timeout):
+            yield
+
+    @contextmanager
+    def acquire_many(
+        self, keys: Iterable[str], timeout: Optional[float] = None
+    ) -> Iterator[None]:
+        timeout = settings.LOCK_TIMEOUT_SECONDS if timeout is None else timeout
+        keys = sorted(set(keys))
+        slots: Dict = {}
+        for key in keys:
+            slots.setdefault(self.slot_for(key), []).append(key)
+
+        start = time.monotonic()
+        deadline = start + timeout
+        with ExitStack() as held:
+            for slot in sorted(slots):
+                remaining = max(0.0, deadline - time.monotonic())
+                try:
+                    handle = self._acquire(slot, remaining)
+                except LockTimeout:
+                    waited = time.monotonic() - start
+                    for key in keys:
+                        self.stats.timeout(key, waited)
+                    raise
+                held.callback(self._release, slot, handle)
+            acquired_at = time.monotonic()
+            try:
+                yield
+            finally:
+                now = time.monotonic()
+                for key in keys:
+                    self.stats.record(key, acquired_at - start, now - acquired_at)
+
+
+class StripedLockManager(LockManager):
+    """In-process locks striped over a fixed pool; single worker process only."""
+
+    backend = "local"
+
+    def __init__(self, stripes: int = 256):
+        super().__init__()
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+
+    def slot_for(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % len(self._stripes)
+
+    def _acquire(self, slot: int, timeout: float):
+        if not self._stripes[slot].acquire(timeout=timeout):
+            raise LockTimeout(f"lock stripe {slot} busy")
+
+    def _release(self, slot: int, handle):
+        self._stripes[slot].release()
+
+
+class FileLockManager(LockManager):
+    """
+    Striped file locks for several worker processes on one host. Uses a fixed
+    set of lock files rather than one file per SKU.
+    """
+
+    backend = "file"
+
+    def __init__(self, directory: Optional[str] = None, stripes: int = 256):
+        super().__init__()
+        self.directory = directory or os.path.join(
+            tempfile.gettempdir(), "yourlocalshop_locks"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        self.stripes = stripes
+        # FileLock is thread-local by default: each thread gets its own fd, so
+        # threads of this process exclude each other as well as other processes.
+        self._locks = [
+            FileLock(os.path.join(self.directory, f"reserve_stripe_{i:04d}.lock"))
+            for i in range(stripes)
+        ]
+
+    def slot_for(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.stripes
+
+    def _acquire(self, slot: int, timeout: float):
+        try:
+            self._locks[slot].acquire(timeout=timeout)
+        except Timeout:
+            raise LockTimeout(f"lock file stripe {slot} busy")
+
+    def _release(self, slot: int, handle):
+        self._locks[slot].release()
+
+
+class AdvisoryLockManager(LockManager):
+    """
+    Postgres session-level advisory locks, for several nodes sharing one DB.
+    Each held lock pins a pooled connection until release.
+    """
+
+    backend = "advisory"
+
+    def __init__(self, engine, poll_seconds: float = 0.01):
+        super().__init__()
+        self.engine = engine
+        self.poll_seconds = poll_seconds
+
+    def slot_for(self, key: str) -> int:
+        # stable signed 64-bit key (Python's hash() is salted per process)
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def _acquire(self, slot: int, timeout: float):
+        conn = self.engine.connect()
+        deadline = time.monotonic() + timeout
+        delay = self.poll_seconds
+        try:
+            while True:
+                got = conn.execute(
+                    text("SELECT pg_try_advisory_lock(:k)"), {"k": slot}
+                ).scalar()
+                if got:
+                    return conn
+                if time.monotonic() >= deadline:
+                    raise LockTimeout(f"advisory lock {slot} busy")
+                time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+                delay = min(delay * 2, 0.2)
+        except BaseException:
+            conn.close()
+            raise
+
+    def _release(self, slot: int, conn):
+        try:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": slot})
+        finally:
+            conn.close()
+
+
+_manager: Optional[LockManager] = None
+_manager_guard = threading.Lock()
+
+
+def get_lock_manager() -> LockManager:
+    """Process-wide lock manager selected by settings.LOCK_BACKEND."""
+    global _manager
+    if _manager is None:
+        with _manager_guard:
+            if _manager is None:
+                backend = settings.LOCK_BACKEND
+                if backend == "local":
+                    _manager = StripedLockManager(stripes=settings.LOCK_STRIPES)
+                elif backend == "file":
+                    _manager = FileLockManager(
+                        directory=settings.LOCK_DIR or None,
+                        stripes=settings.LOCK_STRIPES,
+                    )
+                elif backend == "advisory":
+                    from app.db import engine
+
+                    _manager = AdvisoryLockManager(engine)
+                else:
+                    raise ValueError(f"Unknown LOCK_BACKEND: {backend}")
+    return _manager
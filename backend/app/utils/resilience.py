@@ -0,0 +1,194 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class CircuitOpen(Exception):
+    """The breaker is open: the dependency is failing, calls are refused."""
+
+
+class BulkheadFull(Exception):
+    """Too many calls to the dependency are already in flight."""
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time in
+    [0, min(max_delay, base_delay * 2**n)], so clients that failed together do
+    not retry together.
+    """
+
+    def __init__(
+        self, attempts: int = 3, base_delay: float = 0.05, max_delay: float = 1.0
+    ):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2**retry)))
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures; open refuses
+    calls for `reset_timeout` seconds, then half_open lets a single probe through:
+    its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened_count = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        elapsed = time.monotonic() - self._opened_at
+        if self._state == "open" and elapsed >= self.reset_timeout:
+            self._state = "half_open"
+            self._probing = False
+        return self._state
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go through now."""
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpen(f"{self.name} circuit open")
+
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self.opened_count += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            state = self._current_state()
+            retry_in = (
+                max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+                if state == "open"
+                else 0.0
+            )
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened_count,
+                "rejected": self.rejected,
+                "retry_in_seconds": round(retry_in, 3),
+            }
+
+
+class Bulkhead:
+    """
+    Caps concurrent calls to one dependency. Calls beyond `max_concurrent` are
+    rejected at once (BulkheadFull) rather than queued, so a slow dependency
+    cannot absorb every worker. Usable from threads and event loops alike.
+    """
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._lock:
+            if self.in_flight >= self.max_concurrent:
+                self.rejected += 1
+                raise BulkheadFull(f"{self.name}: {self.in_flight} calls in flight")
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrent": self.max_concurrent,
+                "peak": self.peak,
+                "rejected": self.rejected,
+            }
+
+
+_registry_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+_bulkheads: Dict[str, Bulkhead] = {}
+
+
+def get_breaker(
+    name: str, failure_threshold: int = 5, reset_timeout: float = 30.0
+) -> CircuitBreaker:
+    """Process-wide breaker for `name`; settings apply on first use."""
+    with _registry_lock:
+        b = _breakers.get(name)
+        if b is None:
+            b = _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        return b
+
+
+def get_bulkhead(name: str, max_concurrent: int = 50) -> Bulkhead:
+    with _registry_lock:
+        b = _bulkheads.get(name)
+        if b is None:
+            b = _bulkheads[name] = Bulkhead(name, max_concurrent)
+        return b
+
+
+def snapshot(name: Optional[str] = None) -> Dict[str, Dict]:
+    """Breaker state (plus bulkhead usage) for every registered dependency."""
+    with _registry_lock:
+        names = sorted(set(_breakers) | set(_bulkheads))
+        breakers, bulkheads = dict(_breakers), dict(_bulkheads)
+    out = {}
+    for n in names:
+        if name and n != name:
+            continue
+        entry = breakers[n].snapshot() if n in breakers else {"state": "closed"}
+        if n in bulkheads:
+            entry["bulkhead"] = bulkheads[n].snapshot()
+        out[n] = entry
+    return out
@@ -0,0 +1,125 @@
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import Table, bindparam, insert, text
+from sqlalchemy.orm import Session
+
+
+def supports_returning(session: Session) -> bool:
+    """
+    True when the bound database understands INSERT/UPDATE ... RETURNING.
+    SQLAlchemy 1.4 only compiles RETURNING for some dialects, but SQLite has
+    supported it natively since 3.35, so callers can issue it as text().
+    """
+    dialect = session.get_bind().dialect
+    if dialect.name == "postgresql":
+        return True
+    if dialect.name == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def insert_returning(
+    session: Session,
+    table: Table,
+    rows: List[Dict],
+    returning: Sequence[str] = ("id",),
+    conflict_target: Optional[Sequence[str]] = None,
+    chunk_size: int = 500,
+) -> List:
+    """
+    Insert `rows` (dicts sharing the same keys) with a single multi-row
+    INSERT ... RETURNING on the session's connection and return the RETURNING
+    rows. Their order is unspecified (SQLite documents it as arbitrary): to
+    pair them with `rows`, return an identifying column or use
+    insert_returning_ids. With `conflict_target`, rows that collide are skipped
+    via ON CONFLICT (...) DO NOTHING and simply absent from the result.
+
+    Databases without RETURNING fall back to one INSERT per row and only the
+    primary key is returned (conflict_target is not supported there).
+    Rows are sent `chunk_size` at a time to stay under bind-parameter limits.
+    """
+    if not rows:
+        return []
+    if len(rows) > chunk_size:
+        out = []
+        for start in range(0, len(rows), chunk_size):
+            out.extend(
+                insert_returning(
+                    session,
+                    table,
+                    rows[start : start + chunk_size],
+                    returning=returning,
+                    conflict_target=conflict_target,
+                    chunk_size=chunk_size,
+                )
+            )
+        return out
+
+    if not supports_returning(session):
+        if conflict_target:
+            raise NotImplementedError("ON CONFLICT requires RETURNING support")
+        out = []
+        for row in rows:
+            res = session.execute(insert(table).values(**row))
+            out.append(tuple(res.inserted_primary_key))
+        return out
+
+    quote = session.get_bind().dialect.identifier_preparer.quote
+    keys = list(rows[0].keys())
+    params, binds, values_sql = {}, [], []
+    for i, row in enumerate(rows):
+        names = []
+        for key in keys:
+            name = f"{key}_{i}"
+            params[name] = row[key]
+            binds.append(bindparam(name, type_=table.c[key].type))
+            names.append(f":{name}")
+        values_sql.append("(" + ", ".join(names) + ")")
+
+    sql = (
+        f"INSERT INTO {quote(table.name)} ({', '.join(quote(k) for k in keys)}) "
+        f"VALUES {', '.join(values_sql)}"
+    )
+    if conflict_target:
+        sql += (
+            f" ON CONFLICT ({', '.join(quote(c) for c in conflict_target)}) DO NOTHING"
+        )
+    sql += f" RETURNING {', '.join(quote(c) for c in returning)}"
+
+    stmt = text(sql).bindparams(*binds).columns(*[table.c[c] for c in returning])
+    return session.execute(stmt, params).all()
+
+
+def _match_key(values) -> tuple:
+    # DateTime columns come back naive: compare the stored (UTC) wall time
+    return tuple(
+        v.replace(tzinfo=None) if isinstance(v, datetime) else v for v in values
+    )
+
+
+def insert_returning_ids(
+    session: Session,
+    table: Table,
+    rows: List[Dict],
+    match: Sequence[str],
+    chunk_size: int = 500,
+) -> List:
+    """
+    insert_returning for tables with an `id` primary key, returning the new ids
+    aligned with `rows`. RETURNING rows come back in no particular order, so
+    each is paired with its input row on the `match` columns; rows equal on
+    every `match` column must be interchangeable for the caller.
+    """
+    returned = insert_returning(
+        session, table, rows, returning=("id", *match), chunk_size=chunk_size
+    )
+    if not supports_returning(session):
+        # one INSERT per row, in order, primary key only
+        return [r[0] for r in returned]
+    ids_by_key = defaultdict(list)
+    for r in returned:
+        ids_by_key[_match_key(r[1:])].append(r[0])
+    return [ids_by_key[_match_key(row[c] for c in match)].pop() for row in rows]
@@ -0,0 +1,243 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional
+from uuid import uuid4
+
+from app.config import settings
+
+# upper bounds (ms) of the latency histogram buckets; the last one is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Span:
+    """One timed operation, OpenTelemetry-style: ids, parent, attributes, status."""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "end",
+        "attributes",
+        "status",
+        "_t0",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid4().hex
+        self.span_id = uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self._t0 = time.perf_counter()
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end - self.start) * 1000 if self.end else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentId": self.parent_id,
+            "start": self.start,
+            "durationMs": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class StageHistograms:
+    """Exporter aggregating span durations per span name into fixed buckets."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict] = {}
+
+    def export(self, span: Span):
+        ms = span.duration_ms
+        with self._lock:
+            h = self._stages.get(span.name)
+            if h is None:
+                h = self._stages[span.name] = {
+                    "count": 0,
+                    "errors": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "buckets": [0] * (len(BUCKETS_MS) + 1),
+                }
+            h["count"] += 1
+            h["errors"] += span.status != "ok"
+            h["total_ms"] += ms
+            h["max_ms"] = max(h["max_ms"], ms)
+            h["buckets"][bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    @staticmethod
+    def _quantile(h: Dict, q: float) -> float:
+        # upper bound of the bucket holding the q-th sample (max for the open bucket)
+        rank = q * h["count"]
+        seen = 0
+        for i, n in enumerate(h["buckets"]):
+            seen += n
+            if n and seen >= rank:
+                return float(BUCKETS_MS[i]) if i < len(BUCKETS_MS) else h["max_ms"]
+        return h["max_ms"]
+
+    def snapshot(self, prefix: Optional[str] = None) -> Dict[str, Dict]:
+        with self._lock:
+            stages = {
+                k: dict(v, buckets=list(v["buckets"]))
+                for k, v in self._stages.items()
+                if not prefix or k.startswith(prefix)
+            }
+        out = {}
+        for name, h in sorted(stages.items()):
+            out[name] = {
+                "count": h["count"],
+                "errors": h["errors"],
+                "mean_ms": round(h["total_ms"] / h["count"], 3),
+                "p50_ms": self._quantile(h, 0.50),
+                "p90_ms": self._quantile(h, 0.90),
+                "p99_ms": self._quantile(h, 0.99),
+                "max_ms": round(h["max_ms"], 3),
+                "total_ms": round(h["total_ms"], 3),
+                "buckets": {
+                    (f"le_{b}" if i < len(BUCKETS_MS) else "inf"): n
+                    for i, (b, n) in enumerate(zip(BUCKETS_MS + (None,), h["buckets"]))
+                    if n
+                },
+            }
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+class RecentTraces:
+    """Exporter keeping the last `maxlen` finished spans for trace inspection."""
+
+    def __init__(self, maxlen: int):
+        self._lock = threading.Lock()
+        self._spans: Deque[Span] = deque(maxlen=maxlen)
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    def traces(self, limit: int = 20, name: Optional[str] = None) -> List[Dict]:
+        """Newest root spans (optionally by name), each with its finished descendants."""
+        with self._lock:
+            spans = list(self._spans)
+        by_trace: Dict[str, List[Span]] = {}
+        for s in spans:
+            by_trace.setdefault(s.trace_id, []).append(s)
+        roots = [
+            s
+            for s in reversed(spans)
+            if s.parent_id is None and (name is None or s.name == name)
+        ][:limit]
+        return [
+            dict(
+                root.to_dict(),
+                spans=[
+                    s.to_dict()
+                    for s in sorted(by_trace[root.trace_id], key=lambda s: s.start)
+                    if s is not root
+                ],
+            )
+            for root in roots
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Tracer:
+    """
+    Minimal in-process tracer. `span()` nests through a context variable, so
+    spans opened in the same thread, task, or threadpool call made from it
+    (run_in_threadpool copies the context) share the caller's trace.
+    Finished spans go to every exporter; nothing leaves the process.
+    """
+
+    def __init__(self, exporters, enabled: bool = True):
+        self.exporters = list(exporters)
+        self.enabled = enabled
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        if not self.enabled:
+            yield None
+            return
+        span = Span(name, _current.get(), attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attributes["error"] = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            _current.reset(token)
+            span.end = span.start + (time.perf_counter() - span._t0)
+            for exporter in self.exporters:
+                exporter.export(span)
+
+    def current(self) -> Optional[Span]:
+        return _current.get()
+
+
+stage_histograms = StageHistograms()
+recent_traces = RecentTraces(settings.TRACING_RECENT_SPANS)
+tracer = Tracer([stage_histograms, recent_traces], enabled=settings.TRACING_ENABLED)
+
+
+def traced(name: str):
+    """Decorator: run the function (sync or async) inside tracer.span(name)."""
+
+    def wrap(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                with tracer.span(name):
+                    return await fn(*args, **kwargs)
+
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+
+        return run
+
+    return wrap
+
+
+def annotate(**attributes):
+    """Set attributes on the current span, if any."""
+    span = _current.get()
+    if span is not None:
+        span.attributes.update(attributes)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Bring an existing database up to the current models without dropping data.
+
+init_db() only creates missing tables (create_all), so columns and indexes added
+to existing tables need an explicit step here. Every step checks the live schema
+first, so the script is safe to run repeatedly.
+
+Usage:
+    python scripts/migrate_schema.py            # apply pending steps
+    python scripts/migrate_schema.py --dry-run  # list what would change
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+# allow running from repo/scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import DateTime, bindparam, inspect, text
+
+from app.config import settings
+from app.db import engine, init_db
+
+
+def _has_column(conn, table: str, column: str) -> bool:
+    # a missing table counts as up to date: create_all will build it from the model
+    insp = inspect(conn)
+    if not insp.has_table(table):
+        return True
+    return column in {c["name"] for c in insp.get_columns(table)}
+
+
+def add_product_reserved_qty(conn, dry_run: bool) -> bool:
+    """products.reserved_qty, backfilled from reservations still in status 'reserved'."""
+    if _has_column(conn, "products", "reserved_qty"):
+        return False
+    if dry_run:
+        return True
+    conn.execute(
+        text("ALTER TABLE products ADD COLUMN reserved_qty INTEGER NOT NULL DEFAULT 0")
+    )
+    conn.execute(
+        text(
+            "UPDATE products SET reserved_qty = COALESCE(("
+            " SELECT SUM(r.quantity) FROM inventory_reservations r"
+            " WHERE r.sku = products.sku AND r.status = 'reserved'"
+            "), 0)"
+        )
+    )
+    return True
+
+
+def _has_index(conn, table: str, name: str) -> bool:
+    insp = inspect(conn)
+    if not insp.has_table(table):
+        return True
+    return name in {ix["name"] for ix in insp.get_indexes(table)}
+
+
+def add_reservation_status_until_index(conn, dry_run: bool) -> bool:
+    """(status, reserved_until) index used by the reservation expiry engine."""
+    name = "ix_inventory_reservations_status_until"
+    if _has_index(conn, "inventory_reservations", name):
+        return False
+    if dry_run:
+        return True
+    conn.execute(
+        text(f"CREATE INDEX {name} ON inventory_reservations (status, reserved_until)")
+    )
+    return True
+
+
+def add_order_customer_created_index(conn, dry_run: bool) -> bool:
+    """(customer_id, created_at) index behind GET /api/orders?customer_id=..."""
+    name = "ix_orders_customer_created"
+    if _has_index(conn, "orders", name):
+        return False
+    if dry_run:
+        return True
+    conn.execute(text(f"CREATE INDEX {name} ON orders (customer_id, created_at)"))
+    return True
+
+
+def add_idempotency_expires_at(conn, dry_run: bool) -> bool:
+    """
+    idempotency_records.expires_at and its index (purge job). Existing rows get
+    now + IDEMPOTENCY_DEFAULT_TTL_HOURS: their created_at is not reliable (older
+    models stamped every row with the process start time).
+    """
+    table = "idempotency_records"
+    name = "ix_idempotency_records_expires_at"
+    has_column = _has_column(conn, table, "expires_at")
+    if has_column and _has_index(conn, table, name):
+        return False
+    if dry_run:
+        return True
+    if not has_column:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN expires_at DATETIME"))
+        expires_at = datetime.now(timezone.utc) + timedelta(
+            hours=settings.IDEMPOTENCY_DEFAULT_TTL_HOURS
+        )
+        conn.execute(
+            text(
+                f"UPDATE {table} SET expires_at = :expires_at WHERE expires_at IS NULL"
+            ).bindparams(bindparam("expires_at", type_=DateTime())),
+            {"expires_at": expires_at},
+        )
+    conn.execute(text(f"CREATE INDEX {name} ON {table} (expires_at)"))
+    return True
+
+
+def add_idempotency_request_hash(conn, dry_run: bool) -> bool:
+    """idempotency_records.request_hash; existing records keep NULL (never checked)."""
+    if _has_column(conn, "idempotency_records", "request_hash"):
+        return False
+    if dry_run:
+        return True
+    conn.execute(
+        text("ALTER TABLE idempotency_records ADD COLUMN request_hash VARCHAR(64)")
+    )
+    return True
+
+
+STEPS = [
+    add_product_reserved_qty,
+    add_reservation_status_until_index,
+    add_order_customer_created_index,
+    add_idempotency_expires_at,
+    add_idempotency_request_hash,
+]
+
+
+def migrate(dry_run: bool = False):
+    with engine.begin() as conn:
+        for step in STEPS:
+            changed = step(conn, dry_run)
+            state = ("pending" if dry_run else "applied") if changed else "up to date"
+            print(f"{step.__name__}: {state}")
+    # then create any brand-new tables; existing tables are left untouched
+    if not dry_run:
+        init_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    migrate(dry_run=args.dry_run)
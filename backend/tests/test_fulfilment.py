@@ -1,9 +1,15 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
 from app.adapters.mock_courier import MockCourierAdapter
 from app.db import SessionLocal, init_db
+from app.models.outbox import OutboxEvent
+from app.models.packing_task import PackingTask
 from app.models.product import Product
 from app.repositories.idempotency_repo import IdempotencyRepository
 from app.services.fulfilment_service import FulfilmentService
 from app.services.order_service import OrderService
+from app.services.outbox import ORDER_COMPLETED, OutboxDispatcher, enqueue
 
 # def setup_module(module):
 #     init_db()
@@ -25,7 +31,15 @@ def test_packing_task_created_after_order():
             {"token": "tok-1"},
             idempotency_key="ftest-1",
         )
-        # After creation, a packing task should exist
+        # checkout only queued order.completed; the dispatcher creates the task
+        event = (
+            db.query(OutboxEvent)
+            .filter(OutboxEvent.aggregate_id == resp["orderId"])
+            .one()
+        )
+        assert event.topic == ORDER_COMPLETED
+        OutboxDispatcher().run_pending()
+
         fulfil = FulfilmentService(db)
         tasks = fulfil.list_pending_tasks()
         assert any(t.order_id == resp["orderId"] for t in tasks)
@@ -33,6 +47,51 @@ def test_packing_task_created_after_order():
         db.close()
 
 
+def test_outbox_redelivery_and_retries(monkeypatch):
+    monkeypatch.setattr("app.config.settings.OUTBOX_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr("app.config.settings.OUTBOX_RETRY_SECONDS", 0)
+    calls = []
+
+    def flaky(db, payload):
+        calls.append(payload["n"])
+        raise RuntimeError("webhook down")
+
+    topic = f"test.flaky.{uuid4().hex[:8]}"
+    dispatcher = OutboxDispatcher(handlers={topic: [flaky]})
+    db = SessionLocal()
+    try:
+        enqueue(db, topic, {"n": 1})
+        db.commit()
+        assert dispatcher.run_pending() == []
+        assert dispatcher.run_pending() == []
+        ev = db.query(OutboxEvent).filter(OutboxEvent.topic == topic).one()
+        assert (ev.status, ev.attempts, calls) == ("failed", 2, [1, 1])
+        assert "webhook down" in ev.last_error
+
+        # at least once: an expired lease hands the event out again, and the
+        # packing task handler does not duplicate its task
+        order_id = 1
+        enqueue(db, ORDER_COMPLETED, {"order_id": order_id}, aggregate_id=order_id)
+        db.commit()
+        OutboxDispatcher().run_pending()
+        ev = (
+            db.query(OutboxEvent)
+            .filter(OutboxEvent.aggregate_id == order_id)
+            .order_by(OutboxEvent.id.desc())
+            .first()
+        )
+        ev.status = "processing"
+        ev.locked_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+        db.commit()
+        tasks = db.query(PackingTask).filter(PackingTask.order_id == order_id)
+        before = tasks.count()
+        assert before >= 1
+        assert ev.id in OutboxDispatcher().run_pending()
+        assert tasks.count() == before
+    finally:
+        db.close()
+
+
 def test_mark_packed_and_book():
     db = SessionLocal()
     try:
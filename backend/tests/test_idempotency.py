@@ -0,0 +1,259 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, text
+
+from app.db import SessionLocal, engine
+from app.models.idempotency import IdempotencyRecord, IdempotencyStatus
+from app.repositories.idempotency_repo import (
+    IdempotencyKeyReused,
+    IdempotencyRepository,
+    request_fingerprint,
+)
+from app.services.order_service import OrderService, OrderServiceException
+from app.utils.idem_lock import IdempotencyWaiters
+
+
+def test_waiter_wakes_on_notify_not_on_poll():
+    # polling alone would not look again for 10s
+    waiters = IdempotencyWaiters(poll_initial=10, poll_max=10)
+    state = {"done": None}
+
+    def owner():
+        time.sleep(0.2)
+        state["done"] = "response"
+        waiters.notify("k1")
+
+    threading.Thread(target=owner).start()
+    t0 = time.monotonic()
+    assert waiters.wait("k1", lambda: state["done"], timeout=5) == "response"
+    assert time.monotonic() - t0 < 1
+    assert waiters.pending() == 0
+
+    assert waiters.wait("k2", lambda: None, timeout=0.1) is None
+
+
+def test_duplicate_gets_owner_response_from_repository():
+    key = f"idem-wait-{time.time_ns()}"
+    owner_db, waiter_db = SessionLocal(), SessionLocal()
+    try:
+        owner = IdempotencyRepository(owner_db)
+        _, created = owner.begin(key, "create_order")
+        assert created
+
+        def finish():
+            time.sleep(0.2)
+            # sessions (and their SQLite connections) stay on one thread
+            thread_db = SessionLocal()
+            try:
+                IdempotencyRepository(thread_db).mark_completed(key, {"orderId": 42})
+            finally:
+                thread_db.close()
+
+        threading.Thread(target=finish).start()
+        status, body, _ = IdempotencyRepository(waiter_db).wait_for_completion(
+            key, timeout=5
+        )
+        assert status == IdempotencyStatus.COMPLETED
+        assert body == {"orderId": 42}
+    finally:
+        owner_db.close()
+        waiter_db.close()
+
+
+def test_completed_responses_are_replayed_from_cache():
+    key = f"idem-cache-{time.time_ns()}"
+    db = SessionLocal()
+    try:
+        repo = IdempotencyRepository(db)
+        repo.begin(key, "create_order")
+        assert repo.cached_response(key) is None
+        repo.mark_completed(key, {"orderId": 7})
+
+        statements = []
+
+        def count(conn, cursor, statement, params, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            replay = OrderService(db).create_order(None, [], {}, idempotency_key=key)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        assert replay == {"orderId": 7}
+        assert statements == []
+
+        # a state change evicts the entry
+        repo.mark_failed(key, "refunded by support")
+        db.commit()
+        assert repo.cached_response(key) is None
+    finally:
+        db.close()
+
+
+def test_in_session_completion_cached_only_once_committed():
+    key = f"idem-cache-tx-{time.time_ns()}"
+    db = SessionLocal()
+    try:
+        repo = IdempotencyRepository(db)
+        repo.begin(key, "create_order")
+        repo.mark_completed(key, {"orderId": 8}, in_session=True)
+        assert repo.cached_response(key) is None
+        db.rollback()
+        assert repo.cached_response(key) is None
+
+        repo.mark_completed(key, {"orderId": 9}, in_session=True)
+        db.commit()
+        assert repo.cached_response(key) == {"orderId": 9}
+    finally:
+        db.close()
+
+
+def test_records_expire_per_operation():
+    stamp = time.time_ns()
+    db = SessionLocal()
+    try:
+        repo = IdempotencyRepository(db)
+        order, _ = repo.begin(f"idem-ttl-o-{stamp}", "create_order")
+        ret, _ = repo.begin(f"idem-ttl-r-{stamp}", "return_receive")
+        # created_at is stamped per row, not once at import
+        assert order.created_at != ret.created_at
+        assert order.expires_at - order.created_at == timedelta(hours=24)
+        assert ret.expires_at - ret.created_at == timedelta(hours=168)
+    finally:
+        db.close()
+
+
+def test_purge_deletes_expired_records_in_batches():
+    stamp = time.time_ns()
+    # far in the past, so only this test's rows are older than `now`
+    now = datetime(2000, 1, 2)
+    db = SessionLocal()
+    try:
+        repo = IdempotencyRepository(db)
+        expired = [f"idem-purge-{stamp}-{i}" for i in range(5)]
+        for key in expired:
+            repo.begin(key, "create_order")
+            repo.mark_completed(key, {"key": key})
+        live = f"idem-purge-{stamp}-live"
+        repo.begin(live, "create_order")
+        db.query(IdempotencyRecord).filter(IdempotencyRecord.key.in_(expired)).update(
+            {IdempotencyRecord.expires_at: datetime(2000, 1, 1)},
+            synchronize_session=False,
+        )
+        db.commit()
+        assert repo.cached_response(expired[0]) == {"key": expired[0]}
+
+        assert repo.purge_expired(batch_size=2, max_batches=2, now=now) == {
+            "purged": 4,
+            "batches": 2,
+        }
+        assert repo.purge_expired(batch_size=2, now=now) == {"purged": 1, "batches": 1}
+        assert repo.purge_expired(batch_size=2, now=now) == {"purged": 0, "batches": 0}
+
+        assert repo.get(expired[0]) is None
+        assert repo.get(live) is not None
+        # a purged key is no longer replayed from the cache either
+        assert repo.cached_response(expired[0]) is None
+    finally:
+        db.close()
+
+
+def test_begin_claims_with_one_statement_and_reads_only_on_conflict():
+    key = f"idem-begin-{time.time_ns()}"
+    owner_db, other_db = SessionLocal(), SessionLocal()
+    statements = []
+
+    def count(conn, cursor, statement, params, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        rec, created = IdempotencyRepository(owner_db).begin(key, "create_order")
+        assert created
+        assert len(statements) == 1
+        assert rec in owner_db and rec.status == IdempotencyStatus.IN_PROGRESS
+
+        statements.clear()
+        dup, created = IdempotencyRepository(other_db).begin(key, "create_order")
+        assert not created
+        assert len(statements) == 2
+        assert dup.id == rec.id
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+        owner_db.close()
+        other_db.close()
+
+
+def test_reused_key_with_different_request_is_refused():
+    assert request_fingerprint({"a": 1, "b": [1, 2]}) == request_fingerprint(
+        {"b": [1, 2], "a": 1}
+    )
+    key = f"idem-fp-{time.time_ns()}"
+    first = request_fingerprint({"items": [{"sku": "A", "qty": 1}]})
+    other = request_fingerprint({"items": [{"sku": "A", "qty": 2}]})
+    db = SessionLocal()
+    try:
+        repo = IdempotencyRepository(db)
+        rec, created = repo.begin(key, "create_order", first)
+        assert created and rec.request_hash == first
+        repo.mark_completed(key, {"orderId": 1})
+
+        assert repo.cached_response(key, first) == {"orderId": 1}
+        with pytest.raises(IdempotencyKeyReused):
+            repo.cached_response(key, other)
+        with pytest.raises(IdempotencyKeyReused):
+            repo.begin(key, "create_order", other)
+        rec, created = repo.begin(key, "create_order", first)
+        assert not created and rec.response_body == {"orderId": 1}
+    finally:
+        db.close()
+
+
+def test_checkout_replay_checks_the_request_fingerprint():
+    key = f"idem-fp-order-{time.time_ns()}"
+    items, payment = [{"sku": "CHOC1234", "qty": 1}], {"token": "tok-fp"}
+    db = SessionLocal()
+    try:
+        repo = IdempotencyRepository(db)
+        repo.begin(
+            key, "create_order", OrderService._request_hash(None, items, payment)
+        )
+        repo.mark_completed(key, {"orderId": 3})
+        svc = OrderService(db)
+
+        # key order inside the request does not matter
+        same = [{"qty": 1, "sku": "CHOC1234"}]
+        assert svc.create_order(None, same, payment, idempotency_key=key) == {
+            "orderId": 3
+        }
+        with pytest.raises(OrderServiceException, match="different request"):
+            svc.create_order(
+                None, [{"sku": "CHOC1234", "qty": 5}], payment, idempotency_key=key
+            )
+    finally:
+        db.close()
+
+
+def test_large_responses_are_stored_compressed():
+    key = f"idem-zlib-{time.time_ns()}"
+    body = {"lines": [{"sku": f"SKU-{i}", "qty": 1} for i in range(200)]}
+    db = SessionLocal()
+    try:
+        repo = IdempotencyRepository(db)
+        repo.begin(key, "create_order")
+        repo.mark_completed(key, body)
+
+        raw = db.execute(
+            text("SELECT response_body FROM idempotency_records WHERE key = :k"),
+            {"k": key},
+        ).scalar()
+        assert len(raw) < len(str(body)) / 4
+        assert "__zlib__" in raw
+        # every read path inflates it again
+        assert repo.get(key).response_body == body
+        assert repo.peek(key)[1] == body
+    finally:
+        db.close()
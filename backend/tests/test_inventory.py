@@ -1,12 +1,25 @@
+import asyncio
+import threading
 import time
+from datetime import datetime, timedelta, timezone
 
+import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import sessionmaker
 
 from app.db import SessionLocal, init_db
 from app.main import app
+from app.models.inventory_reservation import (
+    InventoryReservation,
+    InventoryReservationHistory,
+)
 from app.models.product import Product
+from app.services.flash_sale import FlashSaleCoalescer, flash_sale
+from app.services.inventory_ledger import ledger
 from app.services.inventory_service import InventoryException, InventoryService
+from app.services.reservation_archive import ReservationArchiveService
+from app.services.reservation_expiry import ReservationExpiryEngine
+from app.services.stock_feed import StockFeedBroker
 
 client = TestClient(app)
 
@@ -74,3 +87,394 @@ def test_ttl_expiry():
         assert r.id in expired_ids
     finally:
         db.close()
+
+
+def test_ledger_tracks_reserve_release_and_lapse():
+    db = SessionLocal()
+    try:
+        svc = InventoryService(db)
+        before = svc.available_quantity("TEST-002")
+        assert ledger.available("TEST-002") == before
+        db.commit()
+
+        with db.begin():
+            r = svc.reserve("TEST-002", 1, ttl_seconds=1)
+        # served from the ledger, no DB read required
+        assert ledger.available("TEST-002") == before - 1
+        assert svc.available_quantity("TEST-002") == before - 1
+
+        # a lapsed reservation stops counting before expire_overdue runs
+        time.sleep(1.2)
+        assert svc.available_quantity("TEST-002") == before
+
+        with db.begin():
+            r2 = svc.reserve("TEST-002", 2, ttl_seconds=30)
+        assert svc.available_quantity("TEST-002") == before - 2
+        with db.begin():
+            svc.release(r2.id)
+        assert svc.available_quantity("TEST-002") == before
+    finally:
+        db.close()
+
+
+def test_locked_checks_see_reservations_made_by_other_processes():
+    db = SessionLocal()
+    try:
+        if not db.query(Product).filter(Product.sku == "LEDGER-XPROC").first():
+            db.add(Product(sku="LEDGER-XPROC", name="Ledger X", price_cents=1, stock=2))
+            db.commit()
+        db.query(InventoryReservation).filter(
+            InventoryReservation.sku == "LEDGER-XPROC"
+        ).delete()
+        db.commit()
+        svc = InventoryService(db)
+        assert svc.available_quantity("LEDGER-XPROC") == 2
+        db.commit()
+
+        # another worker takes the whole stock; this process's ledger never hears
+        other = SessionLocal()
+        try:
+            other.add(
+                InventoryReservation(
+                    sku="LEDGER-XPROC",
+                    quantity=2,
+                    status="reserved",
+                    reserved_until=datetime.now(timezone.utc) + timedelta(minutes=5),
+                )
+            )
+            other.commit()
+        finally:
+            other.close()
+        assert ledger.available("LEDGER-XPROC") == 2
+
+        with pytest.raises(InventoryException):
+            svc.reserve("LEDGER-XPROC", 1, ttl_seconds=30)
+        db.rollback()
+        with pytest.raises(InventoryException):
+            svc.reserve_many([{"sku": "LEDGER-XPROC", "qty": 1}], ttl_seconds=30)
+        db.rollback()
+        # the locked check reloaded the ledger from the DB
+        assert ledger.available("LEDGER-XPROC") == 0
+    finally:
+        db.close()
+
+
+def test_cas_reserve_maintains_reserved_qty():
+    db = SessionLocal()
+    try:
+        svc = InventoryService(db, reservation_mode="cas")
+        prod = db.query(Product).filter(Product.sku == "TEST-001").first()
+        stock_before, reserved_before = prod.stock, prod.reserved_qty
+        available = svc.available_quantity("TEST-001")
+        assert available == stock_before - reserved_before
+        db.commit()
+
+        r = svc.reserve("TEST-001", 2, ttl_seconds=30)
+        db.refresh(prod)
+        assert prod.reserved_qty == reserved_before + 2
+        assert svc.available_quantity("TEST-001") == available - 2
+        db.commit()
+
+        # the conditional UPDATE refuses to oversell
+        with pytest.raises(InventoryException):
+            svc.reserve("TEST-001", available, ttl_seconds=30)
+        db.commit()
+
+        with db.begin():
+            svc.commit(r.id, order_id=None)
+        db.refresh(prod)
+        assert prod.stock == stock_before - 2
+        assert prod.reserved_qty == reserved_before
+    finally:
+        db.close()
+
+
+def test_reserve_batch_is_all_or_nothing():
+    avail = client.get("/api/inventory/available/TEST-002").json()["available"]
+
+    res = client.post(
+        "/api/inventory/reserve/batch",
+        json={
+            "lines": [
+                {"sku": "TEST-002", "qty": 1},
+                {"sku": "RES-2", "qty": 999},
+            ],
+            "ttl_seconds": 30,
+        },
+    )
+    assert res.status_code == 400
+    # the first line must not have been kept
+    assert client.get("/api/inventory/available/TEST-002").json()["available"] == avail
+
+    res = client.post(
+        "/api/inventory/reserve/batch",
+        json={
+            "lines": [{"sku": "TEST-002", "qty": 1}, {"sku": "TEST-001", "qty": 1}],
+            "ttl_seconds": 30,
+        },
+    )
+    assert res.status_code == 200
+    body = res.json()["reservations"]
+    assert [r["sku"] for r in body] == ["TEST-002", "TEST-001"]
+    assert len({r["reservation_id"] for r in body}) == 2
+    assert (
+        client.get("/api/inventory/available/TEST-002").json()["available"] == avail - 1
+    )
+
+
+def test_reserved_ids_follow_their_rows_whatever_the_returning_order(monkeypatch):
+    import app.utils.sql as sql
+
+    real = sql.insert_returning
+    # RETURNING order is unspecified: hand the rows back reversed
+    monkeypatch.setattr(
+        sql, "insert_returning", lambda *a, **kw: list(reversed(real(*a, **kw)))
+    )
+    db = SessionLocal()
+    try:
+        baskets = [
+            [{"sku": "TEST-001", "qty": 1}, {"sku": "TEST-002", "qty": 2}],
+            [{"sku": "TEST-002", "qty": 1}],
+        ]
+        granted = InventoryService(db).reserve_baskets(baskets, ttl_seconds=30)
+        db.commit()
+        for basket, reservations in zip(baskets, granted):
+            assert [(r.sku, r.quantity) for r in reservations] == [
+                (line["sku"], line["qty"]) for line in basket
+            ]
+        for r in [r for reservations in granted for r in reservations]:
+            InventoryService(db).release(r.id)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_expiry_engine_fires_near_deadline():
+    engine = ReservationExpiryEngine()
+    engine.start()
+    db = SessionLocal()
+    try:
+        svc = InventoryService(db)
+        with db.begin():
+            r = svc.reserve("TEST-002", 1, ttl_seconds=1)
+        rid = r.id
+
+        # no manual expire_overdue call: the engine wakes up at the deadline
+        deadline = time.time() + 5
+        status = None
+        while time.time() < deadline:
+            db.expire_all()
+            status = db.get(InventoryReservation, rid).status
+            db.rollback()
+            if status == "expired":
+                break
+            time.sleep(0.1)
+        assert status == "expired"
+    finally:
+        engine.stop()
+        db.close()
+
+
+def test_bulk_available_matches_single_lookups():
+    skus = ["TEST-001", "TEST-002", "RES-1", "NO-SUCH-SKU"]
+    res = client.get("/api/inventory/available", params={"skus": ",".join(skus)})
+    assert res.status_code == 200
+    body = res.json()
+    assert body["missing"] == ["NO-SUCH-SKU"]
+    for item in body["items"]:
+        single = client.get(f"/api/inventory/available/{item['sku']}").json()
+        assert item["available"] == single["available"]
+
+    res = client.post("/api/inventory/available", json={"skus": skus})
+    assert res.status_code == 200
+    assert [i["sku"] for i in res.json()["items"]] == skus[:3]
+
+
+def test_archive_moves_only_old_terminal_rows():
+    db = SessionLocal()
+    try:
+        svc = InventoryService(db)
+        with db.begin():
+            done = svc.reserve("TEST-001", 1, ttl_seconds=30)
+            active = svc.reserve("TEST-001", 1, ttl_seconds=30)
+        svc.release(done.id)
+        done_id, active_id = done.id, active.id
+
+        archiver = ReservationArchiveService(db, mode="table")
+        # nothing is old enough yet
+        assert archiver.compact(older_than_days=30)["archived"] == 0
+
+        later = datetime.now(timezone.utc) + timedelta(days=31)
+        result = archiver.compact(older_than_days=30, batch_size=1, now=later)
+        assert result["archived"] >= 1
+        assert db.get(InventoryReservation, done_id) is None
+        assert db.get(InventoryReservationHistory, done_id).status == "released"
+        assert db.get(InventoryReservation, active_id).status == "reserved"
+        svc.release(active_id)
+    finally:
+        db.close()
+
+
+def test_stock_feed_coalesces_and_filters_by_sku():
+    broker = StockFeedBroker(coalesce_ms=100)
+
+    async def scenario():
+        watching = broker.subscribe(["TEST-002"])
+        other = broker.subscribe(["TEST-001"])
+        before = broker.snapshot(["TEST-002"])[0]["available"]
+        db = SessionLocal()
+        try:
+            svc = InventoryService(db)
+            rids = []
+            for _ in range(2):
+                with db.begin():
+                    rids.append(svc.reserve("TEST-002", 1, ttl_seconds=30).id)
+            # both commits land inside one window: a single event
+            event = await asyncio.wait_for(watching.queue.get(), timeout=2)
+            assert event["items"] == [
+                {"sku": "TEST-002", "available": before - 2, "delta": -2}
+            ]
+            await asyncio.sleep(0.2)
+            assert watching.queue.empty()
+            assert other.queue.empty()
+            for rid in rids:
+                svc.release(rid)
+        finally:
+            db.close()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        broker.stop()
+
+
+def test_extend_pushes_deadline_of_active_reservations_only():
+    r = client.post(
+        "/api/inventory/reserve", json={"sku": "TEST-001", "qty": 1, "ttl_seconds": 1}
+    ).json()
+    rid = r["reservation_id"]
+
+    res = client.post(
+        f"/api/inventory/reservations/{rid}/extend", json={"ttl_seconds": 60}
+    )
+    assert res.status_code == 200
+    assert res.json()["reserved_until"] > r["reserved_until"]
+    for url, body in [
+        (f"/api/inventory/reservations/{rid}/extend", {"ttl_seconds": "abc"}),
+        (
+            "/api/inventory/reservations/extend",
+            {"reservation_ids": [rid], "ttl_seconds": "abc"},
+        ),
+    ]:
+        assert client.post(url, json=body).status_code == 400
+
+    # the original TTL has passed but the extended hold is still counted
+    time.sleep(1.2)
+    db = SessionLocal()
+    try:
+        svc = InventoryService(db)
+        assert rid not in svc.expire_overdue()
+        db.commit()
+        svc.release(rid)
+        db.commit()
+    finally:
+        db.close()
+
+    res = client.post(
+        "/api/inventory/reservations/extend",
+        json={"reservation_ids": [rid, 999999], "ttl_seconds": 60},
+    )
+    assert res.json() == {"extended": [], "not_active": [rid, 999999]}
+    res = client.post(f"/api/inventory/reservations/{rid}/extend", json={})
+    assert res.status_code == 400
+
+
+def test_flash_sale_group_commits_hot_sku():
+    db = SessionLocal()
+    try:
+        avail = InventoryService(db).available_quantity("TEST-002")
+    finally:
+        db.close()
+    workers = avail + 3
+    start = threading.Barrier(workers)
+    ok, failed = [], []
+
+    def attempt():
+        s = SessionLocal()
+        try:
+            start.wait()
+            ok.append(InventoryService(s).reserve("TEST-002", 1, ttl_seconds=30).id)
+        except InventoryException as e:
+            failed.append(str(e))
+        finally:
+            s.close()
+
+    flash_sale.configure(["TEST-002"])
+    try:
+        threads = [threading.Thread(target=attempt) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = flash_sale.stats()["queues"]["TEST-002"]
+    finally:
+        flash_sale.configure([])
+
+    assert len(ok) == avail
+    assert failed == ["Not enough stock"] * 3
+    assert stats["requests"] == workers
+    assert stats["batches"] < workers
+
+    db = SessionLocal()
+    try:
+        svc = InventoryService(db)
+        assert svc.available_quantity("TEST-002") == 0
+        for rid in ok:
+            svc.release(rid)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_flash_sale_timeout_releases_reservation_made_after_giving_up():
+    db = SessionLocal()
+    try:
+        p = db.query(Product).filter(Product.sku == "FLASH-TIMEOUT").first()
+        if not p:
+            p = Product(sku="FLASH-TIMEOUT", name="Flash timeout", price_cents=0)
+            db.add(p)
+        p.stock, p.reserved_qty = 5, 0
+        db.commit()
+    finally:
+        db.close()
+
+    def slow_session():
+        # the batch has started (future running) but not yet reserved
+        time.sleep(0.3)
+        return SessionLocal()
+
+    coalescer = FlashSaleCoalescer(session_factory=slow_session, skus=["FLASH-TIMEOUT"])
+    with pytest.raises(InventoryException, match="busy"):
+        coalescer.submit("FLASH-TIMEOUT", 2, ttl_seconds=60, timeout=0.1)
+
+    db = SessionLocal()
+    try:
+        deadline = time.monotonic() + 5
+        while True:
+            db.expire_all()
+            p = db.query(Product).filter(Product.sku == "FLASH-TIMEOUT").one()
+            status = (
+                db.query(InventoryReservation.status)
+                .filter(InventoryReservation.sku == "FLASH-TIMEOUT")
+                .order_by(InventoryReservation.id.desc())
+                .limit(1)
+                .scalar()
+            )
+            db.rollback()
+            if status == "released" or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        assert status == "released"
+        assert p.reserved_qty == 0
+    finally:
+        db.close()
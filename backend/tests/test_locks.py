@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.utils.lock_manager import FileLockManager, LockTimeout, StripedLockManager
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "manager",
+    [StripedLockManager(stripes=8), FileLockManager(stripes=8)],
+    ids=["local", "file"],
+)
+def test_lock_excludes_other_threads_and_counts_timeouts(manager):
+    held = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with manager.acquire("SKU-A"):
+            held.set()
+            release.wait(5)
+
+    t = threading.Thread(target=holder)
+    t.start()
+    try:
+        held.wait(5)
+        with pytest.raises(LockTimeout):
+            with manager.acquire("SKU-A", timeout=0.05):
+                pass
+    finally:
+        release.set()
+        t.join()
+
+    # keys sharing a stripe are only taken once
+    with manager.acquire_many(["SKU-A", "SKU-A", "SKU-B"], timeout=1):
+        pass
+
+    stats = {row["key"]: row for row in manager.stats.snapshot(top=10)}
+    assert stats["SKU-A"]["timeouts"] == 1
+    assert stats["SKU-A"]["acquired"] == 2
+    assert stats["SKU-B"]["acquired"] == 1
+
+
+def test_admin_lock_stats_after_reserve():
+    res = client.post(
+        "/api/inventory/reserve", json={"sku": "TEST-001", "qty": 1, "ttl_seconds": 1}
+    )
+    assert res.status_code == 200
+    body = client.get("/api/admin/locks", params={"top": 50}).json()
+    assert body["backend"] in ("local", "file", "advisory")
+    assert any(row["key"] == "TEST-001" for row in body["keys"])
@@ -1,11 +1,17 @@
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 
 from app import db
-from app.db import SessionLocal, init_db
+from app.db import SessionLocal, engine, init_db
 from app.main import app
+from app.models.inventory_reservation import InventoryReservation
 from app.models.order import Invoice, Order, OrderLine
 from app.models.product import Product
+from app.services.checkout_worker import CheckoutWorkerPool
+from app.services.inventory_service import InventoryService
+from app.services.order_service import OrderService
+from app.services.outbox import outbox_dispatcher
 
 client = TestClient(app)
 
@@ -77,3 +83,389 @@ def test_checkout_payment_decline_releases_reservations():
         "Payment declined" in r.json()["detail"]
         or "Payment failed" in r.json()["detail"]
     )
+
+
+def test_async_checkout_returns_202_and_completes_on_worker():
+    payload = {
+        "customer_id": None,
+        "items": [{"sku": "TEST-001", "qty": 1}],
+        "payment_method": {"token": "test"},
+    }
+    headers = {"Idempotency-Key": "idem-async-1", "Prefer": "respond-async"}
+    r = client.post("/api/orders", json=payload, headers=headers)
+    assert r.status_code == 202
+    body = r.json()
+    assert body["status"] == "PENDING"
+    assert r.headers["Location"] == body["statusUrl"]
+
+    # repeating the request returns the same handle
+    r2 = client.post("/api/orders", json=payload, headers=headers)
+    assert r2.json()["orderId"] == body["orderId"]
+
+    status = client.get(body["statusUrl"]).json()
+    assert status["status"] == "PENDING" and status["stage"] == "reserve"
+
+    assert CheckoutWorkerPool(workers=0).run_pending()
+    status = client.get(body["statusUrl"]).json()
+    assert status["status"] == "COMPLETED"
+    assert status["stage"] == "done"
+    assert status["invoiceId"]
+    assert status["payment"]["status"] == "captured"
+
+
+def test_async_checkout_decline_fails_job():
+    payload = {
+        "customer_id": None,
+        "items": [{"sku": "TEST-001", "qty": 1}],
+        "payment_method": {"token": "test", "force_decline": True},
+    }
+    r = client.post("/api/orders", json=payload, headers={"Prefer": "respond-async"})
+    assert r.status_code == 202
+    CheckoutWorkerPool(workers=0).run_pending()
+    status = client.get(r.json()["statusUrl"]).json()
+    assert status["status"] == "FAILED"
+    assert "Payment declined" in status["error"]
+    assert client.get("/api/orders/999999/status").status_code == 404
+
+
+def test_async_checkout_requeues_on_gateway_errors(monkeypatch):
+    from app.adapters.resilient_payment import (
+        PaymentUnavailable,
+        ResilientPaymentAdapter,
+    )
+    from app.config import settings
+
+    real_charge = ResilientPaymentAdapter.charge
+    outage = {"on": True}
+
+    def charge(self, *args, **kwargs):
+        if outage["on"]:
+            raise PaymentUnavailable("Payment gateway unavailable: breaker open")
+        return real_charge(self, *args, **kwargs)
+
+    monkeypatch.setattr(ResilientPaymentAdapter, "charge", charge)
+    monkeypatch.setattr(settings, "CHECKOUT_RETRY_SECONDS", 0)
+    payload = {
+        "customer_id": None,
+        "items": [{"sku": "TEST-001", "qty": 1}],
+        "payment_method": {"token": "test"},
+    }
+    pool = CheckoutWorkerPool(workers=0)
+
+    def held(order_id):
+        # reservations of the order's checkout job still in status "reserved"
+        from app.models.checkout_job import CheckoutJob
+
+        s = SessionLocal()
+        try:
+            job = s.query(CheckoutJob).filter(CheckoutJob.order_id == order_id).one()
+            rids = (job.data or {}).get("reservation_ids") or []
+            assert rids
+            return (
+                s.query(InventoryReservation)
+                .filter(
+                    InventoryReservation.id.in_(rids),
+                    InventoryReservation.status == "reserved",
+                )
+                .count()
+            )
+        finally:
+            s.close()
+
+    # a brownout requeues the job with the basket still held, then it completes
+    r = client.post("/api/orders", json=payload, headers={"Prefer": "respond-async"})
+    url, order_id = r.json()["statusUrl"], r.json()["orderId"]
+    pool.run_once()  # reserve
+    pool.run_once()  # charge: gateway unavailable
+    status = client.get(url).json()
+    assert status["status"] != "FAILED" and status["stage"] == "charge"
+    assert held(order_id) == 1
+    outage["on"] = False
+    pool.run_pending()
+    assert client.get(url).json()["status"] == "COMPLETED"
+
+    # after CHECKOUT_MAX_ATTEMPTS the job fails and the unpaid basket is released
+    outage["on"] = True
+    monkeypatch.setattr(settings, "CHECKOUT_MAX_ATTEMPTS", 2)
+    r = client.post("/api/orders", json=payload, headers={"Prefer": "respond-async"})
+    url, order_id = r.json()["statusUrl"], r.json()["orderId"]
+    pool.run_pending()
+    status = client.get(url).json()
+    assert status["status"] == "FAILED"
+    assert "PaymentUnavailable" in status["error"]
+    assert held(order_id) == 0
+
+
+def test_checkout_query_count_does_not_grow_with_basket():
+    db = SessionLocal()
+    try:
+        for i in range(8):
+            db.add(
+                Product(sku=f"BULK-{i}", name=f"Bulk {i}", price_cents=100, stock=10)
+            )
+        db.commit()
+    finally:
+        db.close()
+
+    def statements_for(skus):
+        seen = []
+
+        def count(conn, cursor, statement, params, context, executemany):
+            seen.append(statement)
+
+        event.listen(engine, "before_cursor_execute", count)
+        session = SessionLocal()
+        try:
+            resp = OrderService(session).create_order(
+                None, [{"sku": s, "qty": 1} for s in skus], {"token": "test"}
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+            session.close()
+        assert resp["status"] == "COMPLETED"
+        return len(seen)
+
+    small = statements_for(["BULK-0"])
+    large = statements_for([f"BULK-{i}" for i in range(1, 8)])
+    assert large == small
+
+    db = SessionLocal()
+    try:
+        lines = db.query(OrderLine).join(Order).filter(OrderLine.sku == "BULK-7").all()
+        assert len(lines) == 1 and lines[0].price_cents == 100
+        assert db.query(Product).filter(Product.sku == "BULK-7").one().stock == 9
+    finally:
+        db.close()
+
+
+def test_unit_checkout_commits_twice(monkeypatch):
+    from app.config import settings
+
+    db = SessionLocal()
+    try:
+        db.add(Product(sku="UNIT-1", name="Unit", price_cents=250, stock=10))
+        db.commit()
+    finally:
+        db.close()
+
+    def checkout(mode, key, decline=False):
+        monkeypatch.setattr(settings, "CHECKOUT_TRANSACTION_MODE", mode)
+        commits = []
+
+        def count(conn):
+            commits.append(1)
+
+        event.listen(engine, "commit", count)
+        session = SessionLocal()
+        try:
+            return OrderService(session).create_order(
+                None,
+                [{"sku": "UNIT-1", "qty": 2}],
+                {"token": "test", "force_decline": decline},
+                idempotency_key=key,
+            ), len(commits)
+        finally:
+            event.remove(engine, "commit", count)
+            session.close()
+
+    staged, staged_commits = checkout("staged", "unit-a")
+    unit, unit_commits = checkout("unit", "unit-b")
+    assert staged["status"] == unit["status"] == "COMPLETED"
+    # idempotency marker, order + reservations, settlement
+    assert unit_commits == 3 < staged_commits
+
+    # replay is served from the response committed with the settlement
+    assert checkout("unit", "unit-b")[0]["orderId"] == unit["orderId"]
+
+    with pytest.raises(Exception):
+        checkout("unit", "unit-c", decline=True)
+
+    db = SessionLocal()
+    try:
+        assert db.query(Product).filter(Product.sku == "UNIT-1").one().stock == 6
+        assert db.get(Invoice, unit["invoiceId"]).order_id == unit["orderId"]
+        statuses = {
+            r.status
+            for r in db.query(InventoryReservation).filter(
+                InventoryReservation.sku == "UNIT-1"
+            )
+        }
+        assert statuses == {"committed", "released"}
+    finally:
+        db.close()
+
+
+def test_async_route_checkout_and_decline():
+    payload = {
+        "customer_id": None,
+        "items": [{"sku": "RET1", "qty": 1}],
+        "payment_method": {"token": "test"},
+    }
+    headers = {"Idempotency-Key": "idem-async-route"}
+    r = client.post("/api/orders/checkout", json=payload, headers=headers)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["status"] == "COMPLETED" and body["payment"]["status"] == "captured"
+    replay = client.post("/api/orders/checkout", json=payload, headers=headers)
+    assert replay.json()["orderId"] == body["orderId"]
+
+    declined = client.post(
+        "/api/orders/checkout",
+        json={**payload, "payment_method": {"token": "test", "force_decline": True}},
+    )
+    assert declined.status_code == 400
+    assert "Payment declined" in declined.json()["detail"]
+
+    db = SessionLocal()
+    try:
+        product = db.query(Product).filter(Product.sku == "RET1").one()
+        assert product.stock == 4 and product.reserved_qty == 0
+    finally:
+        db.close()
+
+
+def test_order_read_endpoints():
+    payload = {
+        "customer_id": 4242,
+        "items": [{"sku": "TEST-001", "qty": 1}],
+        "payment_method": {"token": "test"},
+    }
+    created = []
+    for _ in range(3):
+        r = client.post("/api/orders", json=payload)
+        assert r.status_code == 200, r.text
+        created.append(r.json()["orderId"])
+
+    # keyset pages: newest first, no overlap, last page has no cursor
+    seen, cursor = [], None
+    while True:
+        params = {"customer_id": 4242, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/api/orders", params=params).json()
+        seen += [o["orderId"] for o in page["items"]]
+        cursor = page["nextCursor"]
+        if not cursor:
+            break
+    assert seen == sorted(created, reverse=True)
+    assert client.get("/api/orders", params={"cursor": "!!"}).status_code == 400
+    completed = client.get(
+        "/api/orders", params={"customer_id": 4242, "status": "FAILED"}
+    ).json()
+    assert completed["items"] == []
+
+    # packing tasks come from the order.completed outbox events
+    outbox_dispatcher.run_pending()
+    statements = []
+
+    def count(conn, cursor, statement, params, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        detail = client.get(f"/api/orders/{created[0]}").json()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    # order + lines + invoice + packing tasks
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 4
+    assert detail["lines"][0]["sku"] == "TEST-001"
+    assert detail["invoice"]["totalCents"] == detail["totalCents"]
+    assert len(detail["packingTasks"]) == 1
+    assert client.get("/api/orders/999999").status_code == 404
+
+
+def test_batch_checkout_per_order_results_and_idempotency():
+    db = SessionLocal()
+    try:
+        if not db.query(Product).filter(Product.sku == "BATCH-1").first():
+            db.add(Product(sku="BATCH-1", name="Batch A", price_cents=100, stock=3))
+            db.add(Product(sku="BATCH-2", name="Batch B", price_cents=250, stock=10))
+            db.commit()
+    finally:
+        db.close()
+
+    def order(items, key=None, **payment):
+        return {
+            "items": [{"sku": sku, "qty": qty} for sku, qty in items],
+            "payment_method": {"token": "t", **payment},
+            "idempotency_key": key,
+        }
+
+    batch = [
+        order([("BATCH-1", 2), ("BATCH-2", 1)], key="batch-a"),
+        order([("BATCH-1", 2)]),  # only 1 left after the first order
+        order([("BATCH-1", 1)], key="batch-c", force_decline=True),
+        order([("NOPE", 1)]),
+        order([("BATCH-1", 2), ("BATCH-2", 1)], key="batch-a"),
+    ]
+    r = client.post("/api/orders/batch", json={"orders": batch})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert (body["succeeded"], body["failed"]) == (2, 3)
+    results = body["results"]
+    assert [res["index"] for res in results] == [0, 1, 2, 3, 4]
+    first = results[0]["response"]
+    assert first["status"] == "COMPLETED" and first["payment"]["status"] == "captured"
+    assert "not enough stock" in results[1]["error"]
+    assert "Payment declined" in results[2]["error"]
+    assert "Product SKU not found: NOPE" in results[3]["error"]
+    assert results[4]["response"]["orderId"] == first["orderId"]
+
+    # per-order keys: replays return the stored outcome, nothing is charged again
+    again = client.post("/api/orders/batch", json={"orders": [batch[0], batch[2]]})
+    replayed = again.json()["results"]
+    assert replayed[0]["response"]["orderId"] == first["orderId"]
+    assert "Original request failed: Payment declined" in replayed[1]["error"]
+
+    db = SessionLocal()
+    try:
+        stock = {
+            p.sku: (p.stock, p.reserved_qty)
+            for p in db.query(Product).filter(Product.sku.in_(["BATCH-1", "BATCH-2"]))
+        }
+        assert stock == {"BATCH-1": (1, 0), "BATCH-2": (9, 0)}
+        orders = {
+            o.id: o.status
+            for o in db.query(Order)
+            .join(OrderLine)
+            .filter(OrderLine.sku.like("BATCH-%"))
+        }
+        # the unknown SKU never became an order
+        assert sorted(orders.values()) == ["COMPLETED", "FAILED", "FAILED"]
+    finally:
+        db.close()
+
+    assert client.post("/api/orders/batch", json={"orders": []}).status_code == 422
+
+
+def test_batch_that_fails_to_open_releases_its_keys(monkeypatch):
+    db = SessionLocal()
+    try:
+        if not db.query(Product).filter(Product.sku == "BATCH-OPEN").first():
+            db.add(Product(sku="BATCH-OPEN", name="Batch O", price_cents=100, stock=5))
+            db.commit()
+    finally:
+        db.close()
+
+    def locked(self, baskets):
+        raise RuntimeError("database is locked")
+
+    batch = [
+        {
+            "items": [{"sku": "BATCH-OPEN", "qty": 1}],
+            "payment_method": {"token": "t"},
+            "idempotency_key": "batch-open-retry",
+        }
+    ]
+    monkeypatch.setattr(InventoryService, "reserve_baskets", locked)
+    r = client.post("/api/orders/batch", json={"orders": batch})
+    assert r.status_code == 400
+    assert "Failed to open batch" in r.json()["detail"]
+
+    # nothing was reserved or charged: the same key goes through on retry
+    monkeypatch.undo()
+    r = client.post("/api/orders/batch", json={"orders": batch})
+    assert r.status_code == 200, r.text
+    result = r.json()["results"][0]
+    assert result["ok"], result
+    assert result["response"]["status"] == "COMPLETED"
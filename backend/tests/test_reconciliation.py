@@ -0,0 +1,46 @@
+import json
+
+from sqlalchemy import text
+
+from app.db import SessionLocal
+from app.services.inventory_service import InventoryService
+from app.services.reconciliation_service import ReconciliationService
+
+
+def _report(path):
+    with open(path, encoding="utf-8") as fh:
+        lines = [json.loads(l) for l in fh]
+    return {l["sku"]: l for l in lines[:-1]}, lines[-1]["summary"]
+
+
+def test_reconciliation_flags_stock_drift_only(tmp_path):
+    db = SessionLocal()
+    try:
+        recon = ReconciliationService(db, batch_size=3)
+        recon.run(rebaseline=True, report_path=str(tmp_path / "baseline.jsonl"))
+
+        # a normal reserve + commit keeps everything consistent
+        svc = InventoryService(db)
+        with db.begin():
+            r = svc.reserve("TEST-001", 2, ttl_seconds=30)
+        svc.commit(r.id, order_id=None)
+        db.commit()
+
+        path = tmp_path / "clean.jsonl"
+        found, summary = _report(recon.run(report_path=str(path))["report"])
+        assert "TEST-001" not in found
+        assert summary["scanned"] >= 8
+
+        # stock changed behind the services' back (e.g. a crash mid-checkout)
+        db.execute(text("UPDATE products SET stock = stock - 1 WHERE sku = 'TEST-002'"))
+        db.commit()
+        found, summary = _report(
+            recon.run(report_path=str(tmp_path / "drift.jsonl"))["report"]
+        )
+        assert found["TEST-002"]["issues"] == ["stock"]
+        assert found["TEST-002"]["stock_diff"] == -1
+        assert "TEST-001" not in found
+    finally:
+        db.execute(text("UPDATE products SET stock = stock + 1 WHERE sku = 'TEST-002'"))
+        db.commit()
+        db.close()
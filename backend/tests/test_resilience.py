@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.adapters.mock_payment import (
+    AsyncPaymentAdapter,
+    PaymentDeclined,
+    PaymentTransientError,
+)
+from app.adapters.resilient_payment import PaymentUnavailable, ResilientPaymentAdapter
+from app.main import app
+from app.utils.resilience import (
+    Bulkhead,
+    BulkheadFull,
+    CircuitBreaker,
+    CircuitOpen,
+    RetryPolicy,
+    get_breaker,
+)
+
+client = TestClient(app)
+
+
+class FlakyGateway:
+    """Fails with a transient error `failures` times, then captures."""
+
+    def __init__(self, failures=0, decline=False):
+        self.failures = failures
+        self.decline = decline
+        self.calls = 0
+
+    def charge(self, db, amount_cents, payment_method, idempotency_key=None):
+        self.calls += 1
+        if self.decline:
+            raise PaymentDeclined("no funds")
+        if self.calls <= self.failures:
+            raise PaymentTransientError("brownout")
+        return {"transaction_id": f"tx-{self.calls}", "status": "captured"}
+
+
+def _adapter(gateway, name, attempts=3):
+    policy = RetryPolicy(attempts, base_delay=0.001, max_delay=0.01)
+    return ResilientPaymentAdapter(gateway, name=name, policy=policy)
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(attempts=5, base_delay=0.1, max_delay=0.3)
+    delays = [policy.backoff(n) for n in range(6) for _ in range(50)]
+    assert all(0 <= d <= 0.3 for d in delays)
+    assert len({round(d, 6) for d in delays}) > 10
+
+
+def test_retries_transient_errors_but_not_declines():
+    gateway = FlakyGateway(failures=2)
+    assert _adapter(gateway, "t-retry").charge(None, 100, {})["status"] == "captured"
+    assert gateway.calls == 3
+
+    declining = FlakyGateway(decline=True)
+    with pytest.raises(PaymentDeclined):
+        _adapter(declining, "t-decline").charge(None, 100, {})
+    assert declining.calls == 1
+    assert get_breaker("t-decline").state == "closed"
+
+
+def test_breaker_opens_fails_fast_and_recovers_through_probe():
+    breaker = get_breaker("t-breaker", failure_threshold=3, reset_timeout=0.05)
+    gateway = FlakyGateway(failures=3)
+    adapter = _adapter(gateway, "t-breaker")
+    with pytest.raises(PaymentTransientError):
+        adapter.charge(None, 100, {})
+    assert breaker.state == "open"
+
+    # open: refused without touching the gateway
+    with pytest.raises(PaymentUnavailable):
+        adapter.charge(None, 100, {})
+    assert gateway.calls == 3
+    assert breaker.snapshot()["rejected"] == 1
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert adapter.charge(None, 100, {})["status"] == "captured"
+    assert breaker.state == "closed"
+
+
+def test_half_open_admits_a_single_probe():
+    breaker = CircuitBreaker("probe", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    breaker.allow()
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_bulkhead_rejects_beyond_limit():
+    bulkhead = Bulkhead("t-bulkhead", max_concurrent=2)
+    entered, release = threading.Barrier(3), threading.Event()
+
+    def hold():
+        with bulkhead.slot():
+            entered.wait(5)
+            release.wait(5)
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for t in threads:
+        t.start()
+    entered.wait(5)
+    with pytest.raises(BulkheadFull):
+        with bulkhead.slot():
+            pass
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert bulkhead.snapshot() == {
+        "in_flight": 0,
+        "max_concurrent": 2,
+        "peak": 2,
+        "rejected": 1,
+    }
+
+
+def test_health_reports_open_payment_breaker():
+    breaker = get_breaker("payment")
+    try:
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        body = client.get("/api/health").json()
+        assert body["payment_adapter"] is False
+        assert body["status"] == "degraded"
+        assert body["breakers"]["payment"]["state"] == "open"
+    finally:
+        breaker.reset()
+    body = client.get("/api/health").json()
+    assert body["breakers"]["payment"]["state"] == "closed"
+
+
+def test_async_adapter_without_refund_cannot_be_built():
+    class ChargeOnly(AsyncPaymentAdapter):
+        async def charge(self, amount_cents, payment_method):
+            return {"status": "captured"}
+
+    with pytest.raises(TypeError):
+        ChargeOnly()
@@ -0,0 +1,75 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.db import SessionLocal, init_db
+from app.main import app
+from app.models.product import Product
+from app.utils.tracing import RecentTraces, StageHistograms, Tracer
+
+client = TestClient(app)
+
+
+def test_spans_nest_and_feed_histograms():
+    hist, recent = StageHistograms(), RecentTraces(100)
+    tracer = Tracer([hist, recent])
+    with tracer.span("root", kind="test"):
+        with tracer.span("child"):
+            pass
+        with pytest.raises(ValueError):
+            with tracer.span("child"):
+                raise ValueError("boom")
+
+    [trace] = recent.traces()
+    assert trace["name"] == "root" and trace["attributes"] == {"kind": "test"}
+    assert [s["name"] for s in trace["spans"]] == ["child", "child"]
+    assert {s["parentId"] for s in trace["spans"]} == {trace["spanId"]}
+    assert trace["spans"][1]["status"] == "error"
+
+    stages = hist.snapshot()
+    assert stages["child"]["count"] == 2 and stages["child"]["errors"] == 1
+    assert stages["root"]["p99_ms"] >= stages["root"]["p50_ms"] > 0
+
+
+def test_checkout_stages_exposed_on_admin_endpoint():
+    init_db()
+    db = SessionLocal()
+    try:
+        if not db.query(Product).filter(Product.sku == "TRACE-1").first():
+            db.add(Product(sku="TRACE-1", name="Traced", price_cents=100, stock=5))
+            db.commit()
+    finally:
+        db.close()
+
+    client.post("/api/admin/tracing/reset")
+    r = client.post(
+        "/api/orders",
+        json={
+            "items": [{"sku": "TRACE-1", "qty": 1}],
+            "payment_method": {"token": "t"},
+        },
+        headers={"Idempotency-Key": "trace-1"},
+    )
+    assert r.status_code == 200, r.text
+
+    stages = client.get("/api/admin/tracing/stages").json()
+    for name in (
+        "checkout",
+        "checkout.idempotency",
+        "checkout.load_products",
+        "checkout.reserve",
+        "checkout.payment",
+        "payment.charge",
+        "checkout.inventory_commit",
+        "checkout.invoice",
+        "checkout.outbox",
+        "inventory.lock_wait",
+    ):
+        assert stages[name]["count"] >= 1, name
+    # the gateway delay dominates the trace
+    assert stages["payment.charge"]["mean_ms"] >= 150
+
+    [trace] = client.get(
+        "/api/admin/tracing/traces", params={"name": "checkout"}
+    ).json()
+    names = {s["name"] for s in trace["spans"]}
+    assert {"checkout.payment", "payment.charge", "inventory.lock_wait"} <= names
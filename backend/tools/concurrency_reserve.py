@@ -44,6 +44,292 @@ def run_reserve_concurrent(workers, sku, qty, ttl):
         print("Unique reservation ids:", set(ids))
 
 
+def _bench_worker(mode, sku, qty, ttl, iterations, latencies, errors):
+    from app.db import SessionLocal
+    from app.services.inventory_service import InventoryException, InventoryService
+
+    db = SessionLocal()
+    try:
+        # "flash" is lock mode with the SKU routed through the group-commit queue
+        svc = InventoryService(db, reservation_mode="lock" if mode == "flash" else mode)
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            try:
+                svc.reserve(sku, qty, ttl_seconds=ttl)
+                # end the read transaction loading the result opened
+                db.commit()
+                latencies.append(time.perf_counter() - t0)
+            except InventoryException as e:
+                errors.append(str(e))
+            except Exception as e:  # e.g. sqlite "database is locked"
+                errors.append(f"{type(e).__name__}: {e}")
+                db.rollback()
+    finally:
+        db.close()
+
+
+def _bench_reset(sku, stock):
+    """Give the bench SKU enough stock and clear its outstanding reservations."""
+    from app.db import SessionLocal, init_db
+    from app.models.inventory_reservation import InventoryReservation
+    from app.models.product import Product
+    from app.services.inventory_ledger import ledger
+
+    init_db()
+    db = SessionLocal()
+    try:
+        db.query(InventoryReservation).filter(
+            InventoryReservation.sku == sku, InventoryReservation.status == "reserved"
+        ).update({InventoryReservation.status: "released"}, synchronize_session=False)
+        p = db.query(Product).filter(Product.sku == sku).first()
+        if not p:
+            p = Product(sku=sku, name="Contention bench", price_cents=0)
+            db.add(p)
+        p.stock = stock
+        p.reserved_qty = 0
+        db.commit()
+    finally:
+        db.close()
+    ledger.invalidate(sku)
+
+
+def run_reserve_bench(modes, workers, iterations, sku, qty, ttl):
+    """
+    In-process contention benchmark: `workers` threads hammer one SKU through
+    InventoryService.reserve in each reservation mode (SKU lock, CAS counter,
+    or flash-sale group commit).
+    """
+    from app.services.flash_sale import flash_sale
+
+    print(
+        f"Reserve bench: workers={workers}, iterations={iterations}, sku={sku}, qty={qty}"
+    )
+    for mode in modes:
+        _bench_reset(sku, workers * iterations * qty)
+        flash_sale.configure([sku] if mode == "flash" else [])
+        latencies, errors = [], []
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = [
+                ex.submit(
+                    _bench_worker, mode, sku, qty, ttl, iterations, latencies, errors
+                )
+                for _ in range(workers)
+            ]
+            for f in futures:
+                f.result()
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        print(
+            f"  {mode:>5}: ok={len(latencies)} errors={len(errors)} "
+            f"throughput={len(latencies) / elapsed:.1f}/s "
+            f"p50={pct(0.50):.1f}ms p99={pct(0.99):.1f}ms"
+        )
+        if errors:
+            print(f"        first error: {errors[0]}")
+    flash_sale.configure([])
+    _bench_reset(sku, 0)
+
+
+def run_idempotency_bench(modes, workers, keys):
+    """
+    In-process contention benchmark of IdempotencyRepository.begin: `workers`
+    threads claim the same `keys` fresh keys in shuffled order, so every key
+    has one owner and workers - 1 collisions. Modes are the begin strategies:
+    "returning" (INSERT ... ON CONFLICT DO NOTHING RETURNING) and "insert"
+    (INSERT, then SELECT; the path for databases without RETURNING).
+    """
+    import logging
+    import random
+
+    from sqlalchemy import event
+
+    from app.db import SessionLocal, engine, init_db
+    from app.repositories.idempotency_repo import IdempotencyRepository, log
+
+    init_db()
+    log.setLevel(logging.WARNING)
+    print(f"Idempotency begin bench: workers={workers}, keys={keys}")
+    for mode in modes:
+        names = [f"bench-idem-{mode}-{uuid4().hex}" for _ in range(keys)]
+        latencies, created, statements = [], [], []
+
+        def count(conn, cursor, statement, params, context, executemany):
+            statements.append(statement)
+
+        def worker():
+            db = SessionLocal()
+            try:
+                begin = getattr(IdempotencyRepository(db), f"_begin_{mode}")
+                order = names[:]
+                random.shuffle(order)
+                for key in order:
+                    t0 = time.perf_counter()
+                    _, ok = begin(key, "create_order")
+                    db.commit()
+                    latencies.append(time.perf_counter() - t0)
+                    created.append(ok)
+            finally:
+                db.close()
+
+        event.listen(engine, "before_cursor_execute", count)
+        start = time.perf_counter()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+                for f in [ex.submit(worker) for _ in range(workers)]:
+                    f.result()
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        print(
+            f"  {mode:>9}: calls={len(latencies)} owners={sum(created)} "
+            f"statements/call={len(statements) / len(latencies):.2f} "
+            f"throughput={len(latencies) / elapsed:.1f}/s "
+            f"p50={pct(0.50):.1f}ms p99={pct(0.99):.1f}ms"
+        )
+
+
+def run_checkout_bench(modes, iterations, sku, qty, payment_ms):
+    """
+    In-process checkout benchmark: sequential OrderService.create_order calls in
+    each CHECKOUT_TRANSACTION_MODE, reporting COMMITs per order (one fsync each
+    on SQLite, one WAL flush on Postgres) and latency. `payment_ms` replaces the
+    mock gateway delay so the database cost is not hidden behind it.
+    """
+    from sqlalchemy import event
+
+    from app.config import settings
+    from app.db import SessionLocal, engine
+    from app.services.order_service import OrderService
+
+    print(f"Checkout bench: iterations={iterations}, sku={sku}, qty={qty}")
+    commits = []
+
+    def count(conn):
+        commits.append(1)
+
+    event.listen(engine, "commit", count)
+    try:
+        for mode in modes:
+            _bench_reset(sku, iterations * qty)
+            settings.CHECKOUT_TRANSACTION_MODE = mode
+            latencies, errors = [], []
+            del commits[:]
+            for i in range(iterations):
+                db = SessionLocal()
+                try:
+                    svc = OrderService(db)
+                    svc.payment_adapter.adapter.delay_seconds = payment_ms / 1000.0
+                    t0 = time.perf_counter()
+                    svc.create_order(
+                        None,
+                        [{"sku": sku, "qty": qty}],
+                        {"token": "tok-bench"},
+                        idempotency_key=f"bench-{mode}-{uuid4().hex}",
+                    )
+                    latencies.append(time.perf_counter() - t0)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+                finally:
+                    db.close()
+            latencies.sort()
+            ok = max(1, len(latencies))
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+            print(
+                f"  {mode:>6}: ok={len(latencies)} errors={len(errors)} "
+                f"commits/order={len(commits) / ok:.1f} "
+                f"mean={sum(latencies) / ok * 1000:.1f}ms p50={p50:.1f}ms"
+            )
+            if errors:
+                print(f"        first error: {errors[0]}")
+    finally:
+        event.remove(engine, "commit", count)
+    _bench_reset(sku, 0)
+
+
+def run_checkout_load(routes, total, concurrency, threadpool, sku):
+    """
+    In-process load test of the sync (/api/orders) and async (/api/orders/checkout)
+    checkout routes with Starlette's threadpool capped at `threadpool` threads.
+    Every order spends the gateway delay in payment, so payments in flight =
+    throughput x delay (Little's law). On the sync route each one holds a thread,
+    capping it at `threadpool`; the async route awaits them off the threadpool.
+    """
+    import asyncio
+
+    import anyio.to_thread
+    import httpx
+
+    from app.config import settings
+    from app.main import app
+    from app.services.order_service import OrderService
+
+    # same two-commit transaction shape on both routes; only the gateway wait differs
+    settings.CHECKOUT_TRANSACTION_MODE = "unit"
+
+    async def one(client, path, sem, latencies, errors):
+        payload = {
+            "customer_id": None,
+            "items": [{"sku": sku, "qty": 1}],
+            "payment_method": {"token": "tok-load"},
+        }
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post(
+                path, json=payload, headers={"Idempotency-Key": f"load-{uuid4().hex}"}
+            )
+            if r.status_code == 200:
+                latencies.append(time.perf_counter() - t0)
+            else:
+                errors.append(f"{r.status_code}: {r.text[:200]}")
+
+    # the gateway delay OrderService configures on its adapters
+    delay = OrderService(None).async_payment_adapter.adapter.delay_seconds
+
+    async def main():
+        anyio.to_thread.current_default_thread_limiter().total_tokens = threadpool
+        async with httpx.AsyncClient(
+            app=app, base_url="http://load", timeout=60
+        ) as client:
+            for route in routes:
+                path = {"sync": "/api/orders", "async": "/api/orders/checkout"}[route]
+                _bench_reset(sku, total)
+                sem = asyncio.Semaphore(concurrency)
+                latencies, errors = [], []
+                start = time.perf_counter()
+                await asyncio.gather(
+                    *(one(client, path, sem, latencies, errors) for _ in range(total))
+                )
+                elapsed = time.perf_counter() - start
+                throughput = len(latencies) / elapsed
+                mean = sum(latencies) / max(1, len(latencies))
+                print(
+                    f"  {route:>5}: ok={len(latencies)} errors={len(errors)} "
+                    f"throughput={throughput:.1f}/s mean={mean * 1000:.0f}ms "
+                    f"payments_in_flight={throughput * delay:.1f}"
+                )
+                if errors:
+                    print(f"        first error: {errors[0]}")
+
+    print(
+        f"Checkout load: requests={total}, client concurrency={concurrency}, "
+        f"threadpool={threadpool}"
+    )
+    asyncio.run(main())
+    _bench_reset(sku, 0)
+
+
 def run_order_concurrent(workers, idempotency_key, payload):
     print(f"Running order test: workers={workers}, idempotency_key={idempotency_key}")
     with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
@@ -76,10 +362,68 @@ if __name__ == "__main__":
     o.add_argument("--sku", default="CHOC1234")
     o.add_argument("--qty", type=int, default=1)
 
+    b = sub.add_parser(
+        "bench", help="in-process lock vs CAS vs flash-sale reserve benchmark"
+    )
+    b.add_argument("--modes", default="lock,cas,flash")
+    b.add_argument("--sku", default="BENCH-RESERVE")
+    b.add_argument("--qty", type=int, default=1)
+    b.add_argument("--ttl", type=int, default=60)
+    b.add_argument("--workers", type=int, default=8)
+    b.add_argument("--iterations", type=int, default=25)
+
+    c = sub.add_parser(
+        "checkout", help="in-process staged vs unit checkout transaction benchmark"
+    )
+    c.add_argument("--modes", default="staged,unit")
+    c.add_argument("--sku", default="BENCH-CHECKOUT")
+    c.add_argument("--qty", type=int, default=1)
+    c.add_argument("--iterations", type=int, default=50)
+    c.add_argument("--payment-ms", type=int, default=0)
+
+    i = sub.add_parser(
+        "idempotency", help="in-process idempotency begin benchmark under contention"
+    )
+    i.add_argument("--modes", default="returning,insert")
+    i.add_argument("--workers", type=int, default=8)
+    i.add_argument("--keys", type=int, default=200)
+
+    l = sub.add_parser(
+        "checkout-load", help="in-process sync vs async checkout route load test"
+    )
+    l.add_argument("--routes", default="sync,async")
+    l.add_argument("--sku", default="BENCH-LOAD")
+    l.add_argument("--requests", type=int, default=64)
+    l.add_argument("--concurrency", type=int, default=32)
+    l.add_argument("--threadpool", type=int, default=4)
+
     args = parser.parse_args()
 
     if args.mode == "reserve":
         run_reserve_concurrent(args.workers, args.sku, args.qty, args.ttl)
+    elif args.mode == "bench":
+        run_reserve_bench(
+            args.modes.split(","),
+            args.workers,
+            args.iterations,
+            args.sku,
+            args.qty,
+            args.ttl,
+        )
+    elif args.mode == "checkout":
+        run_checkout_bench(
+            args.modes.split(","), args.iterations, args.sku, args.qty, args.payment_ms
+        )
+    elif args.mode == "idempotency":
+        run_idempotency_bench(args.modes.split(","), args.workers, args.keys)
+    elif args.mode == "checkout-load":
+        run_checkout_load(
+            args.routes.split(","),
+            args.requests,
+            args.concurrency,
+            args.threadpool,
+            args.sku,
+        )
     elif args.mode == "orders":
         # Build simple order payload
         payload = {
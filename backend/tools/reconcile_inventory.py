@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+
+from app.db import SessionLocal
+from app.services.reconciliation_service import ReconciliationService
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check products.stock / reserved_qty against reservations and restocks"
+    )
+    parser.add_argument("--batch", type=int, default=None, help="SKUs per page")
+    parser.add_argument("--report", default=None, help="JSONL report path")
+    parser.add_argument(
+        "--rebaseline",
+        action="store_true",
+        help="reset every SKU's checkpoint to its current state (after fixing drift)",
+    )
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        summary = ReconciliationService(db, batch_size=args.batch).run(
+            rebaseline=args.rebaseline, report_path=args.report
+        )
+    finally:
+        db.close()
+    print(json.dumps(summary, indent=2))
+    sys.exit(1 if summary["discrepancies"] else 0)
+
+
+if __name__ == "__main__":
+    main()